@@ -106,21 +106,19 @@ class AIFselector():
         print "aorta mask voxels: ", numVoxels
         return mask
 
-    def getAIFcurveAndMeasures(self):
+    def getAIFcurveAndMeasures(self, returnCurves=False):
         """ Return the value of the AIF at every time point and measures from the data.
 
+        The AIF is computed in the precision of the maps, from the curves of the AIF voxels gathered in one go.
+        :param returnCurves: bool
+        Also return the curve of each AIF voxel and the standard deviation over the voxels at every time point.
         :return: np.array [np.array(double), inp.array[int, int, double, double, double]]
-        AIF, [numBaseline, numVoxels, aveBaseline, maxDiff, maxVal]
+        AIF, [numBaseline, numVoxels, aveBaseline, maxDiff, maxVal], then if returnCurves the curves
+        [numVoxels, nt], in the type of the dynamics, and the standard deviation.
         """
-        dyn = self._mapMaker.dynamics
-        nzt, ny, nx = dyn.shape
-        nz = self._mapMaker.getNz()
-        nt = nzt / nz
-
-        aif = np.zeros([nt])
-        for i in range(0, nt):
-            vol = dyn[i:nzt:nt, :, :]
-            aif[i] = np.mean(vol[self._aifMask])
+        precision = self._mapMaker.precision
+        curves = self._getAIFvoxelCurves()
+        aif = np.mean(curves, axis=0, dtype=precision)
 
         nBaseline = self._mapMaker.numBaseline
         aveBaseline = np.mean(aif[0:nBaseline])
@@ -128,7 +126,10 @@ class AIFselector():
         maxVal = np.amax(aif)
 
         # print aif[0:15], np.amax(aif), np.argmax(aif)
-        return [aif, np.array([nBaseline, np.count_nonzero(self._aifMask), aveBaseline, maxDiffBaseline, maxVal])]
+        results = [aif, np.array([nBaseline, len(curves), aveBaseline, maxDiffBaseline, maxVal])]
+        if returnCurves:
+            results += [curves, np.std(curves, axis=0, dtype=precision)]
+        return results
 
 
     def pickAIFpatch(self):
@@ -324,6 +325,29 @@ class AIFselector():
 
         return mask
 
+    def _getAIFvoxelCurves(self):
+        """ Gather the curve of every voxel in the AIF mask.
+
+        The mask is converted to flat voxel indices once and the curves taken from the [nz, nt, ny, nx] view of the
+        dynamics with a single index, or a slice at a time if the dynamics are read on demand.
+        :return: np.array
+        [numVoxels, nt], in the type of the dynamics.
+        """
+        nz, ny, nx = self._mapMaker.dims
+        nt = self._mapMaker.getNt()
+        slices, pixels = np.divmod(np.flatnonzero(self._aifMask), ny*nx)
+        dyn4D = self._mapMaker.dynamics4D
+        if dyn4D is not None:
+            return dyn4D.reshape(nz, nt, ny*nx)[slices, :, pixels]
+
+        curves = np.zeros([len(pixels), nt], self._mapMaker.dynamics.dtype)
+        # the indices are in slice order, so the voxels of each slice are together
+        starts = np.searchsorted(slices, np.arange(nz + 1))
+        for z in np.unique(slices):
+            dyn = np.asarray(self._mapMaker.dynamics[z*nt:(z + 1)*nt]).reshape(nt, ny*nx)
+            curves[starts[z]:starts[z + 1]] = dyn[:, pixels[starts[z]:starts[z + 1]]].T
+        return curves
+
     def _logExtractionParameters(self):
         self._logger.info('kernel_nx: %i, kernel_ny: %i' % (self.extractionParams.kernel_nx, self.extractionParams.kernel_ny))
         self._logger.info('Voxel selection. minFraction: %.2f, maxStddev: %.2f' % (self.extractionParams.minFraction, self.extractionParams.maxStdev))
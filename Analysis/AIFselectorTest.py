@@ -0,0 +1,53 @@
+__author__ = 'medabana'
+
+import unittest
+
+import numpy as np
+
+from Analysis.AIFselector import AIFselector
+from Analysis.MapGenerator import MapGenerator
+from Analysis.SyntheticDynamics import SlicedSeries, makeDynamics
+
+
+class AIFselectorTest(unittest.TestCase):
+    def test_aifCurves(self):
+        dyn = makeDynamics(4, 10, 6, 6, 2)
+        mask = np.zeros([4, 6, 6], np.bool)
+        mask[1, 2:4, 1:5] = True
+        mask[3, 0, 5] = True
+        expected = np.concatenate([dyn.reshape(4, 10, 6, 6)[z][:, mask[z]].T for z in range(0, 4)])
+        for source in (dyn, SlicedSeries(dyn)):
+            mapGenerator = MapGenerator(np.float64)
+            mapGenerator.setDynamics(source, 10)
+            mapGenerator.numBaseline = 2
+            selector = AIFselector(mapGenerator)
+            selector._aifMask = mask
+            aif, measures, curves, std = selector.getAIFcurveAndMeasures(returnCurves=True)
+
+            np.testing.assert_array_equal(expected, curves)
+            self.assertEqual(dyn.dtype, curves.dtype)
+            np.testing.assert_allclose(expected.mean(0), aif)
+            np.testing.assert_allclose(expected.std(0), std)
+            self.assertEqual(9, measures[1])
+
+    def test_aifPrecision(self):
+        dyn = makeDynamics(3, 10, 6, 6, 2)
+        mask = np.zeros([3, 6, 6], np.bool)
+        mask[1, 2:4, 1:5] = True
+        results = []
+        for precision in (np.float64, np.float32):
+            mapGenerator = MapGenerator(precision)
+            mapGenerator.setDynamics(dyn, 10)
+            mapGenerator.numBaseline = 2
+            selector = AIFselector(mapGenerator)
+            selector._aifMask = mask
+            results.append(selector.getAIFcurveAndMeasures())
+
+        aif64, aif32 = results[0][0], results[1][0]
+        self.assertEqual(np.float32, aif32.dtype)
+        np.testing.assert_allclose(dyn.reshape(3, 10, 6, 6)[1, :, 2:4, 1:5].mean(axis=(1, 2)), aif64)
+        np.testing.assert_allclose(aif64, aif32, rtol=1e-6)
+        np.testing.assert_allclose(results[0][1], results[1][1], rtol=1e-6)
+
+if __name__ == "__main__":
+    unittest.main()
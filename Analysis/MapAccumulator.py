@@ -0,0 +1,73 @@
+__author__ = 'medabana'
+
+import numpy as np
+
+
+class MapAccumulator(object):
+    """ Reduces the later images of a dynamic series as they are read, so the maps are ready when the series is.
+
+    For each voxel it keeps the maximum from firstTime onwards, the first time it is reached and the minimum. The
+    images can arrive in any order. MapGenerator.setDynamics takes these as the last entry of its time tables and
+    only has to go through the first firstTime images of each slice itself.
+    """
+    def __init__(self, nt, firstTime):
+        """
+        :param nt: int
+        Number of timepoints.
+        :param firstTime: int
+        The first timepoint reduced, the number of baseline images the time tables cover.
+        """
+        self.firstTime = firstTime
+        self.peaks = None
+        self.peakTimes = None
+        self.troughs = None
+        self._nt = nt
+        self._numImages = None
+        self._isPeak = None
+        self._isTie = None
+
+    def addImage(self, index, seriesData):
+        """ Reduce an image that has been read into the series array, if it is from firstTime onwards.
+
+        Can be passed as onImageRead to PatientDirectoryReader.getImageData.
+        :param index: int
+        Index of the image in the [nt x nz, ny, nx] series array. Images of an incomplete last slice are ignored.
+        :param seriesData: np.array
+        The series array.
+        :return:
+        """
+        z, t = divmod(index, self._nt)
+        if t < self.firstTime or z >= seriesData.shape[0] // self._nt:
+            return
+        if self.peaks is None:
+            self._allocate(seriesData)
+        image = seriesData[index]
+        peak, peakTime, trough = self.peaks[z], self.peakTimes[z], self.troughs[z]
+        if self._numImages[z] == 0:
+            peak[...] = image
+            peakTime[...] = t
+            trough[...] = image
+        else:
+            np.greater(image, peak, out=self._isPeak)
+            # the images are read in any order, so an earlier time with the same value also becomes the peak
+            np.equal(image, peak, out=self._isTie)
+            np.logical_and(self._isTie, peakTime > t, out=self._isTie)
+            np.logical_or(self._isPeak, self._isTie, out=self._isPeak)
+            peakTime[self._isPeak] = t
+            np.maximum(peak, image, out=peak)
+            np.minimum(trough, image, out=trough)
+        self._numImages[z] += 1
+
+    def isComplete(self):
+        """ Return True once every image from firstTime onwards has been added. """
+        return self._numImages is not None and (self._numImages == self._nt - self.firstTime).all()
+
+    def _allocate(self, seriesData):
+        """ Allocate the reductions for the series array. """
+        shape = [seriesData.shape[0] // self._nt] + list(seriesData.shape[1:])
+        self.peaks = np.zeros(shape, seriesData.dtype)
+        self.peakTimes = np.zeros(shape, np.uint16)
+        self.troughs = np.zeros(shape, seriesData.dtype)
+        self._numImages = np.zeros(shape[0], np.int)
+        self._isPeak = np.zeros(shape[1:], np.bool)
+        self._isTie = np.zeros(shape[1:], np.bool)
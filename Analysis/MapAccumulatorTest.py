@@ -0,0 +1,51 @@
+__author__ = 'medabana'
+
+import unittest
+
+import numpy as np
+
+from Analysis.MapGenerator import MapGenerator
+
+
+class MapAccumulatorTest(unittest.TestCase):
+    def test_addImagesInAnyOrder(self):
+        for nz, nt in [(3, 6), (2, 20)]:
+            random = np.random.RandomState(nt)
+            # few distinct values, so peaks are often reached more than once
+            dyn = random.randint(0, 4, [nz*nt, 4, 5]).astype(np.uint16)
+            mapGenerator = MapGenerator()
+            accumulator = mapGenerator.createAccumulator(nt)
+            self.assertFalse(accumulator.isComplete())
+            for index in random.permutation(nz*nt):
+                accumulator.addImage(index, dyn)
+            self.assertTrue(accumulator.isComplete())
+
+            # the images the accumulator reduced are not read again
+            firstImages = dyn.reshape(nz, nt, 4, 5).copy()
+            firstImages[:, accumulator.firstTime:] = 0
+            mapGenerator.setDynamics(firstImages.reshape(nz*nt, 4, 5), nt, accumulator)
+            for numBaseline in [accumulator.firstTime // 2, 1, accumulator.firstTime]:
+                expected = MapGenerator()
+                expected.setDynamics(dyn, nt)
+                expected.numBaseline = numBaseline
+                expected.computeAllMaps()
+                mapGenerator.numBaseline = numBaseline
+                mapGenerator.computeAllMaps()
+                for name in ['baselineMap', 'maximumIntensityMap', 'timeToPeakMap', 'minimumIntensityMap']:
+                    np.testing.assert_array_equal(getattr(expected, name)(), getattr(mapGenerator, name)(), name)
+                # the tables are only made once the number of baseline images changes
+                self.assertEqual(numBaseline == accumulator.firstTime // 2, mapGenerator._timeTables is None)
+
+    def test_incomplete(self):
+        nz, nt = 2, 6
+        dyn = np.arange(nz*nt*4, dtype=np.uint16).reshape(nz*nt, 2, 2)
+        mapGenerator = MapGenerator()
+        accumulator = mapGenerator.createAccumulator(nt)
+        for index in range(nz*nt - 1):
+            accumulator.addImage(index, dyn)
+        self.assertFalse(accumulator.isComplete())
+        mapGenerator.setDynamics(dyn, nt, accumulator)
+        self.assertIsNone(mapGenerator._accumulator)
+
+if __name__ == "__main__":
+    unittest.main()
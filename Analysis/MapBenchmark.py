@@ -0,0 +1,129 @@
+__author__ = 'medabana'
+
+import multiprocessing
+import sys
+import timeit
+
+import numpy as np
+
+from Analysis.MapGenerator import MapGenerator
+
+
+def loopedMaps(dyn, nt, numBaseline, precision=np.float32):
+    """ Compute the baseline, maximum intensity, time to peak and minimum intensity maps a slice at a time, as
+    MapGenerator used to, for comparison.
+
+    :return: list of np.array
+    """
+    nzt, ny, nx = dyn.shape
+    nz = nzt // nt
+    maps = [np.zeros([nz, ny, nx], precision) for i in range(0, 4)]
+    for i in range(0, nz):
+        startIndex = i*nt
+        baseMap = np.mean(dyn[startIndex:(startIndex+numBaseline), :, :], axis=0, dtype=precision)
+        baseMapAllTime = np.tile(baseMap, (nt-numBaseline, 1, 1))
+        slice = np.subtract(dyn[startIndex+numBaseline:(startIndex+nt), :, :], baseMapAllTime, dtype=precision)
+        slice = slice.clip(min=0)
+        maps[0][i] = baseMap
+        maps[1][i] = np.amax(slice, axis=0)
+        maps[2][i] = np.argmax(slice, axis=0)
+        maps[3][i] = np.amin(dyn[startIndex+numBaseline:(startIndex+nt), :, :], axis=0)
+    return maps
+
+
+def mapGeneratorMaps(dyn, nt, numBaseline, precision=np.float32, numWorkers=1):
+    """ Compute the same maps with MapGenerator.
+
+    :return: list of np.array
+    """
+    mapGenerator = MapGenerator(precision)
+    mapGenerator.setWorkers(numWorkers)
+    mapGenerator.setDynamics(dyn, nt)
+    mapGenerator.numBaseline = numBaseline
+    maps = [mapGenerator.baselineMap(), mapGenerator.maximumIntensityMap(), mapGenerator.timeToPeakMap(),
+            mapGenerator.minimumIntensityMap()]
+    mapGenerator.setWorkers(1)
+    return maps
+
+
+def makeDynamics(nz, nt, ny, nx, numBaseline):
+    """ Return a uint16 series with noisy baseline images and enhancement afterwards.
+
+    The series is made a slice at a time so that nothing larger than it is allocated.
+    """
+    random = np.random.RandomState(0)
+    dyn = np.zeros([nz*nt, ny, nx], np.uint16)
+    for i in range(0, nz):
+        slice = dyn[i*nt:(i+1)*nt]
+        slice[...] = random.randint(900, 1100, [nt, ny, nx], np.uint16)
+        slice[numBaseline:] += random.randint(0, 3000, [nt - numBaseline, ny, nx], np.uint16)
+    return dyn
+
+
+def peakMemory(mapFunction, dyn, nt, numBaseline):
+    """ Return the most memory in MB taken while computing the maps, over that taken before, including the maps.
+
+    The maps are computed in a child process so that memory freed earlier is not reused. Uses the peak resident set
+    size, which Linux resets when 5 is written to /proc/self/clear_refs.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_putPeakMemory, args=(queue, mapFunction, dyn, nt, numBaseline))
+    process.start()
+    peak = queue.get()
+    process.join()
+    return peak
+
+
+def timeMaps(mapFunction, dyn, nt, numBaseline, repeats=3):
+    """ Return the best time in seconds taken to compute the maps. """
+    timer = timeit.Timer(lambda: mapFunction(dyn, nt, numBaseline))
+    return min(timer.repeat(repeats, 1))
+
+
+def main(argv):
+    """ Compare the time and, on Linux, the peak memory taken computing the maps a slice at a time and with
+    MapGenerator, then time MapGenerator with 2, 4 and so on workers up to the number of cores.
+
+    Usage: python -m Analysis.MapBenchmark [nz nt ny nx]
+    The series is 40 slices of 60 timepoints of 256x256 images if no size is given.
+    """
+    nz, nt, ny, nx = [int(arg) for arg in argv[1:5]] if len(argv) > 4 else [40, 60, 256, 256]
+    numBaseline = 3
+    dyn = makeDynamics(nz, nt, ny, nx, numBaseline)
+    print 'series:        %i x %i x %i x %i, %.0f MB' % (nz, nt, ny, nx, dyn.nbytes / 1024.0**2)
+    # memory is measured first, while only the series has been allocated
+    if sys.platform.startswith('linux'):
+        print 'maps:          %.0f MB' % (4 * nz * ny * nx * np.dtype(np.float32).itemsize / 1024.0**2)
+        print 'slice loop peak memory:    %.0f MB' % peakMemory(loopedMaps, dyn, nt, numBaseline)
+        print 'MapGenerator peak memory:  %.0f MB' % peakMemory(mapGeneratorMaps, dyn, nt, numBaseline)
+    for expected, map in zip(loopedMaps(dyn, nt, numBaseline), mapGeneratorMaps(dyn, nt, numBaseline)):
+        np.testing.assert_allclose(expected, map, rtol=1e-6)
+    loopedTime = timeMaps(loopedMaps, dyn, nt, numBaseline)
+    mapGeneratorTime = timeMaps(mapGeneratorMaps, dyn, nt, numBaseline)
+    print 'slice loop:    %.3f s' % loopedTime
+    print 'MapGenerator:  %.3f s' % mapGeneratorTime
+    print 'speed up:      %.1fx' % (loopedTime / mapGeneratorTime)
+    numWorkers = 2
+    while numWorkers <= multiprocessing.cpu_count():
+        workersTime = timeMaps(lambda *args: mapGeneratorMaps(*args, numWorkers=numWorkers), dyn, nt, numBaseline)
+        print '%2i workers:    %.3f s, %.1fx' % (numWorkers, workersTime, mapGeneratorTime / workersTime)
+        numWorkers *= 2
+
+def _putPeakMemory(queue, mapFunction, dyn, nt, numBaseline):
+    """ Compute the maps and put the peak memory taken on the queue. Runs in the child process. """
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5')
+    before = _readMemoryStatus('VmRSS')
+    maps = mapFunction(dyn, nt, numBaseline)
+    queue.put((_readMemoryStatus('VmHWM') - before) / 1024.0)
+
+
+def _readMemoryStatus(key):
+    """ Return a memory size in kB from /proc/self/status, such as VmRSS. """
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith(key + ':'):
+                return int(line.split()[1])
+
+if __name__ == "__main__":
+    main(sys.argv)
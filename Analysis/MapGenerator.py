@@ -2,11 +2,52 @@ __author__ = 'medabana'
 
 import logging
 import numpy as np
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
-class MapGenerator():
-    " Generates Maps from the dynamic series"
-    def __init__(self):
+from Analysis.MapAccumulator import MapAccumulator
+
+# Floating point types the maps can be computed in.
+PRECISIONS = (np.float32, np.float64)
+# Bytes of map accumulators worked on together, small enough to stay in cache while the timepoints stream past.
+SLAB_BYTES = 1 << 21
+# Largest number of baseline images the time tables cover, so the maps can be found again without reading the
+# dynamics while the number of baseline images is changed.
+BASELINE_RANGE = 16
+# Number of baseline image counts outside the time tables whose maps are kept.
+MAX_CACHED_BASELINES = 8
+
+
+class MapGenerator(object):
+    """ Generates Maps from the dynamic series
+
+    The dynamics are kept in the type they were read in, usually uint16, and the maps are computed in the precision
+    set, float32 unless float64 is asked for. The maps are reductions along the time axis of dynamics4D, a
+    [nz, nt, ny, nx] view of the dynamics, and are all computed together by computeAllMaps, in slabs of slices
+    which can be shared between worker threads. The dynamics can also be a memory map, or a series read on demand
+    such as LazySeries, in which case only a slab at a time is read, within the memory budget set.
+
+    Once the number of baseline images has been changed, tables along the time axis of the sums of the first images
+    and of the maximum, its time and the minimum from each image onwards are made in one more pass, and maps for up
+    to BASELINE_RANGE baseline images are taken from them without reading the dynamics. These maps are found again
+    from the tables when needed rather than kept, only maps for numbers of baseline images outside the tables are
+    kept.
+    If the series was passed through a MapAccumulator as it was read, the maps and the tables are made reading only
+    the images before BASELINE_RANGE, the later images having already been reduced by the accumulator.
+    """
+    def __init__(self, precision=np.float32):
+        """
+        :param precision: np.dtype
+        np.float32 or np.float64.
+        """
+        self.precision = None
+        self._numBaseline = None
+        self._numWorkers = 1
+        self._pool = None
+        self._maxBytes = None
         self.reset()
+        self.setPrecision(precision)
         self._logger = logging.getLogger(__name__)
 
     def baselineMap(self):
@@ -17,19 +58,57 @@ class MapGenerator():
         if self._baselineMap is not None:
             return self._baselineMap
 
+        self.computeAllMaps()
+        return self._baselineMap
+
+    def computeAllMaps(self):
+        """ Compute the baseline, maximum intensity, time to peak, minimum intensity and zero minimum maps in one pass.
+
+        The timepoints of a slab of slices are streamed through running sum, maximum, time of maximum and minimum
+        accumulators, so the dynamics are read once. The maximum intensity is the maximum after the baseline less the
+        baseline, or 0, and the time to peak is the first timepoint after the baseline at which it is reached.
+        With more than one worker the slabs are shared between threads, which run together as NumPy releases the
+        GIL in its loops. Maps already kept for the number of baseline images are used as they are, and maps for a
+        changed number are taken from the time tables when it is in their range.
+        :return:
+        """
         if self.dynamics is None:
             print "No data"
             return
 
-        self._logger.info('generating baseline map')
-        nz, ny, nx = self.dims
-        map = np.zeros([nz, ny, nx])
-        for i in range(0, nz):
-            startIndex = i*self._nt
-            map[i, :, :] = np.mean(self.dynamics[startIndex:(startIndex+self.numBaseline), :, :], axis=0)
+        maps = self._mapsForNumBaseline.get(self.numBaseline)
+        if maps is None:
+            if self._timeTables is None and self._mapsForNumBaseline and self.numBaseline <= self._getTableRange():
+                # the number of baseline images has been changed, as when stepping through it
+                self._logger.info('generating time tables')
+                self._timeTables = self._computeTimeTables(self._accumulator)
+                for numBaseline in list(self._mapsForNumBaseline):
+                    if numBaseline < len(self._timeTables[0]):
+                        del self._mapsForNumBaseline[numBaseline]
+            if self._timeTables is not None and self.numBaseline < len(self._timeTables[0]):
+                maps = self._getMapsFromTimeTables()
+            else:
+                self._logger.info('generating maps')
+                maps = self._streamMaps()
+                self._mapsForNumBaseline[self.numBaseline] = maps
+                while len(self._mapsForNumBaseline) > MAX_CACHED_BASELINES:
+                    self._mapsForNumBaseline.popitem(last=False)
+        self._setCurrentMaps(maps)
 
-        self._baselineMap = map
-        return map
+    def createAccumulator(self, nt):
+        """ Return an accumulator to pass the images of a series to as they are read, and then to setDynamics.
+
+        :param nt: int
+        number of timepoints
+        :return: MapAccumulator
+        """
+        return MapAccumulator(nt, min(BASELINE_RANGE, nt - 1))
+
+    def getNt(self):
+        """ Returns the number of timepoints.
+        :return: int
+        """
+        return self._nt
 
     def getNz(self):
         """ Returns the number of slices.
@@ -37,16 +116,49 @@ class MapGenerator():
         """
         return self.dims[0]
 
+    def getRoiCurves(self, labels):
+        """ Return the mean curve, number of voxels and variance at each time point of many ROIs, in one pass over the
+        dynamics.
+
+        The voxels of the ROIs are gathered a slab of slices at a time and summed into each ROI with np.bincount.
+        :param labels: np.array or list of np.array
+        [nz, ny, nx] integer label volume, 0 for the background and 1 to nLabels for the ROIs, or a list of masks,
+        which may overlap.
+        :return: [np.array, np.array, np.array]
+        means [nLabels, nt] in the precision of the maps, counts [nLabels] and variances [nLabels, nt].
+        """
+        if isinstance(labels, np.ndarray):
+            numLabels = max(0, int(labels.max())) if labels.size else 0
+            voxels = np.flatnonzero(labels > 0)
+            labelIndices = labels.ravel()[voxels].astype(np.intp) - 1
+        else:
+            numLabels = len(labels)
+            voxelsForMask = [np.flatnonzero(mask) for mask in labels]
+            voxels = np.concatenate([np.zeros(0, np.intp)] + voxelsForMask)
+            labelIndices = np.repeat(np.arange(numLabels), [len(maskVoxels) for maskVoxels in voxelsForMask])
+        # in voxel order, so the voxels of each slab are together
+        order = np.argsort(voxels, kind='mergesort')
+        voxels, labelIndices = voxels[order], labelIndices[order]
+
+        counts = np.bincount(labelIndices, minlength=numLabels)
+        sums = np.zeros([numLabels, self._nt])
+        sumSquares = np.zeros([numLabels, self._nt])
+        lock = threading.Lock()
+        self._forEachSlab(lambda start, stop, *sums: self._accumulateRoiCurves(start, stop, voxels, labelIndices,
+                                                                               lock, *sums),
+                          [sums, sumSquares], 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = sums / counts[:, np.newaxis]
+            variances = np.maximum(sumSquares / counts[:, np.newaxis] - means**2, 0)
+        return [means.astype(self.precision), counts, variances.astype(self.precision)]
+
     def getZeroMinIntensityMap(self):
         """ Return the mask of voxels who have a zero minimum signal intensity.
         :return: np.array bool
         Mask.
         """
-        if self._zeroMinIntensityMap == None:
-            self.minimumIntensityMap()
-            nz, ny, nx = self.dims
-            self._zeroMinIntensityMap = np.zeros([nz, nx, ny])
-            self._zeroMinIntensityMap[self._minIntMap == 0.0] = 1
+        if self._zeroMinIntensityMap is None:
+            self.computeAllMaps()
         return self._zeroMinIntensityMap
 
     def isNumBaselineSet(self):
@@ -64,52 +176,107 @@ class MapGenerator():
         if self._maxIntMap is not None:
             return self._maxIntMap
 
-        self._generateMaxMaps()
+        self.computeAllMaps()
         return self._maxIntMap
 
     def minimumIntensityMap(self):
-        """ Generate the minimum intensity maps from the time series.
-        :return: np.array double
+        """ Generate the minimum intensity map of the post-contrast images if required and return the map.
+        :return: np.array
+        The minimum intensity map
         """
-        if self.dynamics is None:
-            print "No data"
-            return
+        if self._minIntMap is None:
+            self.computeAllMaps()
+        return self._minIntMap
 
-        if self._minIntMap == None:
-            nz, ny, nx = self.dims
-            self._minIntMap = np.zeros([nz, nx, ny])
-            for i in range(0, nz):
-                startIndex = i*self._nt
-                slice = self.dynamics[startIndex+self.numBaseline:(startIndex+self._nt), :, :]
-                self._minIntMap[i, :, :] = np.amin(slice, axis=0)
+    @property
+    def numBaseline(self):
+        """ The number of baseline (pre-contrast) timepoints. Setting it changes the maps to those for the new number,
+        which are computed when next asked for if they are not kept.
+        """
+        return self._numBaseline
+
+    @numBaseline.setter
+    def numBaseline(self, numBaseline):
+        self._numBaseline = numBaseline
+        self.scoreMap = None
+        self._setCurrentMaps()
 
     def reset(self):
         """ Reset the state of the object.
         :return:
         """
         self.dynamics = None
+        self.dynamics4D = None
         self.dims = None
         self._nt = None
-        self._maxIntMap = None
-        self._timeToPeakMap = None
-        self._baselineMap = None
+        self._accumulator = None
+        self._clearMaps()
         self.numBaseline = None
-        self.scoreMap = None
-        self._minIntMap = None
-        self._zeroMinIntensityMap = None
 
-    def setDynamics(self, dyn, nt):
+    def setDynamics(self, dyn, nt, accumulator=None):
         """ Sets the dynamic images.
         :param dyn: np.array
-        3D data array
+        3D data array, kept in the type it was read in, with the timepoints of each slice together. Can be a
+        np.memmap, or anything with shape and dtype that returns an array when sliced, such as LazySeries.
         :param nt: int
         number of timepoints
+        :param accumulator: MapAccumulator
+        Optional accumulator from createAccumulator that every image of dyn was added to as it was read. The maps,
+        and the time tables when they are needed, are then made from the first images and the accumulator, without
+        reading the rest of the dynamics. Only the accumulator's reductions are kept, nothing more is computed here.
         :return:
         """
         self.dynamics = dyn
         [nzt, ny, nx] = dyn.shape
-        self.dims = [nzt / nt, ny, nx]
+        nz = nzt // nt
+        self.dims = [nz, ny, nx]
         self._nt = nt
+        self._clearMaps()
+        if isinstance(dyn, np.ndarray):
+            # a view rather than a copy, as long as the dynamics are contiguous. The images of an incomplete last
+            # slice, as in a series still being acquired, are left out.
+            self.dynamics4D = dyn[:nz*nt].reshape(nz, nt, ny, nx)
+        else:
+            # dynamics read on demand are read a slab at a time
+            self.dynamics4D = None
+        self._accumulator = accumulator if accumulator is not None and accumulator.isComplete() else None
+
+    def setMemoryBudget(self, maxBytes):
+        """ Set the most memory taken by the slabs of dynamics and their accumulators while the maps are computed.
+
+        Slabs are made smaller, down to a single slice, to keep within the budget. This is in addition to the maps
+        themselves. The time tables are also kept within the budget by covering fewer baseline images.
+        :param maxBytes: int
+        None for no limit beyond the slab size that keeps the accumulators in cache.
+        :return:
+        """
+        self._maxBytes = maxBytes
+
+    def setPrecision(self, precision):
+        """ Set the floating point type the maps are computed in, clearing any maps computed in another.
+
+        :param precision: np.dtype
+        np.float32 or np.float64.
+        :return:
+        """
+        precision = np.dtype(precision).type
+        if precision not in PRECISIONS:
+            raise ValueError('maps can only be computed in float32 or float64, not %s' % np.dtype(precision).name)
+        if precision is not self.precision:
+            self._clearMaps()
+        self.precision = precision
+
+    def setWorkers(self, numWorkers):
+        """ Set the number of threads the maps are computed in.
+
+        :param numWorkers: int
+        Number of threads. 1 computes the maps in the calling thread.
+        :return:
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._numWorkers = numWorkers
 
     def timeToPeakMap(self):
         """ Generate the time to peak map, if required and return the map.
@@ -119,26 +286,272 @@ class MapGenerator():
         if self._timeToPeakMap is not None:
             return self._timeToPeakMap
 
-        self._generateMaxMaps()
+        self.computeAllMaps()
         return self._timeToPeakMap
 
-    def _generateMaxMaps(self):
-        """ Generate the time to peak and maximum intensity maps from the time series.
+    def _accumulateRoiCurves(self, start, stop, voxels, labelIndices, lock, sums, sumSquares):
+        """ Add the voxels of slices start to stop to the sums and sums of squares of their ROIs.
+
+        :param start: int
+        First slice.
+        :param stop: int
+        After the last slice.
+        :param voxels: np.array
+        Flat indices of the voxels of the ROIs, in order.
+        :param labelIndices: np.array
+        ROI of each voxel.
+        :param lock: threading.Lock
+        Held while adding to the sums, which are shared between the workers.
+        :param sums: np.array
+        [nLabels, nt]
+        :param sumSquares: np.array
+        [nLabels, nt]
         :return:
         """
-        if self.dynamics is None:
-            print "No data"
+        nz, ny, nx = self.dims
+        first, last = np.searchsorted(voxels, [start*ny*nx, stop*ny*nx])
+        if first == last:
             return
+        slices, pixels = np.divmod(voxels[first:last] - start*ny*nx, ny*nx)
+        curves = self._readSlab(start, stop).reshape(stop - start, self._nt, ny*nx)[slices, :, pixels]
+        # one bin for each ROI and time point
+        bins = (labelIndices[first:last, np.newaxis] * self._nt + np.arange(self._nt)).ravel()
+        curves = curves.ravel().astype(np.float64)
+        slabSums = np.bincount(bins, curves, sums.size).reshape(sums.shape)
+        slabSumSquares = np.bincount(bins, curves*curves, sums.size).reshape(sums.shape)
+        with lock:
+            sums += slabSums
+            sumSquares += slabSumSquares
+
+    def _accumulateSlab(self, start, stop, baseMap, maxIntMap, timeToPeakMap, minIntMap):
+        """ Stream the timepoints of slices start to stop into the maps.
+
+        :param start: int
+        :param stop: int
+        :param baseMap: np.array
+        :param maxIntMap: np.array
+        :param timeToPeakMap: np.array
+        :param minIntMap: np.array
+        :return:
+        """
+        numBaseline = self.numBaseline
+        slab = self._readSlab(start, stop)
+        baseMap = baseMap[start:stop]
+        maxIntMap = maxIntMap[start:stop]
+        timeToPeakMap = timeToPeakMap[start:stop]
+        minIntMap = minIntMap[start:stop]
+        for t in range(0, numBaseline):
+            np.add(baseMap, slab[:, t], out=baseMap)
+        baseMap /= numBaseline
+
+        # images from the accumulator's first time onwards have already been reduced by it
+        accumulator = self._accumulator
+        if accumulator is not None and numBaseline > accumulator.firstTime:
+            accumulator = None
+        endTime = accumulator.firstTime if accumulator is not None else self._nt
+        # the maximum and minimum are kept in the type of the dynamics, which they are exact in
+        if numBaseline < endTime:
+            peak = slab[:, numBaseline].copy()
+            trough = peak.copy()
+        else:
+            peak = accumulator.peaks[start:stop].copy()
+            trough = accumulator.troughs[start:stop].copy()
+            timeToPeakMap[...] = accumulator.peakTimes[start:stop] - numBaseline
+        isPeak = np.zeros(peak.shape, np.bool)
+        for t in range(numBaseline + 1, endTime):
+            frame = slab[:, t]
+            # only a strictly greater value moves the peak, so it is the first time the maximum is reached
+            np.greater(frame, peak, out=isPeak)
+            timeToPeakMap[isPeak] = t - numBaseline
+            np.maximum(peak, frame, out=peak)
+            np.minimum(trough, frame, out=trough)
+        if accumulator is not None and numBaseline < endTime:
+            np.greater(accumulator.peaks[start:stop], peak, out=isPeak)
+            timeToPeakMap[isPeak] = accumulator.peakTimes[start:stop][isPeak] - numBaseline
+            np.maximum(peak, accumulator.peaks[start:stop], out=peak)
+            np.minimum(trough, accumulator.troughs[start:stop], out=trough)
+        minIntMap[...] = trough
+
+        np.subtract(peak, baseMap, out=maxIntMap)
+        # no enhancement after the subtraction, so each time has the same value of 0
+        np.less_equal(maxIntMap, 0, out=isPeak)
+        timeToPeakMap[isPeak] = 0
+        maxIntMap.clip(min=0, out=maxIntMap)
+
+    def _accumulateTimeTables(self, start, stop, sums, peaks, peakTimes, troughs, hasLastEntries=False):
+        """ Stream the timepoints of slices start to stop into the time tables, the first of each for 0 baseline
+        images.
+
+        :param start: int
+        :param stop: int
+        :param sums: np.array
+        Sums of the images before each time.
+        :param peaks: np.array
+        Maximum from each time onwards.
+        :param peakTimes: np.array
+        First time the maximum from each time onwards is reached.
+        :param troughs: np.array
+        Minimum from each time onwards.
+        :param hasLastEntries: bool
+        True if the last entries of the peaks, peak times and troughs are already filled, by a MapAccumulator.
+        :return:
+        """
+        slab = self._readSlab(start, stop)
+        sums, peaks, peakTimes, troughs = [table[:, start:stop] for table in (sums, peaks, peakTimes, troughs)]
+        tableRange = len(sums) - 1
+        for t in range(0, tableRange):
+            np.add(sums[t], slab[:, t], out=sums[t + 1])
+
+        # the images after the table range are reduced as for a single map
+        isPeak = np.zeros(peaks.shape[1:], np.bool)
+        if not hasLastEntries:
+            peaks[tableRange] = slab[:, tableRange]
+            peakTimes[tableRange] = tableRange
+            troughs[tableRange] = slab[:, tableRange]
+        for t in range(tableRange + 1, self._nt if not hasLastEntries else 0):
+            frame = slab[:, t]
+            np.greater(frame, peaks[tableRange], out=isPeak)
+            peakTimes[tableRange][isPeak] = t
+            np.maximum(peaks[tableRange], frame, out=peaks[tableRange])
+            np.minimum(troughs[tableRange], frame, out=troughs[tableRange])
+
+        # then the earlier images, each of which is the first time of the maximum if it equals it
+        for t in range(tableRange - 1, -1, -1):
+            frame = slab[:, t]
+            np.greater_equal(frame, peaks[t + 1], out=isPeak)
+            np.maximum(peaks[t + 1], frame, out=peaks[t])
+            peakTimes[t] = peakTimes[t + 1]
+            peakTimes[t][isPeak] = t
+            np.minimum(troughs[t + 1], frame, out=troughs[t])
+
+    def _clearMaps(self):
+        """ Clear the maps computed from the dynamics, and those kept for other numbers of baseline images.
+        :return:
+        """
+        self._mapsForNumBaseline = OrderedDict()
+        self._timeTables = None
+        self.scoreMap = None
+        self._setCurrentMaps()
+
+    def _computeTimeTables(self, accumulator=None):
+        """ Compute the time tables in one pass over the dynamics.
+
+        :param accumulator: MapAccumulator
+        Optional accumulator the images were added to, which gives the last entries if it starts at the end of the
+        table range, so only the images before them are read.
+        :return: list of np.array
+        sums, peaks, peak times and troughs, each [tableRange + 1, nz, ny, nx].
+        """
+        nz, ny, nx = self.dims
+        tableRange = self._getTableRange()
+        shape = [tableRange + 1, nz, ny, nx]
+        tables = [np.zeros(shape, self.precision), np.zeros(shape, self.dynamics.dtype), np.zeros(shape, np.uint16),
+                  np.zeros(shape, self.dynamics.dtype)]
+        accumulate = self._accumulateTimeTables
+        if accumulator is not None and accumulator.firstTime == tableRange:
+            tables[1][tableRange] = accumulator.peaks
+            tables[2][tableRange] = accumulator.peakTimes
+            tables[3][tableRange] = accumulator.troughs
+            accumulate = lambda start, stop, *tables: self._accumulateTimeTables(start, stop, *tables,
+                                                                                 hasLastEntries=True)
+        self._forEachSlab(accumulate, tables, 4 * shape[0])
+        return tables
+
+    def _forEachSlab(self, accumulate, maps, numMaps):
+        """ Call accumulate for each slab of slices, sharing the slabs between the workers.
 
+        :param accumulate: function
+        Called with the first and after last slice and the maps.
+        :param maps: list of np.array
+        :param numMaps: int
+        Number of map sized arrays accumulated into, for the slab size.
+        :return:
+        """
+        nz = self.dims[0]
+        slabSize = self._getSlabSize(numMaps)
+        slabs = [(start, min(start + slabSize, nz)) for start in range(0, nz, slabSize)]
+        if self._numWorkers <= 1 or len(slabs) < 2:
+            for start, stop in slabs:
+                accumulate(start, stop, *maps)
+        else:
+            self._getPool().map(lambda slab: accumulate(slab[0], slab[1], *maps), slabs)
+
+    def _getMapsFromTimeTables(self):
+        """ Return the maps for the number of baseline images, found from the time tables for each voxel.
+
+        :return: list of np.array
+        Baseline, maximum intensity, time to peak, minimum intensity and zero minimum maps.
+        """
+        sums, peaks, peakTimes, troughs = self._timeTables
+        numBaseline = self.numBaseline
+        baseMap = sums[numBaseline] / self.precision(numBaseline)
+        maxIntMap = np.subtract(peaks[numBaseline], baseMap, dtype=self.precision)
+        timeToPeakMap = np.where(maxIntMap > 0, peakTimes[numBaseline] - numBaseline, 0).astype(self.precision)
+        maxIntMap.clip(min=0, out=maxIntMap)
+        minIntMap = troughs[numBaseline].astype(self.precision)
+        return [baseMap, maxIntMap, timeToPeakMap, minIntMap, (minIntMap == 0.0).astype(self.precision)]
+
+    def _getPool(self):
+        """ Return the pool of worker threads, starting it if needed. """
+        if self._pool is None:
+            self._pool = ThreadPool(self._numWorkers)
+        return self._pool
+
+    def _getSlabSize(self, numMaps):
+        """ Return the number of slices computed together, small enough for the accumulators to stay in cache and,
+        for each worker, for the slab of dynamics read and its accumulators to fit in the memory budget.
+
+        :param numMaps: int
+        :return: int
+        """
+        nz, ny, nx = self.dims
+        mapItemSize = np.dtype(self.precision).itemsize
+        slabSize = max(1, SLAB_BYTES // (numMaps * ny * nx * mapItemSize))
+        if self._maxBytes is not None:
+            sliceBytes = (self._nt * np.dtype(self.dynamics.dtype).itemsize + numMaps * mapItemSize) * ny * nx
+            slabSize = min(slabSize, max(1, self._maxBytes // (max(1, self._numWorkers) * sliceBytes)))
+        return slabSize
+
+    def _getTableRange(self):
+        """ Return the largest number of baseline images the time tables cover, 0 if they cannot be made. """
+        tableRange = min(BASELINE_RANGE, self._nt - 1)
+        if self._maxBytes is not None:
+            entryBytes = np.prod(self.dims) * (np.dtype(self.precision).itemsize + np.dtype(np.uint16).itemsize +
+                                               2 * np.dtype(self.dynamics.dtype).itemsize)
+            tableRange = min(tableRange, self._maxBytes // entryBytes - 1)
+        return max(0, tableRange)
+
+    def _readSlab(self, start, stop):
+        """ Return the timepoints of slices start to stop, as a view of dynamics4D or read from the dynamics.
+
+        :param start: int
+        :param stop: int
+        :return: np.array
+        [stop - start, nt, ny, nx]. Only whole slices are read, as stop is at most nz.
+        """
+        if self.dynamics4D is not None:
+            return self.dynamics4D[start:stop]
+        slab = np.asarray(self.dynamics[start*self._nt:stop*self._nt])
+        return slab.reshape([stop - start, self._nt] + list(slab.shape[1:]))
+
+    def _setCurrentMaps(self, maps=None):
+        """ Use the maps given, or else those kept for the number of baseline images, or none if they are not kept.
+        :param maps: list of np.array
+        Baseline, maximum intensity, time to peak, minimum intensity and zero minimum maps.
+        :return:
+        """
+        if maps is None:
+            maps = self._mapsForNumBaseline.get(self._numBaseline, [None] * 5)
+        self._baselineMap, self._maxIntMap, self._timeToPeakMap, self._minIntMap, self._zeroMinIntensityMap = maps
+
+    def _streamMaps(self):
+        """ Compute the maps for the number of baseline images in one pass over the dynamics, or over only its first
+        images if they were passed through an accumulator.
+
+        :return: list of np.array
+        Baseline, maximum intensity, time to peak, minimum intensity and zero minimum maps.
+        """
         nz, ny, nx = self.dims
-        self._maxIntMap = np.zeros([nz, nx, ny])
-        self._timeToPeakMap = np.zeros([nz, nx, ny])
-        for i in range(0, nz):
-            startIndex = i*self._nt
-            baseMap = np.mean(self.dynamics[startIndex:(startIndex+self.numBaseline), :, :], axis=0)
-            baseMapAllTime = np.tile(baseMap, (self._nt-self.numBaseline, 1, 1))
-            slice = self.dynamics[startIndex+self.numBaseline:(startIndex+self._nt), :, :] - baseMapAllTime
-            slice = slice.clip(min=0) #remove negative values after subtraction
-            self._maxIntMap[i, :, :] = np.amax(slice, axis=0)
-            ttp = np.argmax(slice, axis=0)
-            self._timeToPeakMap[i, :, :] = ttp
\ No newline at end of file
+        maps = [np.zeros([nz, ny, nx], self.precision) for i in range(0, 4)]
+        self._forEachSlab(self._accumulateSlab, maps, len(maps))
+        return maps + [(maps[3] == 0.0).astype(self.precision)]
@@ -0,0 +1,190 @@
+__author__ = 'medabana'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import Analysis.MapGenerator
+from Analysis.MapGenerator import MapGenerator
+from Analysis.SyntheticDynamics import SlicedSeries, makeDynamics
+
+
+class MapGeneratorTest(unittest.TestCase):
+    def test_dynamicsSources(self):
+        nz, nt, ny, nx, numBaseline = 6, 5, 4, 4, 2
+        dyn = makeDynamics(nz, nt, ny, nx, numBaseline)
+        tmpDir = tempfile.mkdtemp()
+        try:
+            memmap = np.memmap(os.path.join(tmpDir, 'dyn.raw'), dyn.dtype, 'w+', shape=dyn.shape)
+            memmap[:] = dyn
+            slicedSeries = SlicedSeries(dyn)
+            maps = []
+            for source in (dyn, memmap, slicedSeries):
+                mapGenerator = MapGenerator()
+                # room for two slices of dynamics and their accumulators
+                mapGenerator.setMemoryBudget(2 * (nt*2 + 4*4) * ny * nx)
+                mapGenerator.setDynamics(source, nt)
+                mapGenerator.numBaseline = numBaseline
+                maps.append([mapGenerator.baselineMap(), mapGenerator.maximumIntensityMap(),
+                             mapGenerator.timeToPeakMap(), mapGenerator.minimumIntensityMap(),
+                             mapGenerator.getZeroMinIntensityMap()])
+            del memmap, mapGenerator
+        finally:
+            shutil.rmtree(tmpDir)
+
+        self.assertEqual(2 * nt, slicedSeries.maxImagesRead)
+        for inMemory, memoryMapped, sliced in zip(*maps):
+            np.testing.assert_array_equal(inMemory, memoryMapped)
+            np.testing.assert_array_equal(inMemory, sliced)
+
+    def test_maps(self):
+        nz, nt, ny, nx, numBaseline = 3, 7, 4, 6, 2
+        dyn = makeDynamics(nz, nt, ny, nx, numBaseline)
+        # no enhancement and a repeated peak
+        dyn[:, 0, 0] = 1000
+        dyn[[3, 5], 1, 1] = 5000
+        mapGenerator = MapGenerator(np.float64)
+        mapGenerator.setDynamics(dyn, nt)
+        mapGenerator.numBaseline = numBaseline
+        mapGenerator.computeAllMaps()
+
+        self.assertTrue(np.may_share_memory(dyn, mapGenerator.dynamics4D))
+        for i in range(0, nz):
+            slice = dyn[i*nt:(i+1)*nt].astype(np.float64)
+            baseMap = slice[:numBaseline].mean(axis=0)
+            enhancement = (slice[numBaseline:] - baseMap).clip(min=0)
+            np.testing.assert_allclose(baseMap, mapGenerator.baselineMap()[i])
+            np.testing.assert_allclose(enhancement.max(axis=0), mapGenerator.maximumIntensityMap()[i])
+            np.testing.assert_array_equal(enhancement.argmax(axis=0), mapGenerator.timeToPeakMap()[i])
+            np.testing.assert_array_equal(slice[numBaseline:].min(axis=0), mapGenerator.minimumIntensityMap()[i])
+        self.assertEqual((nz, ny, nx), mapGenerator.getZeroMinIntensityMap().shape)
+
+    def test_precision(self):
+        dyn = makeDynamics(4, 12, 8, 8, 3)
+        maps = {}
+        for precision in (np.float64, np.float32):
+            mapGenerator = MapGenerator(precision)
+            mapGenerator.setDynamics(dyn, 12)
+            mapGenerator.numBaseline = 3
+            maps[precision] = [mapGenerator.baselineMap(), mapGenerator.maximumIntensityMap(),
+                               mapGenerator.timeToPeakMap(), mapGenerator.getZeroMinIntensityMap()]
+
+        self.assertEqual(np.uint16, dyn.dtype)
+        for map32, map64 in zip(maps[np.float32], maps[np.float64]):
+            self.assertEqual(np.float32, map32.dtype)
+            self.assertEqual(np.float64, map64.dtype)
+            np.testing.assert_allclose(map64, map32, rtol=1e-6)
+
+    def test_setPrecision(self):
+        mapGenerator = MapGenerator()
+        mapGenerator.setDynamics(makeDynamics(2, 5, 4, 4, 2), 5)
+        mapGenerator.numBaseline = 2
+        self.assertEqual(np.float32, mapGenerator.maximumIntensityMap().dtype)
+
+        mapGenerator.setPrecision(np.float64)
+        self.assertEqual(np.float64, mapGenerator.maximumIntensityMap().dtype)
+        self.assertRaises(ValueError, mapGenerator.setPrecision, np.int16)
+
+    def test_workers(self):
+        dyn = makeDynamics(5, 6, 4, 4, 2)
+        maps = []
+        slabBytes = Analysis.MapGenerator.SLAB_BYTES
+        # a slice per slab
+        Analysis.MapGenerator.SLAB_BYTES = 1
+        try:
+            for numWorkers in (1, 3):
+                mapGenerator = MapGenerator()
+                mapGenerator.setWorkers(numWorkers)
+                mapGenerator.setDynamics(dyn, 6)
+                mapGenerator.numBaseline = 2
+                mapGenerator.computeAllMaps()
+                maps.append([mapGenerator.baselineMap(), mapGenerator.maximumIntensityMap(),
+                             mapGenerator.timeToPeakMap(), mapGenerator.minimumIntensityMap()])
+                mapGenerator.setWorkers(1)
+        finally:
+            Analysis.MapGenerator.SLAB_BYTES = slabBytes
+
+        for serialMap, parallelMap in zip(*maps):
+            np.testing.assert_array_equal(serialMap, parallelMap)
+
+    def test_changeNumBaseline(self):
+        nz, nt, ny, nx = 3, 9, 4, 5
+        dyn = makeDynamics(nz, nt, ny, nx, 3)
+        dyn[[5, 7], 1, 1] = 5000
+        mapGenerator = MapGenerator()
+        mapGenerator.setDynamics(dyn, nt)
+        mapGenerator.numBaseline = 3
+        firstMaps = mapGenerator.maximumIntensityMap()
+
+        for numBaseline in (2, 1, 8, 4):
+            mapGenerator.numBaseline = numBaseline
+            expected = MapGenerator()
+            expected.setDynamics(dyn, nt)
+            expected.numBaseline = numBaseline
+            np.testing.assert_array_equal(expected.baselineMap(), mapGenerator.baselineMap())
+            np.testing.assert_array_equal(expected.maximumIntensityMap(), mapGenerator.maximumIntensityMap())
+            np.testing.assert_array_equal(expected.timeToPeakMap(), mapGenerator.timeToPeakMap())
+            np.testing.assert_array_equal(expected.minimumIntensityMap(), mapGenerator.minimumIntensityMap())
+            np.testing.assert_array_equal(expected.getZeroMinIntensityMap(), mapGenerator.getZeroMinIntensityMap())
+        self.assertIsNotNone(mapGenerator._timeTables)
+        # maps the tables cover are found from them again rather than kept
+        self.assertEqual([], list(mapGenerator._mapsForNumBaseline))
+
+        mapGenerator.numBaseline = 3
+        np.testing.assert_array_equal(firstMaps, mapGenerator.maximumIntensityMap())
+
+    def test_roiCurves(self):
+        nz, nt, ny, nx = 4, 7, 5, 6
+        dyn = makeDynamics(nz, nt, ny, nx, 2)
+        labels = np.zeros([nz, ny, nx], np.int32)
+        labels[1, 1:3, 2:5] = 1
+        labels[3, 4, 0] = 1
+        labels[0:3, 0, 0] = 3
+        masks = [labels == 1, labels > 0, labels == 2]
+        curves = dyn.reshape(nz, nt, ny, nx).transpose(0, 2, 3, 1)
+        slabBytes = Analysis.MapGenerator.SLAB_BYTES
+        # a slice at a time
+        Analysis.MapGenerator.SLAB_BYTES = 1
+        try:
+            for source, numWorkers in [(dyn, 1), (SlicedSeries(dyn), 1), (dyn, 3)]:
+                mapGenerator = MapGenerator(np.float64)
+                mapGenerator.setDynamics(source, nt)
+                mapGenerator.setWorkers(numWorkers)
+                for rois in (labels, masks):
+                    means, counts, variances = mapGenerator.getRoiCurves(rois)
+
+                    self.assertEqual([7, 10, 0] if rois is masks else [7, 0, 3], counts.tolist())
+                    for i, mask in enumerate(masks if rois is masks else [labels == 1, labels == 2, labels == 3]):
+                        if mask.any():
+                            np.testing.assert_allclose(curves[mask].mean(0), means[i])
+                            np.testing.assert_allclose(curves[mask].var(0), variances[i], atol=1e-6)
+                        else:
+                            self.assertTrue(np.isnan(means[i]).all())
+                mapGenerator.setWorkers(1)
+        finally:
+            Analysis.MapGenerator.SLAB_BYTES = slabBytes
+
+    def test_incompleteSeries(self):
+        nt = 12
+        dyn = makeDynamics(5, nt, 4, 4, 3)[:50]
+        mapGenerator = MapGenerator()
+        accumulator = mapGenerator.createAccumulator(nt)
+        for index in range(0, len(dyn)):
+            accumulator.addImage(index, dyn)
+        mapGenerator.setDynamics(dyn, nt, accumulator)
+        mapGenerator.numBaseline = 3
+        expected = MapGenerator()
+        expected.setDynamics(dyn[:48].copy(), nt)
+        expected.numBaseline = 3
+
+        self.assertEqual([4, nt], [mapGenerator.getNz(), mapGenerator.getNt()])
+        np.testing.assert_array_equal(expected.maximumIntensityMap(), mapGenerator.maximumIntensityMap())
+        np.testing.assert_array_equal(expected.timeToPeakMap(), mapGenerator.timeToPeakMap())
+        mask = np.ones([4, 4, 4], np.bool)
+        np.testing.assert_array_equal(expected.getRoiCurves(mask)[0], mapGenerator.getRoiCurves(mask)[0])
+
+if __name__ == "__main__":
+    unittest.main()
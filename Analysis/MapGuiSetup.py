@@ -167,7 +167,7 @@ class MapGuiSetup(QtCore.QObject):
         if self._input is not None:
             self._baselineNumInput.spinBox.setValue(t)
 
-    def setDynamics(self, d, nt):
+    def setDynamics(self, d, nt, accumulator=None):
         """ Set the dynamic series from which to derive the maps and
         the number of timepoints.
 
@@ -175,9 +175,11 @@ class MapGuiSetup(QtCore.QObject):
         3D array [nt x nz, ny, nx]
         :param nt: int
         number of timepoints
+        :param accumulator: MapAccumulator
+        Optional accumulator the images were added to as they were read
         :return:
         """
-        self._mapGenerator.setDynamics(d, nt)
+        self._mapGenerator.setDynamics(d, nt, accumulator)
         self._nt = nt
 
     def _requestBaseline(self):
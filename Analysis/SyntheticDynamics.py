@@ -0,0 +1,37 @@
+__author__ = 'medabana'
+
+import numpy as np
+
+# Synthetic dynamic series for the analysis tests.
+
+
+def makeDynamics(nz, nt, ny, nx, numBaseline):
+    """ Return a uint16 series of noisy baseline images followed by enhancing ones, slice by slice.
+
+    :param numBaseline: int
+    Number of baseline images in each slice.
+    :return: np.array
+    [nt x nz, ny, nx]
+    """
+    random = np.random.RandomState(0)
+    dyn = random.randint(900, 1100, [nz, nt, ny, nx])
+    dyn[:, numBaseline:] += random.randint(0, 3000, [nz, nt - numBaseline, ny, nx])
+    return dyn.reshape(nz*nt, ny, nx).astype(np.uint16)
+
+
+class SlicedSeries(object):
+    """ Series read on demand a slice at a time, as LazySeries is, recording the most images read at once. """
+    def __init__(self, dyn):
+        """
+        :param dyn: np.array
+        The series returned when sliced.
+        """
+        self._dyn = dyn
+        self.dtype = dyn.dtype
+        self.shape = dyn.shape
+        self.maxImagesRead = 0
+
+    def __getitem__(self, index):
+        images = self._dyn[index]
+        self.maxImagesRead = max(self.maxImagesRead, len(images))
+        return images.copy()
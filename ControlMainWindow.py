@@ -1,5 +1,6 @@
 __author__ = 'medabana'
 
+import functools
 import logging
 import os
 import numpy as np
@@ -10,13 +11,21 @@ from Analysis.AIFguiSetup import AIFguiSetup
 from Analysis.AIFmethods import AIFmethods
 from DicomReader.DicomDirFileReader import DicomDirFileReader
 from DicomReader.RecursiveDirectoryReader import RecursiveDirectoryReader
+from DicomReader.SeriesLoader import SeriesLoader
 from DicomReader.SeriesSelection import Ui_SeriesSelection
+from DicomReader.StudyIndex import StudyIndex
 from ImageDisplayWindow import ImageDisplay
 
 class ControlMainWindow(QtGui.QMainWindow):
     """ Responsible for the main GUI window."""
-    def __init__(self, parent=None):
-        """ Set up the main window and connect buttons/sliders etc. """
+    def __init__(self, parent=None, diskSeriesCache=None):
+        """ Set up the main window and connect buttons/sliders etc.
+
+        :param parent: QtGui.QWidget
+        :param diskSeriesCache: DiskSeriesCache
+        Optional cache to keep decoded series on disk, so that they are mapped rather than decoded when read again.
+        It holds a copy of the image data, so it is not used unless given.
+        """
         super(ControlMainWindow, self).__init__(parent)
         self._im = QtGui.QImage()
         self._currSlice = 1
@@ -26,6 +35,16 @@ class ControlMainWindow(QtGui.QMainWindow):
         self._aifGuiSetup = AIFguiSetup(self._mapGuiSetup.getMapGenerator())
         self._aifMethods = AIFmethods(self._aifGuiSetup, self._mapGuiSetup)
         self._logger = logging.getLogger(__name__)
+        self._studyIndex = StudyIndex()
+        # memory ceiling for the decoded series kept for switching between series
+        self._seriesCacheBytes = 2 * 1024**3
+        self._diskSeriesCache = diskSeriesCache
+        # series are read in a worker thread so the window stays responsive
+        self._seriesLoader = None
+        self._seriesLoaderThread = None
+        self._loadingSeriesName = None
+        # loaders which have been stopped, kept until their threads finish
+        self._stoppedSeriesLoads = []
 
         # Create the main window.
         self._ui = ImageDisplay.Ui_MainWindow()
@@ -75,11 +94,16 @@ class ControlMainWindow(QtGui.QMainWindow):
 
     def closeEvent(self, *args, **kwargs):
         """ Closes any open windows. """
+        self._cancelSeriesLoad()
+        for seriesLoader, seriesLoaderThread in self._stoppedSeriesLoads:
+            seriesLoaderThread.wait()
         QtGui.qApp.quit()
 
     def keyPressEvent(self, e):
-        """ Move around the series images using the H, J, F, and G keys. """
-        if e.key() == QtCore.Qt.Key_H:
+        """ Move around the series images using the H, J, F, and G keys. Escape cancels loading a series. """
+        if e.key() == QtCore.Qt.Key_Escape:
+            self._cancelSeriesLoad()
+        elif e.key() == QtCore.Qt.Key_H:
             self._changeTime(self._currTime - 1)
             self._ui.spinTime.setValue(self._currTime)
         elif e.key() == QtCore.Qt.Key_J:
@@ -101,6 +125,16 @@ class ControlMainWindow(QtGui.QMainWindow):
         index = (self._currSlice - 1) * self._nt + self._currTime - 1
         return index
 
+    def _cancelSeriesLoad(self):
+        """ Stop reading the series being loaded. The loader stops after the file or batch of headers being read. """
+        if self._seriesLoader is None:
+            return
+        self._logger.info('Cancelling load of %s' % self._loadingSeriesName)
+        self._seriesLoader.cancel()
+        self._finishSeriesLoad()
+        # replaced by _showLoadCancelled once the loader has stopped
+        self.statusBar().showMessage('Cancelling loading %s' % self._loadingSeriesName, 5000)
+
     def _changeSlice(self, num):
         """ Change the slice being displayed """
         if num > 0 and num <= self._nz:
@@ -170,23 +204,60 @@ class ControlMainWindow(QtGui.QMainWindow):
         self._setUpLogging()
         self._logger.info('Opening %s.' % fileName)
 
+    def _displayLoadedSeries(self, data):
+        """ Display the series once all of its images have been read and pass it to the analysis. """
+        if self.sender() is not self._seriesLoader:
+            return
+        seriesName = self._loadingSeriesName
+        accumulator = self._seriesLoader.accumulator
+        self._finishSeriesLoad()
+        self.statusBar().clearMessage()
+        # set again so the display range covers the whole series
+        self._ui.label.data = data
+        self._files = self._seriesReader.getOrderedFileList(seriesName)
+        self._nx, self._ny, self._nz, self._nt = self._seriesReader.getSequenceParameters(seriesName)
+        self._mapGuiSetup.setDynamics(data, self._nt, accumulator)
+        print self._seriesReader.getSequenceParameters(seriesName)
+        self._setGuiInfo(seriesName)
+
+    def _displayPartialSeries(self, data):
+        """ Display the series while its images are being read. Images not yet read are blank. """
+        if self.sender() is not self._seriesLoader:
+            return
+        seriesName = self._loadingSeriesName
+        self._ui.label.data = data
+        self._files = self._seriesReader.getOrderedFileList(seriesName)
+        self._nx, self._ny, self._nz, self._nt = self._seriesReader.getSequenceParameters(seriesName)
+        self._setGuiInfo(seriesName)
+
     def _displaySeries(self, index):
-        """ Gets the data for the selected series and displays an initial image. """
+        """ Starts reading the data for the selected series in a worker thread.
+
+        The images are displayed as they are read and the series is passed to the analysis once it is complete.
+        """
         # Get the selected protocol name
         item = self.model.itemFromIndex(index)
         print "double clicked", item.text()
         seriesName = item.text()
 
-        # get the image data and info
-        data = self._seriesReader.getImageData(seriesName)
-        self._ui.label.data = data
-        self._files = self._seriesReader.getOrderedFileList(seriesName)
-        self._nx, self._ny, self._nz, self._nt = self._seriesReader.getSequenceParameters(seriesName)
+        self._cancelSeriesLoad()
         self._mapGuiSetup.reset()
         self._aifGuiSetup.reset()
-        self._mapGuiSetup.setDynamics(data, self._nt)
-        print self._seriesReader.getSequenceParameters(seriesName)
-        self._setGuiInfo(seriesName)
+        self._loadingSeriesName = seriesName
+        self._seriesLoaderThread = QtCore.QThread()
+        self._seriesLoader = SeriesLoader(self._seriesReader, seriesName,
+                                          mapGenerator=self._mapGuiSetup.getMapGenerator())
+        self._seriesLoader.moveToThread(self._seriesLoaderThread)
+        self._seriesLoaderThread.started.connect(self._seriesLoader.run)
+        self._seriesLoader.headerProgress.connect(self._showHeaderProgress)
+        self._seriesLoader.partialDataReady.connect(self._displayPartialSeries)
+        self._seriesLoader.progress.connect(self._showLoadProgress)
+        self._seriesLoader.loaded.connect(self._displayLoadedSeries)
+        self._seriesLoader.failed.connect(self._showLoadFailure)
+        # the loader is no longer the current one when it stops, so the series name is passed with the signal
+        self._seriesLoader.cancelled.connect(functools.partial(self._showLoadCancelled, seriesName))
+        self.statusBar().showMessage('Loading %s' % seriesName)
+        self._seriesLoaderThread.start()
 
     def _displaySeriesNames(self):
         """ Request the DICOM directory from the user and displays the found protocols. """
@@ -203,6 +274,8 @@ class ControlMainWindow(QtGui.QMainWindow):
         # Get the appropriate type of directory reader for the data.
         # And from the reader get the protocol names.
         self._seriesReader = self._getDirectoryReader()
+        self._seriesReader.setCacheSize(self._seriesCacheBytes)
+        self._seriesReader.setDiskCache(self._diskSeriesCache)
         seriesNames = self._seriesReader.getSeriesNames()
 
         # Display the protocols to the user.
@@ -221,6 +294,17 @@ class ControlMainWindow(QtGui.QMainWindow):
         self.scrArea.activateWindow()
         self.scrArea.raise_()
 
+    def _finishSeriesLoad(self):
+        """ Stop the loader thread once the loader has finished or been cancelled, without waiting for it.
+
+        The loader and its thread are kept until the thread has finished.
+        """
+        self._stoppedSeriesLoads.append((self._seriesLoader, self._seriesLoaderThread))
+        self._seriesLoaderThread.finished.connect(self._removeFinishedSeriesLoads)
+        self._seriesLoaderThread.quit()
+        self._seriesLoader = None
+        self._seriesLoaderThread = None
+
     def _freehandPressed(self):
         """ Toggle roiButton """
         self._ui.roiButton.setChecked(False)
@@ -237,8 +321,8 @@ class ControlMainWindow(QtGui.QMainWindow):
         for baseDir, dirNames, files in os.walk(dirNameSearch):
             for file in files:
                 if file == 'DICOMDIR':
-                    return DicomDirFileReader(dirName, os.path.join(baseDir, file))
-        return RecursiveDirectoryReader(dirName)
+                    return DicomDirFileReader(dirName, os.path.join(baseDir, file), index=self._studyIndex)
+        return RecursiveDirectoryReader(dirName, index=self._studyIndex)
 
     def _loadROI_npz(self):
         """ Load in data from a *.npz file and display it. """
@@ -277,6 +361,12 @@ class ControlMainWindow(QtGui.QMainWindow):
         roi[data > 0] = True
         self._ui.label.roi = roi
 
+    def _removeFinishedSeriesLoads(self):
+        """ Drop the stopped loaders whose threads have finished. """
+        self._stoppedSeriesLoads = [(seriesLoader, seriesLoaderThread)
+                                    for seriesLoader, seriesLoaderThread in self._stoppedSeriesLoads
+                                    if not seriesLoaderThread.isFinished()]
+
     def _roiPressed(self):
         """ Toggle roiFreehand button. """
         self._ui.roiFreehand.setChecked(False)
@@ -442,6 +532,36 @@ class ControlMainWindow(QtGui.QMainWindow):
         logFile = os.path.join(self._dcmDir, 'aifSelection.log')
         logging.basicConfig(filename= logFile, filemode="w", level=logging.INFO)
 
+    def _showHeaderProgress(self, numRead, numFiles):
+        """ Show how many of the file headers of the series have been read. """
+        if self.sender() is not self._seriesLoader:
+            return
+        self.statusBar().showMessage('Reading headers of %s: %i of %i files (Esc to cancel)' %
+                                     (self._loadingSeriesName, numRead, numFiles))
+
+    def _showLoadCancelled(self, seriesName):
+        """ Report a cancelled series once its loader has stopped, unless another series is being loaded. """
+        if self._seriesLoader is not None:
+            return
+        self.statusBar().showMessage('Cancelled loading %s' % seriesName, 5000)
+
+    def _showLoadFailure(self, message):
+        """ Report a series that could not be read. """
+        if self.sender() is not self._seriesLoader:
+            return
+        seriesName = self._loadingSeriesName
+        self._finishSeriesLoad()
+        self.statusBar().clearMessage()
+        QtGui.QMessageBox.critical(self, "Critical", "Could not read %s.\n%s" % (seriesName, message))
+
+    def _showLoadProgress(self, numRead, numFiles):
+        """ Show how much of the series has been read and refresh the image as more slices arrive. """
+        if self.sender() is not self._seriesLoader:
+            return
+        self.statusBar().showMessage('Loading %s: %i of %i files (Esc to cancel)' %
+                                     (self._loadingSeriesName, numRead, numFiles))
+        self._setSlice()
+
     def _showVoxelValue(self, x, y, value):
         """ Show the voxel subscripts and value on the GUI """
         z = self._calculateIndex()
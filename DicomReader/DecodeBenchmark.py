@@ -0,0 +1,60 @@
+__author__ = 'medabana'
+
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+
+from DicomReader.RecursiveDirectoryReader import RecursiveDirectoryReader
+from DicomReader.SyntheticStudy import SyntheticStudy
+
+
+def timeLoad(dirNm, numWorkers, useProcesses, repeats=3):
+    """ Return the best time in seconds taken to load the first series in the directory. """
+    reader = RecursiveDirectoryReader(dirNm)
+    reader.setDecodeWorkers(numWorkers, useProcesses)
+    protName = reader.getSeriesNames()[0]
+    times = []
+    for i in range(0, repeats):
+        # force the series to be read again
+        reader.evict()
+        start = time.time()
+        reader.getImageData(protName)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    """ Report how series loading throughput scales with the number of decoding workers.
+
+    Usage: python -m DicomReader.DecodeBenchmark [nz nt ny nx]
+    Synthetic DICOM, NEMA and enhanced multiframe series are written to temporary directories. An enhanced
+    multiframe series is a single file, whose frames are mapped rather than decoded by the workers, so it is only
+    timed once as a reference.
+    """
+    nz, nt, ny, nx = [int(arg) for arg in argv[1:5]] if len(argv) > 4 else [20, 40, 256, 256]
+    numImages = nz*nt
+    workerCounts = [n for n in [1, 2, 4, 8, 16] if n <= max(2, multiprocessing.cpu_count())]
+    for fileType in ['DICOM', 'NEMA', 'enhancedDICOM']:
+        dirNm = tempfile.mkdtemp()
+        try:
+            study = SyntheticStudy(dirNm)
+            if fileType == 'DICOM':
+                study.writeDicomSeries('dce', nz, nt, ny, nx)
+            elif fileType == 'NEMA':
+                study.writeNemaSeries('dce', nz, nt, ny, nx)
+            else:
+                study.writeEnhancedSeries('dce', nz, nt, ny, nx)
+            isSingleFile = fileType == 'enhancedDICOM'
+            for useProcesses in [False] if isSingleFile else [False, True]:
+                for numWorkers in [1] if isSingleFile else workerCounts:
+                    seconds = timeLoad(dirNm, numWorkers, useProcesses)
+                    print '%-14s %-9s %2i workers: %7.3f s %8.0f images/s' % \
+                          (fileType, 'processes' if useProcesses else 'threads', numWorkers, seconds,
+                           numImages / seconds)
+        finally:
+            shutil.rmtree(dirNm)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,45 @@
+__author__ = 'medabana'
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from DicomReader.DicomDirRecordReader import iterRecords, iterRecordsFullParse
+from DicomReader.SyntheticStudy import SyntheticStudy
+
+
+def timeRecords(iterFunction, fileNm, repeats=3):
+    """ Return the best time in seconds taken to read every SERIES and IMAGE record, and the number of records. """
+    timer = timeit.Timer(lambda: sum(1 for record in iterFunction(fileNm)))
+    return min(timer.repeat(repeats, 1)), sum(1 for record in iterFunction(fileNm))
+
+
+def main(argv):
+    """ Compare streaming the records of a DICOMDIR file with reading the whole file with dicom.read_file.
+
+    Usage: python -m DicomReader.DicomDirBenchmark [DICOMDIR]
+    A synthetic DICOMDIR of about 50000 records is written to a temporary directory if no file is given.
+    """
+    tmpDir = None
+    if len(argv) > 1:
+        fileNm = argv[1]
+    else:
+        tmpDir = tempfile.mkdtemp()
+        fileNm = os.path.join(tmpDir, 'DICOMDIR')
+        # 10 patients, 2 studies each, 10 series of 245 images per study
+        SyntheticStudy(tmpDir).writeDicomDir(10, 2, 10, 245)
+    try:
+        print 'DICOMDIR:    %.1f MB' % (os.path.getsize(fileNm) / 1024.0**2)
+        fullTime, numRecords = timeRecords(iterRecordsFullParse, fileNm)
+        streamTime, numStreamed = timeRecords(iterRecords, fileNm)
+        print 'full parse:  %.3f s, %i records' % (fullTime, numRecords)
+        print 'streamed:    %.3f s, %i records' % (streamTime, numStreamed)
+        print 'speed up:    %.1fx' % (fullTime / streamTime)
+    finally:
+        if tmpDir is not None:
+            shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,41 +1,84 @@
 __author__ = 'medabana'
 
-import os
-import dicom
-
+from DicomReader.DicomDirRecordReader import DicomDirFormatError, iterRecords, iterRecordsFullParse
 from DicomReader.PatientDirectoryReader import PatientDirectoryReader
 
 class DicomDirFileReader(PatientDirectoryReader):
     """Responsible for reading image directories where there is a DICOMDIR file."""
-    def __init__(self, dirNm, dcmdirFile):
+    def __init__(self, dirNm, dcmdirFile, index=None):
+        """
+        :param dirNm: str
+        The image directory.
+        :param dcmdirFile: str
+        Path of the DICOMDIR file.
+        :param index: StudyIndex
+        Optional persistent index. The DICOMDIR file is only read if it is not in the index or has changed.
+        """
         PatientDirectoryReader.__init__(self, dirNm)
-        self._gatherSeriesFileNames(dcmdirFile)
+        series = None
+        if index is not None:
+            series = index.getDicomDirSeries(dcmdirFile)
+        if series is not None:
+            self._setSeries(series)
+        else:
+            self._gatherSeriesFileNames(dcmdirFile)
+            if index is not None:
+                index.setDicomDirSeries(dcmdirFile, self._getSeries())
         print "using DICOMDIR file"
 
-    def _gatherSeriesFileNames(self, file):
-        """ Read the DICOMDIR file and gather information on the image series. """
-        ds= dicom.read_file(file)
-        seriesRecord = None
+    def _addSeries(self, seriesValues, fileNames):
+        """ Store the information for a series and its files. """
+        protName, suid, seriesTime = seriesValues
+        self._suidNum += 1
+        protName = str(self._suidNum) + ": " + protName
+        self._suidAndTimeForProtocols[protName]= [suid, seriesTime]
+        self._filesForSuid[suid]= fileNames
+        self._protNamesOrdered.append(protName)
+
+    def _addSeriesRecords(self, records):
+        """ Gather the series information from SERIES and IMAGE records in directory order.
+
+        Each series is stored as soon as the next one starts, so the series information is built while the records
+        are read. Series without any images are left out.
+        """
+        seriesValues = None
         fileNames= []
-        foundNewSeries = False
-        foundImageSeries = False
-        # read through the data structure and pick out the series information.
-        for i, record in enumerate(ds.DirectoryRecordSequence):
-            if record.DirectoryRecordType == 'SERIES':
-                if foundImageSeries:
-                    #found start of new series.
-                    #store information on the last series now we have it all.
-                    self._suidNum += 1
-                    protName = str(self._suidNum) + ": " + seriesRecord.ProtocolName
-                    self._suidAndTimeForProtocols[protName]= [seriesRecord.SeriesInstanceUID, seriesRecord.SeriesTime]
-                    self._filesForSuid[seriesRecord.SeriesInstanceUID]= fileNames
-                    self._protNamesOrdered.append(protName)
-                seriesRecord= record
+        for recordType, values in records:
+            if recordType == 'SERIES':
+                if fileNames:
+                    self._addSeries(seriesValues, fileNames)
+                seriesValues = values
                 fileNames= []
-                foundNewSeries = True
-                foundImageSeries = False
-            elif foundNewSeries and record.DirectoryRecordType == 'IMAGE':
-                foundImageSeries= True
-                foundNewSeries = False
-            if foundImageSeries and record.DirectoryRecordType == 'IMAGE':
-                fileNames.append(os.path.join(*record.ReferencedFileID))
+            elif seriesValues is not None:
+                fileNames.append(values)
+        if fileNames:
+            self._addSeries(seriesValues, fileNames)
+
+    def _gatherSeriesFileNames(self, file):
+        """ Read the DICOMDIR file and gather information on the image series.
+
+        The records are streamed from the file by following the directory record offsets. A file which cannot be
+        read that way is read in full instead.
+        """
+        try:
+            self._addSeriesRecords(iterRecords(file))
+        except DicomDirFormatError as e:
+            self._logger.info('reading %s in full: %s' % (file, e))
+            self._suidNum = 0
+            self._suidAndTimeForProtocols = {}
+            self._filesForSuid = {}
+            self._protNamesOrdered = []
+            self._addSeriesRecords(iterRecordsFullParse(file))
+
+    def _getSeries(self):
+        """ Return the series information gathered from the DICOMDIR file, for storing in the index. """
+        return {'protNamesOrdered': self._protNamesOrdered,
+                'suidAndTimeForProtocols': self._suidAndTimeForProtocols,
+                'filesForSuid': self._filesForSuid}
+
+    def _setSeries(self, series):
+        """ Restore the series information stored in the index. """
+        self._protNamesOrdered = series['protNamesOrdered']
+        self._suidAndTimeForProtocols = series['suidAndTimeForProtocols']
+        self._filesForSuid = series['filesForSuid']
+        self._suidNum = len(self._protNamesOrdered)
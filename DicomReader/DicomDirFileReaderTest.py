@@ -0,0 +1,68 @@
+__author__ = 'medabana'
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from DicomReader.DicomDirFileReader import DicomDirFileReader
+from DicomReader.DicomDirRecordReader import DicomDirFormatError, iterRecords, iterRecordsFullParse
+from DicomReader.StudyIndex import StudyIndex
+from DicomReader.SyntheticStudy import SyntheticStudy
+
+
+class DicomDirFileReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dirNm = tempfile.mkdtemp()
+        self.dcmdirFile = os.path.join(self.dirNm, 'DICOMDIR')
+        self.series = SyntheticStudy(self.dirNm).writeDicomDir(2, 2, 3, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirNm)
+
+    def test_streamMatchesFullParse(self):
+        self.assertEqual(list(iterRecordsFullParse(self.dcmdirFile)), list(iterRecords(self.dcmdirFile)))
+
+    def test_series(self):
+        reader = DicomDirFileReader(self.dirNm, self.dcmdirFile)
+
+        # includes the last series in the file
+        self.assertEqual(12, len(reader.getSeriesNames()))
+        for protName, (seriesNum, seriesValues) in zip(reader.getSeriesNames(), enumerate(self.series)):
+            self.assertEqual(str(seriesNum + 1) + ': ' + seriesValues[0], protName)
+            self.assertEqual(seriesValues[1:3], reader._suidAndTimeForProtocols[protName])
+            self.assertEqual(seriesValues[3], reader._filesForSuid[seriesValues[1]])
+
+    def test_index(self):
+        indexDir = tempfile.mkdtemp()
+        index = StudyIndex(os.path.join(indexDir, 'studyIndex.sqlite'))
+        try:
+            read = DicomDirFileReader(self.dirNm, self.dcmdirFile, index=index)
+            restored = DicomDirFileReader(self.dirNm, self.dcmdirFile, index=index)
+
+            self.assertEqual(read.getSeriesNames(), restored.getSeriesNames())
+            self.assertEqual(read._filesForSuid, restored._filesForSuid)
+            # the restored text has the same type as the text read from the file
+            self.assertEqual([type(protName) for protName in read.getSeriesNames()],
+                             [type(protName) for protName in restored.getSeriesNames()])
+            self.assertEqual(type(list(read._filesForSuid.values())[0][0]),
+                             type(list(restored._filesForSuid.values())[0][0]))
+        finally:
+            index.close()
+            shutil.rmtree(indexDir)
+
+    def test_badOffsetsAreReadInFull(self):
+        with open(self.dcmdirFile, 'rb') as f:
+            contents = f.read()
+        rootOffset = contents.index(struct.pack('<HH2sH', 0x0004, 0x1200, 'UL', 4)) + 8
+        with open(self.dcmdirFile, 'wb') as f:
+            f.write(contents[:rootOffset] + struct.pack('<L', 1) + contents[rootOffset + 4:])
+
+        self.assertRaises(DicomDirFormatError, list, iterRecords(self.dcmdirFile))
+        reader = DicomDirFileReader(self.dirNm, self.dcmdirFile)
+        self.assertEqual(12, len(reader.getSeriesNames()))
+        self.assertEqual(self.series[-1][3], reader._filesForSuid[self.series[-1][1]])
+
+if __name__ == "__main__":
+    unittest.main()
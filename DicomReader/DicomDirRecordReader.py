@@ -0,0 +1,155 @@
+__author__ = 'medabana'
+
+import dicom
+import os
+import struct
+
+# Functions yielding the SERIES and IMAGE records of a DICOMDIR file in directory order, as
+# ['SERIES', [protName, suid, seriesTime]] and ['IMAGE', referencedFileName].
+
+_explicitVRLittleEndian = '1.2.840.10008.1.2.1'
+_rootOffsetTag = 0x00041200
+_nextOffsetTag = 0x00041400
+_inUseTag = 0x00041410
+_lowerOffsetTag = 0x00041420
+_recordTypeTag = 0x00041430
+_referencedFileIDTag = 0x00041500
+_seriesTimeTag = 0x00080031
+_protocolNameTag = 0x00181030
+_seriesInstanceUIDTag = 0x0020000E
+_itemTag = 0xFFFEE000
+_itemDelimitationTag = 0xFFFEE00D
+# explicit VRs whose value length takes 4 bytes after 2 reserved bytes
+_longLengthVRs = ('OB', 'OD', 'OF', 'OL', 'OW', 'SQ', 'UC', 'UN', 'UR', 'UT')
+# record types whose lower level records are searched for series
+_searchedRecordTypes = ('PATIENT', 'STUDY')
+
+
+class DicomDirFormatError(Exception):
+    """ Raised when a DICOMDIR file cannot be streamed and has to be parsed in full. """
+
+
+def iterRecords(fileNm):
+    """ Stream the SERIES and IMAGE records from a DICOMDIR file.
+
+    Only the start of each record is read. The directory is walked by following the record offsets, so records
+    other than patients, studies, series and images, and any records no longer in use, are skipped along with the
+    records below them.
+    :param fileNm: str
+    Path of the DICOMDIR file.
+    :return: generator
+    Raises DicomDirFormatError if the file is not an explicit VR little endian DICOMDIR with valid offsets.
+    """
+    with open(fileNm, 'rb') as fp:
+        visited = set()
+        for record in _iterDirectoryEntity(fp, _readRootOffset(fp), visited):
+            yield record
+
+
+def iterRecordsFullParse(fileNm):
+    """ Yield the SERIES and IMAGE records from a DICOMDIR file read in full with dicom.read_file.
+
+    The records are taken in the order they are stored, ignoring the record offsets.
+    :param fileNm: str
+    Path of the DICOMDIR file.
+    :return: generator
+    """
+    ds = dicom.read_file(fileNm)
+    for record in ds.DirectoryRecordSequence:
+        if record.DirectoryRecordType == 'SERIES':
+            yield ['SERIES', [record.get('ProtocolName', ''), record.SeriesInstanceUID, record.get('SeriesTime', '')]]
+        elif record.DirectoryRecordType == 'IMAGE':
+            fileID = record.ReferencedFileID
+            yield ['IMAGE', os.path.join(*fileID) if isinstance(fileID, list) else fileID]
+
+
+def _iterDirectoryEntity(fp, offset, visited):
+    """ Yield the records of a directory entity, the chain of records starting at offset, and those below them. """
+    while offset:
+        if offset in visited:
+            raise DicomDirFormatError('directory record at offset %i is referenced twice' % offset)
+        visited.add(offset)
+        values = _readRecord(fp, offset)
+        if values.get(_inUseTag, 0xFFFF) != 0:
+            recordType = values.get(_recordTypeTag)
+            if recordType == 'SERIES':
+                yield ['SERIES', [values.get(_protocolNameTag, ''), values.get(_seriesInstanceUIDTag, ''),
+                                  values.get(_seriesTimeTag, '')]]
+            elif recordType == 'IMAGE' and _referencedFileIDTag in values:
+                yield ['IMAGE', os.path.join(*values[_referencedFileIDTag].split('\\'))]
+            if recordType == 'SERIES' or recordType in _searchedRecordTypes:
+                for record in _iterDirectoryEntity(fp, values.get(_lowerOffsetTag, 0), visited):
+                    yield record
+        offset = values.get(_nextOffsetTag, 0)
+
+
+def _readElementHeader(fp):
+    """ Read the header of an explicit VR little endian data element.
+
+    :return: [int, str, int]
+    Tag, VR and value length. The VR is None for item and delimitation elements.
+    """
+    header = fp.read(8)
+    if len(header) < 8:
+        raise DicomDirFormatError('unexpected end of file')
+    group, element = struct.unpack('<HH', header[:4])
+    tag = (group << 16) | element
+    if group == 0xFFFE:
+        return tag, None, struct.unpack('<L', header[4:])[0]
+    vr = header[4:6]
+    if vr in _longLengthVRs:
+        return tag, vr, struct.unpack('<L', fp.read(4))[0]
+    return tag, vr, struct.unpack('<H', header[6:])[0]
+
+
+def _readRecord(fp, offset):
+    """ Read the elements of the directory record at offset as far as the ones needed for its record type.
+
+    :return: dict
+    Decoded values of the elements read, by tag.
+    """
+    fp.seek(offset)
+    tag, vr, length = _readElementHeader(fp)
+    if tag != _itemTag:
+        raise DicomDirFormatError('no directory record at offset %i' % offset)
+    end = None if length == 0xFFFFFFFF else fp.tell() + length
+    lastTag = _recordTypeTag
+    values = {}
+    while end is None or fp.tell() < end:
+        tag, vr, length = _readElementHeader(fp)
+        if tag == _itemDelimitationTag or tag > lastTag:
+            break
+        if length == 0xFFFFFFFF:
+            raise DicomDirFormatError('undefined length element in the directory record at offset %i' % offset)
+        value = fp.read(length)
+        if vr in ('UL', 'US'):
+            values[tag] = struct.unpack('<L' if vr == 'UL' else '<H', value)[0]
+        elif vr not in _longLengthVRs:
+            values[tag] = value.rstrip(' \0')
+        if tag == _recordTypeTag:
+            if values[tag] == 'SERIES':
+                lastTag = _seriesInstanceUIDTag
+            elif values[tag] == 'IMAGE':
+                lastTag = _referencedFileIDTag
+    return values
+
+
+def _readRootOffset(fp):
+    """ Check the file meta information and return the offset of the first record of the root directory entity. """
+    fp.seek(128)
+    if fp.read(4) != 'DICM':
+        raise DicomDirFormatError('no DICOM preamble')
+    transferSyntax = None
+    while True:
+        tag, vr, length = _readElementHeader(fp)
+        if tag >> 16 != 0x0002 and transferSyntax != _explicitVRLittleEndian:
+            raise DicomDirFormatError('transfer syntax %s is not explicit VR little endian' % transferSyntax)
+        if tag == _rootOffsetTag:
+            offset = struct.unpack('<L', fp.read(length))[0]
+            break
+        if tag > _rootOffsetTag or length == 0xFFFFFFFF:
+            raise DicomDirFormatError('no root directory record offset')
+        value = fp.read(length)
+        if tag == 0x00020010:
+            transferSyntax = value.rstrip(' \0')
+    return offset
@@ -0,0 +1,65 @@
+__author__ = 'medabana'
+
+import logging
+import os
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class DirectoryWatcher(object):
+    """ Collects the files written below a directory using inotify, so new files can be found without listing it.
+
+    Needs pyinotify, check isAvailable first.
+    """
+    def __init__(self, dirNm):
+        """
+        :param dirNm: str
+        The directory to watch, along with its subdirectories.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._changedFiles = set()
+        self._lock = threading.Lock()
+        self._watchManager = pyinotify.WatchManager()
+        self._notifier = pyinotify.ThreadedNotifier(self._watchManager, self._processEvent)
+        self._notifier.daemon = True
+        self._notifier.start()
+        # files are only reported once they have been written and closed, or moved into place. IN_CREATE is needed
+        # for new directories to be watched, the creation of a file is not reported.
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE
+        self._watchManager.add_watch(dirNm, mask, rec=True, auto_add=True)
+        self._logger.info('watching %s' % dirNm)
+
+    @staticmethod
+    def isAvailable():
+        """ Return True if pyinotify can be imported. """
+        return pyinotify is not None
+
+    def close(self):
+        """ Stop watching the directory. """
+        self._notifier.stop()
+
+    def getChangedFiles(self):
+        """ Return the files written since the last call.
+
+        :return: list of str
+        """
+        with self._lock:
+            changedFiles = sorted(self._changedFiles)
+            self._changedFiles = set()
+        return changedFiles
+
+    def _processEvent(self, event):
+        """ Record a written file. Runs in the notifier thread. """
+        with self._lock:
+            if not event.dir:
+                # a file that has just been created may still be being written
+                if not event.mask & pyinotify.IN_CREATE:
+                    self._changedFiles.add(event.pathname)
+            elif event.mask & pyinotify.IN_MOVED_TO or event.mask & pyinotify.IN_CREATE:
+                # files may already be in a new directory before its watch is added
+                for baseDir, dirNames, files in os.walk(event.pathname):
+                    self._changedFiles.update(os.path.join(baseDir, file) for file in files)
@@ -0,0 +1,110 @@
+__author__ = 'medabana'
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+
+class DiskSeriesCache(object):
+    """ Decoded series stored as .npy files so that later reads are a memory map instead of a DICOM decode.
+
+    Each series is stored under a key made from its series instance uid and the path, modification time and size of
+    its files, so a series whose files change is decoded again. Several processes can map the same file and share
+    its pages.
+    """
+    def __init__(self, cacheDir, maxBytes=None):
+        """
+        :param cacheDir: str
+        Directory for the cache files.
+        :param maxBytes: int
+        Optional limit on the total size of the cache files. The least recently used series are deleted first.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+
+    def load(self, suid, fileNames):
+        """ Return the cached series as a read-only memory map.
+
+        :param suid: str
+        Series instance uid.
+        :param fileNames: list of str
+        The files of the series.
+        :return: [np.memmap, dict] or None
+        Series array [nt x nz, ny, nx] and the series info, None if the series is not cached.
+        """
+        dataFile, infoFile = self._getCacheFiles(suid, fileNames)
+        if not os.path.exists(dataFile) or not os.path.exists(infoFile):
+            return None
+        with open(infoFile) as f:
+            fileInfo = json.load(f)
+        data = np.load(dataFile, mmap_mode='r')
+        # record the use for least recently used deletion
+        os.utime(dataFile, None)
+        self._logger.info('mapped series %s from %s' % (suid, dataFile))
+        return data, fileInfo
+
+    def save(self, suid, fileNames, data, fileInfo):
+        """ Write a decoded series to the cache.
+
+        :param suid: str
+        Series instance uid.
+        :param fileNames: list of str
+        The files of the series.
+        :param data: np.array
+        Series array [nt x nz, ny, nx].
+        :param fileInfo: dict
+        Series info, as returned by SeriesInfo.toDict.
+        :return:
+        """
+        dataFile, infoFile = self._getCacheFiles(suid, fileNames)
+        # write to temporary names first so an interrupted write is never mapped
+        with open(dataFile + '.tmp', 'wb') as f:
+            np.save(f, data)
+        with open(infoFile + '.tmp', 'w') as f:
+            json.dump(fileInfo, f)
+        os.rename(infoFile + '.tmp', infoFile)
+        os.rename(dataFile + '.tmp', dataFile)
+        self._logger.info('cached series %s in %s' % (suid, dataFile))
+        if self.maxBytes is not None:
+            self._deleteLeastRecentlyUsed(dataFile)
+
+    def _deleteLeastRecentlyUsed(self, keepFile):
+        """ Delete the least recently used series until the cache is within its size limit. """
+        dataFiles = [os.path.join(self._cacheDir, f) for f in os.listdir(self._cacheDir) if f.endswith('.npy')]
+        dataFiles.sort(key=os.path.getmtime)
+        totalBytes = sum(os.path.getsize(f) for f in dataFiles)
+        for dataFile in dataFiles:
+            if totalBytes <= self.maxBytes:
+                break
+            if dataFile == keepFile:
+                continue
+            numBytes = os.path.getsize(dataFile)
+            try:
+                os.remove(dataFile)
+            except OSError:
+                continue  # still mapped, on Windows
+            totalBytes -= numBytes
+            infoFile = os.path.splitext(dataFile)[0] + '.json'
+            if os.path.exists(infoFile):
+                os.remove(infoFile)
+
+    def _getCacheFiles(self, suid, fileNames):
+        """ Return the data and file info paths for the series. """
+        key = hashlib.sha1(_encode(suid))
+        for fileNm in sorted(fileNames):
+            stat = os.stat(fileNm)
+            key.update(_encode(os.path.abspath(fileNm)) + _encode(' %r %i' % (stat.st_mtime, stat.st_size)))
+        base = os.path.join(self._cacheDir, key.hexdigest())
+        return base + '.npy', base + '.json'
+
+
+def _encode(text):
+    """ Return the text as UTF-8 bytes for hashing, unicode paths may hold characters that are not ASCII. """
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
@@ -0,0 +1,93 @@
+__author__ = 'medabana'
+
+import dicom
+import numpy as np
+from dicom.tag import Tag
+
+from DicomReader.ImageFileReader import getPixelArray
+from DicomReader.SeriesInfo import parseTimes
+
+# dimension index pointers which give the position of a frame in the slice stack
+_sliceDimensionPointers = [Tag(0x0020, 0x0032), Tag(0x0020, 0x9057)]
+
+
+def getFrameInfo(dcm):
+    """ Return the acquisition time and slice index of every frame of an enhanced multiframe dataset.
+
+    The per frame functional groups are walked once, collecting the times and DimensionIndexValues into arrays.
+    The times are parsed together with parseTimes.
+    :param dcm: dicom.dataset.Dataset
+    :return: [np.array, np.array]
+    Frame acquisition times in seconds, zero if not given, and slice indices, one for each frame in file order.
+    """
+    dateTimes = []
+    indexValues = []
+    for frame in dcm.PerFrameFunctionalGroupsSequence:
+        frameContent = frame.FrameContentSequence[0]
+        dateTimes.append(frameContent.get('FrameAcquisitionDateTime', ''))
+        values = frameContent.DimensionIndexValues
+        indexValues.append(values if isinstance(values, list) else [values])
+    times = np.zeros(len(dateTimes))
+    given = [i for i, dateTime in enumerate(dateTimes) if dateTime]
+    if given:
+        times[given] = parseTimes([dateTimes[i] for i in given])
+    indexValues = np.array(indexValues, np.int)
+    return times, indexValues[:, _getSliceDimension(dcm, indexValues.shape[1])]
+
+
+def getFrameOrder(times, sliceIndices):
+    """ Return the frame numbers sorted by slice and then time, giving the [nt x nz] order of the other readers.
+
+    :param times: np.array
+    :param sliceIndices: np.array
+    :return: np.array
+    """
+    return np.lexsort((times, sliceIndices))
+
+
+def readEnhancedPixelData(fileNm, dcm, offset=None, numBytes=None):
+    """ Return the frames of an enhanced multiframe file sorted into [nt x nz] order.
+
+    Uncompressed pixel data is mapped from the file. If the frames are already in order the read-only memory map is
+    returned without copying, otherwise the frames are gathered into a new array in a single copy.
+    :param fileNm: str
+    :param dcm: dicom.dataset.Dataset
+    Dataset holding the elements before the pixel data.
+    :param offset: int
+    Offset of the pixel data in the file, None if it cannot be mapped.
+    :param numBytes: int
+    Length of the pixel data in bytes.
+    :return: np.array
+    3D array [nt x nz, ny, nx]
+    """
+    times, sliceIndices = getFrameInfo(dcm)
+    order = getFrameOrder(times, sliceIndices)
+    frames = _mapFrames(fileNm, dcm, offset, numBytes)
+    if frames is None:
+        frames = getPixelArray(dicom.read_file(fileNm, force=True))
+        frames = frames.reshape([len(order), dcm.Rows, dcm.Columns])
+    if (order == np.arange(len(order))).all():
+        return frames
+    return np.asarray(frames)[order]
+
+
+
+def _getSliceDimension(dcm, numDimensions):
+    """ Return which of the DimensionIndexValues gives the slice, the last one if it is not described. """
+    if 'DimensionIndexSequence' in dcm:
+        for i, dimension in enumerate(dcm.DimensionIndexSequence):
+            if dimension.DimensionIndexPointer in _sliceDimensionPointers:
+                return i
+    return numDimensions - 1
+
+
+def _mapFrames(fileNm, dcm, offset, numBytes):
+    """ Return the frames mapped read-only from the file, or None if the pixel data cannot be mapped. """
+    if offset is None or dcm.get('SamplesPerPixel', 1) != 1 or dcm.BitsAllocated not in [8, 16, 32]:
+        return None
+    dtype = np.dtype('%s%s%i' % ('<' if dcm.is_little_endian else '>', 'i' if dcm.PixelRepresentation else 'u',
+                                 dcm.BitsAllocated // 8))
+    shape = [int(dcm.get('NumberOfFrames', 1)), dcm.Rows, dcm.Columns]
+    if int(np.prod(shape)) * dtype.itemsize > numBytes:
+        return None
+    return np.memmap(fileNm, dtype, 'r', offset, tuple(shape))
@@ -0,0 +1,28 @@
+__author__ = 'medabana'
+
+import os
+import struct
+
+# Bytes read from the start of a file to decide its type, enough for the DICOM preamble and prefix.
+SNIFF_BYTES = 132
+
+
+def sniffFileType(fileNm):
+    """ Decide from the first few bytes of a file whether it can be a DICOM or NEMA image file.
+
+    DICOM files have 'DICM' after a 128 byte preamble. NEMA files have no preamble and start with an implicit VR
+    little endian element of group 0008 whose length fits in the file. Anything else, such as thumbnails, reports
+    and vendor files, is 'other' and does not need to be parsed.
+    :param fileNm: str
+    :return: str
+    'DICOM', 'NEMA' or 'other'.
+    """
+    with open(fileNm, 'rb') as fp:
+        start = fp.read(SNIFF_BYTES)
+    if len(start) == SNIFF_BYTES and start[128:132] == 'DICM':
+        return 'DICOM'
+    if len(start) >= 8:
+        group, element, length = struct.unpack('<HHL', start[:8])
+        if group == 0x0008 and 8 + length <= os.path.getsize(fileNm):
+            return 'NEMA'
+    return 'other'
@@ -0,0 +1,67 @@
+__author__ = 'medabana'
+
+import struct
+import dicom.UID
+from dicom.filereader import read_partial
+from dicom.tag import Tag
+
+# The tags needed to identify a series (SOPClassUID, RecognitionCode, the acquisition times, SeriesDescription
+# and SeriesInstanceUID) all lie at or before SeriesInstanceUID, so nothing after it needs to be parsed.
+LAST_DISCOVERY_TAG = Tag(0x0020, 0x000E)
+PIXEL_DATA_TAG = Tag(0x7FE0, 0x0010)
+# transfer syntaxes whose pixel data is stored as a plain array which can be mapped from the file
+UNCOMPRESSED_TRANSFER_SYNTAXES = [dicom.UID.ImplicitVRLittleEndian, dicom.UID.ExplicitVRLittleEndian,
+                                  dicom.UID.ExplicitVRBigEndian]
+
+
+def readDiscoveryHeader(fileNm, force=False):
+    """ Read a file only as far as the tags needed to work out which series it belongs to.
+
+    :param fileNm: str
+    Path of the file.
+    :param force: bool
+    Passed on to dicom.read_file, True to read files without a DICOM preamble (NEMA).
+    :return: dicom.dataset.FileDataset
+    Dataset holding the elements up to and including SeriesInstanceUID.
+    """
+    with open(fileNm, 'rb') as fp:
+        return read_partial(fp, _isPastDiscoveryTags, force=force)
+
+
+def readPixelDataHeader(fileNm, force=False):
+    """ Read a file up to its pixel data and find where the pixel data lies in the file.
+
+    :param fileNm: str
+    Path of the file.
+    :param force: bool
+    Passed on to dicom.read_file, True to read files without a DICOM preamble (NEMA).
+    :return: [dicom.dataset.FileDataset, int, int]
+    Dataset holding the elements before the pixel data, and the offset and length in bytes of the pixel data. The
+    offset and length are None if the pixel data is missing or compressed, so cannot be mapped from the file.
+    """
+    with open(fileNm, 'rb') as fp:
+        dcm = read_partial(fp, _isPixelData, force=force)
+        if dcm.file_meta.TransferSyntaxUID not in UNCOMPRESSED_TRANSFER_SYNTAXES:
+            return dcm, None, None
+        # read_partial leaves the file at the start of the pixel data element
+        offset = fp.tell()
+        headerLength = 8 if dcm.is_implicit_VR else 12
+        header = fp.read(headerLength)
+    if len(header) < headerLength:
+        return dcm, None, None
+    endian = '<' if dcm.is_little_endian else '>'
+    group, element = struct.unpack(endian + 'HH', header[:4])
+    length = struct.unpack(endian + 'L', header[-4:])[0]
+    if Tag(group, element) != PIXEL_DATA_TAG or length == 0xFFFFFFFF:
+        return dcm, None, None
+    return dcm, offset + headerLength, length
+
+
+def _isPastDiscoveryTags(tag, VR, length):
+    """ stop_when callback for read_partial. """
+    return tag > LAST_DISCOVERY_TAG
+
+
+def _isPixelData(tag, VR, length):
+    """ stop_when callback for read_partial. """
+    return tag == PIXEL_DATA_TAG
@@ -0,0 +1,79 @@
+__author__ = 'medabana'
+
+import dicom
+import os
+
+from DicomReader.HeaderReader import readPixelDataHeader
+from DicomReader.SeriesInfo import parseTimes
+
+# Functions for reading single image files, defined at module level so that they can be used by worker processes.
+
+
+def getFileInfo(file, dcm):
+    """ Return the file info [file, time string, sliceLocation, instanceNumber] from the dataset.
+
+    The time is left as a string so that the times of a whole series can be parsed together.
+    """
+    if 'SliceLocation' in dcm:
+        sliceLocation = float(dcm.SliceLocation)
+    else:
+        sliceLocation = 0.0
+    if 'InstanceNumber' in dcm and dcm.InstanceNumber != '':
+        instanceNumber = int(dcm.InstanceNumber)
+    else:
+        instanceNumber = 0
+    return [file, getImageTimeString(dcm), sliceLocation, instanceNumber]
+
+
+def getImageTime(dcm):
+    """ Get the acquisition time of the file in seconds, as from parseTimes. """
+    return parseTimes([getImageTimeString(dcm)])[0]
+
+
+def getImageTimeString(dcm):
+    """ Get the acquisition time of the file as it is stored. """
+    if 'AcquisitionTime' in dcm:
+        # DICOM
+        return dcm.AcquisitionTime
+    elif 'AcquisitionDateTime' in dcm:
+        # DICOM enhanced
+        return dcm.AcquisitionDateTime
+    elif 'ContentTime' in dcm:
+        # NEMA
+        return dcm.ContentTime
+    else:
+        raise Exception
+
+
+def getPixelArray(dcm):
+    """ Return the image data from the dataset. """
+    if not dcm.dir('SamplesPerPixel'):
+        #required for NEMA for the pixel_array access to work
+        dcm.SamplesPerPixel = 1
+    return dcm.pixel_array
+
+
+def isImageFileComplete(file):
+    """ Return True if the image data of the file can be read, False if it is still being written.
+
+    Uncompressed pixel data is checked against the size of the file, other files are decoded.
+    """
+    try:
+        dcm, offset, numBytes = readPixelDataHeader(file, force=True)
+        if offset is not None:
+            return offset + numBytes <= os.path.getsize(file)
+        readImageData(file)
+    except Exception:
+        return False
+    return True
+
+
+def readFileInfo(file):
+    """ Return the file info [file, time string, sliceLocation, instanceNumber] without reading the image data. """
+    dcm = dicom.read_file(file, stop_before_pixels=True, force=True)
+    return getFileInfo(file, dcm)
+
+
+def readImageData(file):
+    """ Return the image data of the file. """
+    return getPixelArray(dicom.read_file(file, stop_before_pixels=False, force=True))
@@ -0,0 +1,153 @@
+__author__ = 'medabana'
+
+import logging
+import numbers
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from DicomReader.ImageFileReader import readImageData
+
+
+class LazySeries(object):
+    """ A series that reads its images from the files as they are indexed.
+
+    It can be indexed like the [nt x nz, ny, nx] array returned by PatientDirectoryReader.getImageData. Images read
+    on demand are kept in a bounded least recently used frame cache. The whole series can be read into a full array
+    in a background thread, after which indexing reads from that array.
+    """
+    def __init__(self, files, maxFrames=64, onLoaded=None):
+        """
+        :param files: list of str
+        The files of the series, sorted into [nt x nz] order.
+        :param maxFrames: int
+        Number of images read on demand to keep.
+        :param onLoaded: function
+        Called with the full array when the background load finishes.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._files = files
+        self._maxFrames = maxFrames
+        self._onLoaded = onLoaded
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._data = None
+        self._isFrameLoaded = None
+        self._loadThread = None
+        firstImage = readImageData(files[0])
+        self.dtype = firstImage.dtype
+        self.shape = tuple([len(files)] + list(firstImage.shape))
+        self.ndim = len(self.shape)
+        self._storeFrame(0, firstImage)
+
+    def __array__(self, dtype=None):
+        """ Return the full series array, reading any images not yet read. """
+        data = self.loadAll(False)
+        if dtype is not None:
+            return data.astype(dtype)
+        return data
+
+    def __getitem__(self, index):
+        """ Index the series like a [nt x nz, ny, nx] array, reading only the images needed. """
+        if self.isLoaded():
+            return self._data[index]
+        if not isinstance(index, tuple):
+            index = (index,)
+        frameIndex, imageIndex = index[0], index[1:]
+        if isinstance(frameIndex, numbers.Integral):
+            return self._getFrame(int(frameIndex))[imageIndex]
+        frameNums = np.arange(self.shape[0])[frameIndex]
+        frames = np.empty([len(frameNums)] + list(self.shape[1:]), self.dtype)
+        for i, frameNum in enumerate(frameNums):
+            frames[i, :, :] = self._getFrame(frameNum)
+        return frames[(slice(None),) + imageIndex]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def isLoaded(self):
+        """ Return True once every image has been read into the full array. """
+        return self._loadThread is None and self._isFrameLoaded is not None and self._isFrameLoaded.all()
+
+    def loadAll(self, background=True):
+        """ Read every image into the full series array.
+
+        :param background: bool
+        If True read the images in a background thread and return straight away, otherwise wait for them.
+        :return: np.array or None
+        The full array, None if loading in the background.
+        """
+        with self._lock:
+            if self._isFrameLoaded is None:
+                self._data = np.empty(self.shape, self.dtype)
+                self._isFrameLoaded = np.zeros(self.shape[0], np.bool)
+                # images already read do not need reading again
+                for frameNum, frame in self._frames.items():
+                    self._data[frameNum, :, :] = frame
+                    self._isFrameLoaded[frameNum] = True
+                self._frames.clear()
+            if self._loadThread is None and not self._isFrameLoaded.all():
+                self._loadThread = threading.Thread(target=self._loadRemainingFrames)
+                self._loadThread.daemon = True
+                self._loadThread.start()
+            loadThread = self._loadThread
+        if background:
+            return None
+        if loadThread is not None:
+            loadThread.join()
+        return self._data
+
+    def prefetch(self, frameNums):
+        """ Read the images in a background thread so that they are ready when indexed.
+
+        :param frameNums: list of int
+        For example range(startIndex, startIndex + nt) for all the timepoints of a slice.
+        :return: threading.Thread
+        The thread reading the images.
+        """
+        def readFrames():
+            for frameNum in frameNums:
+                self._getFrame(frameNum)
+
+        thread = threading.Thread(target=readFrames)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _getFrame(self, frameNum):
+        """ Return an image, reading it from its file if it has not been read. """
+        with self._lock:
+            if self._isFrameLoaded is not None and self._isFrameLoaded[frameNum]:
+                return self._data[frameNum]
+            if frameNum in self._frames:
+                frame = self._frames.pop(frameNum)
+                self._frames[frameNum] = frame
+                return frame
+        frame = readImageData(self._files[frameNum])
+        with self._lock:
+            self._storeFrame(frameNum, frame)
+        return frame
+
+    def _loadRemainingFrames(self):
+        """ Read every image not already in the full array. Runs in the background thread. """
+        for frameNum in range(0, self.shape[0]):
+            if not self._isFrameLoaded[frameNum]:
+                frame = readImageData(self._files[frameNum])
+                with self._lock:
+                    self._data[frameNum, :, :] = frame
+                    self._isFrameLoaded[frameNum] = True
+        self._logger.info('read all %i images' % self.shape[0])
+        with self._lock:
+            self._loadThread = None
+        if self._onLoaded is not None:
+            self._onLoaded(self._data)
+
+    def _storeFrame(self, frameNum, frame):
+        """ Keep an image read on demand. Must be called holding the lock. """
+        if self._isFrameLoaded is not None:
+            self._data[frameNum, :, :] = frame
+            self._isFrameLoaded[frameNum] = True
+            return
+        self._frames[frameNum] = frame
+        while len(self._frames) > self._maxFrames:
+            self._frames.popitem(last=False)
@@ -1,11 +1,45 @@
 __author__ = 'medabana'
 
+import ctypes
 import dicom
 import logging
+import multiprocessing
 import os
+import threading
 import numpy as np
-from datetime import datetime
-from collections import Counter
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
+
+from DicomReader.EnhancedFileReader import getFrameInfo, readEnhancedPixelData
+from DicomReader.HeaderReader import readPixelDataHeader
+from DicomReader.ImageFileReader import getFileInfo, getPixelArray, readFileInfo, readImageData
+from DicomReader.LazySeries import LazySeries
+from DicomReader.SeriesCache import SeriesCache
+from DicomReader.SeriesInfo import SeriesInfo
+
+
+# The series array shared with the decoding worker processes, set by _initSharedSeriesData.
+_sharedSeriesData = None
+# Number of file headers read between calls to a header progress function, which can cancel the load.
+_headerBatchSize = 256
+
+
+def _initSharedSeriesData(buffer, dtype, shape):
+    """ Pool initializer that wraps the shared memory buffer as the series array in a worker process. """
+    global _sharedSeriesData
+    _sharedSeriesData = np.frombuffer(buffer, dtype).reshape(shape)
+
+
+def _readImageIntoSharedSeriesData(args):
+    """ Read the image data of a file into its place in the shared series array and return its index. """
+    index, file = args
+    _sharedSeriesData[index, :, :] = readImageData(file)
+    return index
+
+
+class SeriesLoadCancelled(Exception):
+    """ Raised by getImageData when its progress function cancels the load. """
+
 
 class PatientDirectoryReader(object):
     """ Responsible for reading image and series data and information. """
@@ -17,54 +51,110 @@ class PatientDirectoryReader(object):
         self._suidNum = 0
         self._filesForSuid = {}
         self._suidAndTimeForProtocols = {}
-        self._fileInfoForSuid = {}
+        self._seriesInfoForSuid = {}
         self._protNamesOrdered = []
         self._sequenceParameters = {}
-        # only keep one set of data at a time for memory purposes
-        self._data = None
-        self._dataSuid = None
+        # decoded series, by default only one is kept at a time for memory purposes
+        self._seriesCache = SeriesCache()
+        self._diskCache = None
+        self._numDecodeWorkers = 1
+        self._decodeProcesses = False
+        self._decodePool = None
+
+    def evict(self, protName=None):
+        """ Remove the image data for the series, or for all series if no name is given, from memory.
+
+        :param protName: str
+        :return:
+        """
+        if protName is None:
+            self._seriesCache.evict()
+        else:
+            self._seriesCache.evict(self._suidAndTimeForProtocols[protName][0])
+
+    def getCacheStatistics(self):
+        """ Return the hit, miss and eviction counts and memory use of the series cache.
+
+        :return: dict
+        """
+        return self._seriesCache.getStatistics()
+
+    def getImageData(self, protName, progress=None, onImageRead=None, headerProgress=None, deferDiskCache=False):
+        """ Get the image data for the series.
 
-    def getImageData(self, protName):
-        """ Get the image data for the series. """
+        :param protName: str
+        :param progress: function
+        Optional function called as progress(numRead, numFiles, seriesData) after each file is read, where seriesData
+        is the series array being filled, so that the images read so far can be shown. Images not yet read are zero.
+        If it returns False the load is abandoned and SeriesLoadCancelled is raised. It is called from the thread
+        calling getImageData.
+        :param onImageRead: function
+        Optional function called as onImageRead(index, seriesData) once each image is in place in the series array,
+        in the order they are read, such as MapAccumulator.addImage. It is called from the thread calling
+        getImageData, and not at all for series already read or in the disk cache.
+        :param headerProgress: function
+        Optional function called as headerProgress(numRead, numFiles) as the file headers are read to sort the
+        series, before the series array is allocated. If it returns False the load is abandoned and
+        SeriesLoadCancelled is raised.
+        :param deferDiskCache: bool
+        If True a series that is read is not written to the disk cache before returning. Call saveToDiskCache once
+        the series has been handed over.
+        :return: np.array
+        [nt x nz, ny, nx]
+        """
         suid= self._suidAndTimeForProtocols[protName][0]
-        if self._dataSuid != suid:
+        data = self._seriesCache.get(suid)
+        if data is None:
             self._logger.info('getImageData %s' % protName)
-            self._setSeriesInfoAndData(suid)
-        return self._data
+            data = self._setSeriesInfoAndData(suid, progress, onImageRead, headerProgress, not deferDiskCache)
+        return data
+
+    def getLazyImageData(self, protName, loadInBackground=True, maxFrames=64):
+        """ Get the image data for the series as a LazySeries, which reads each image when it is first indexed.
+
+        Only the file headers are read before returning, so the first image can be shown without waiting for the
+        whole series. Series that are already in memory or the disk cache, or are a single file, are returned as
+        arrays.
+        :param protName: str
+        :param loadInBackground: bool
+        If True start reading the whole series in a background thread. It is added to the series cache when done.
+        :param maxFrames: int
+        Number of images read on demand to keep.
+        :return: LazySeries or np.array
+        [nt x nz, ny, nx]
+        """
+        suid= self._suidAndTimeForProtocols[protName][0]
+        if suid in self._seriesCache or len(self._filesForSuid[suid]) == 1:
+            return self.getImageData(protName)
+        seriesData = self._loadFromDiskCache(suid)
+        if seriesData is not None:
+            return seriesData
+        series = LazySeries(self._getSeriesInfo(suid).getFileNames(), maxFrames,
+                            lambda seriesData: self._storeSeriesData(suid, seriesData))
+        if loadInBackground:
+            series.loadAll()
+        return series
 
     def getOrderedFileList(self, protName):
-        """ Return and ordered list of files for the series. """
+        """ Return and ordered list of files for the series.
+
+        The list is a FileNameSequence kept with the series info, so it is not rebuilt on each call.
+        """
         suid= self._suidAndTimeForProtocols[protName][0]
-        if suid not in self._fileInfoForSuid:
-            self._setSeriesInfoAndData(suid)
-        infoSorted = self._fileInfoForSuid[suid]
-        fileList = []
-        for i, file in enumerate(infoSorted):
-            fileList.append(file[0])
-        return fileList
+        return self._getSeriesInfo(suid).getFileNames()
 
     def getSequenceParameters(self, protName):
         " Get the matrix dimensions and number of timepoints for the series. "
         if protName not in self._sequenceParameters:
-            fileInfo= self._fileInfoForSuid[self._suidAndTimeForProtocols[protName][0]]
-            dcm = dicom.read_file(os.path.join(self._dirNm, fileInfo[0][0]), stop_before_pixels=True, force= True)
-            acquisitionTimes= []
-            sliceLocations= []
-            for file in fileInfo:
-                acquisitionTimes.append(file[1])
-                sliceLocations.append(file[2])
+            seriesInfo = self._getSeriesInfo(self._suidAndTimeForProtocols[protName][0])
+            dcm = dicom.read_file(os.path.join(self._dirNm, seriesInfo.getFileName(0)), stop_before_pixels=True,
+                                  force= True)
             if self._getFileType(dcm) != 'enhancedDICOM':
-                nt = Counter(sliceLocations)[sliceLocations[0]]
-                nz = Counter(acquisitionTimes)[acquisitionTimes[0]]
-                # for unusual cases e.g. bold
-                if nz*nt > len(fileInfo):
-                    nt= len(fileInfo)/nz
+                nz, nt = seriesInfo.getDimensions()
             else:
                 nf = dcm.NumberOfFrames
-                nz= dcm.PerFrameFunctionalGroupsSequence[nf-1].FrameContentSequence[0].DimensionIndexValues[2]
-                # could get the nt from the DimensionIndexValues[3] array for a 4D image, but for a 3D image this
-                # will not exist
-                nt= nf / nz
+                nz = len(np.unique(getFrameInfo(dcm)[1]))
+                nt = nf // nz
             self._sequenceParameters[protName]= [dcm.Rows, dcm.Columns, nz, nt]
         return self._sequenceParameters[protName]
 
@@ -72,22 +162,92 @@ class PatientDirectoryReader(object):
         """ Return the names of all the series. """
         return self._protNamesOrdered
 
+    def saveToDiskCache(self, protName):
+        """ Write the series to the disk cache if there is one and the series is in memory, as when getImageData was
+        called with deferDiskCache.
+
+        :param protName: str
+        :return:
+        """
+        suid= self._suidAndTimeForProtocols[protName][0]
+        if suid in self._seriesCache:
+            self._saveToDiskCache(suid, self._seriesCache.get(suid))
+
+    def setCacheSize(self, maxBytes):
+        """ Set the memory ceiling for the decoded series kept for switching between series.
+
+        The least recently used series are removed first. The series most recently read is always kept.
+        :param maxBytes: int
+        :return:
+        """
+        self._seriesCache.maxBytes = maxBytes
+        self._seriesCache.reserve(0)
+
+    def setDecodeWorkers(self, numWorkers, useProcesses=False):
+        """ Set the number of workers used to read the files of a series.
+
+        :param numWorkers: int
+        Number of workers. 1 reads the files one after another.
+        :param useProcesses: bool
+        If True the files are read by worker processes which write the images into a shared memory series array,
+        otherwise by threads. The processes are started for each series, as the shared array can only be given to
+        them as they start.
+        :return:
+        """
+        if self._decodePool is not None:
+            self._decodePool.terminate()
+            self._decodePool = None
+        self._numDecodeWorkers = numWorkers
+        self._decodeProcesses = useProcesses
+
+    def setDiskCache(self, diskCache):
+        """ Set the cache used to store decoded series on disk.
+
+        Series found in the disk cache are returned as read-only memory maps instead of being decoded.
+        :param diskCache: DiskSeriesCache
+        None to stop using a disk cache.
+        :return:
+        """
+        self._diskCache = diskCache
+
+    def _chunkSize(self, numFiles):
+        """ Return the number of files handed to a worker at a time, several chunks per worker to balance the load. """
+        return max(1, numFiles // (4*self._numDecodeWorkers))
+
+    def _clearSeries(self, suid):
+        """ Forget the sorted file info, sequence parameters and image data of a series, so they are read again. """
+        for protName, suidAndTime in self._suidAndTimeForProtocols.items():
+            if suidAndTime[0] == suid:
+                self._sequenceParameters.pop(protName, None)
+        self._seriesInfoForSuid.pop(suid, None)
+        self._seriesCache.evict(suid)
+
+    def _getDecodePool(self):
+        """ Return the pool of decoding workers, starting it if needed.
+
+        The pool is kept for the life of the reader as starting one takes longer than reading a small series. It is
+        used for reading headers and, with threads, for decoding. Process workers decode a series into a shared memory
+        array instead, which can only be handed to a process when it starts, so _readSortedImageData starts a pool
+        of its own for each series.
+        """
+        if self._decodePool is None:
+            if self._decodeProcesses:
+                self._decodePool = multiprocessing.Pool(self._numDecodeWorkers)
+            else:
+                self._decodePool = ThreadPool(self._numDecodeWorkers)
+        return self._decodePool
+
     def _getFileInfoAndData(self, file):
         """ Return the image data and file info.
 
-        Assumes all files are safe to read image format.
+        Assumes all files are safe to read image format. The frames of enhanced multiframe files are sorted into
+        [nt x nz] order.
         """
-        dcm= dicom.read_file(file, stop_before_pixels=False, force=True)
-        if not dcm.dir('SamplesPerPixel'):
-            #required for NEMA for the pixel_array access to work
-            dcm.SamplesPerPixel = 1
-        if 'SliceLocation' in dcm:
-            sliceLocation = dcm.SliceLocation
-        else:
-            sliceLocation = 0
-        imageData = dcm.pixel_array
-        fileInfo = [file, self._getImageTime(dcm), sliceLocation]
-        return fileInfo, imageData
+        dcm, offset, numBytes = readPixelDataHeader(file, force=True)
+        if 'PerFrameFunctionalGroupsSequence' in dcm:
+            return getFileInfo(file, dcm), readEnhancedPixelData(file, dcm, offset, numBytes)
+        dcm = dicom.read_file(file, stop_before_pixels=False, force=True)
+        return getFileInfo(file, dcm), getPixelArray(dcm)
 
     def _getFileType(self, dcm):
         """ Check whether the file is DICOM, multiframe DICOM or NEMA."""
@@ -101,57 +261,186 @@ class PatientDirectoryReader(object):
                 self._fileType= 'NEMA'
         return self._fileType
 
-    def _getImageTime(self, dcm):
-        """ Get the acquisition time of the file. """
-        if 'AcquisitionTime' in dcm:
-            # DICOM
-            acqTime = dcm.AcquisitionTime
-        elif 'AcquisitionDateTime' in dcm:
-            # DICOM enhanced
-            acqTime= dcm.AcquisitionDateTime
-        elif 'ContentTime' in dcm:
-            # NEMA
-            acqTime = dcm.ContentTime
+    def _getSeriesInfo(self, suid, headerProgress=None):
+        """ Return the file info for the series sorted by slice location and time, reading the headers if needed.
+
+        :param headerProgress: function
+        See getImageData. The headers are read in batches, so it is called after each batch.
+        :return: SeriesInfo
+        """
+        if suid not in self._seriesInfoForSuid:
+            files = [os.path.join(self._dirNm, file) for file in self._filesForSuid[suid]]
+            batchSize = _headerBatchSize if headerProgress is not None else max(1, len(files))
+            seriesFileInfo = []
+            for start in range(0, len(files), batchSize):
+                seriesFileInfo += self._mapFiles(readFileInfo, files[start:start + batchSize])
+                if headerProgress is not None and headerProgress(len(seriesFileInfo), len(files)) is False:
+                    self._logger.info('load cancelled after %i of %i headers' % (len(seriesFileInfo), len(files)))
+                    raise SeriesLoadCancelled()
+            self._seriesInfoForSuid[suid] = SeriesInfo.fromFileInfo(seriesFileInfo)
+        return self._seriesInfoForSuid[suid]
+
+    def _loadFromDiskCache(self, suid):
+        """ Return the series from the disk cache, setting its file info, or None if it is not cached. """
+        if self._diskCache is None:
+            return None
+        cached = self._diskCache.load(suid, [os.path.join(self._dirNm, file) for file in self._filesForSuid[suid]])
+        if cached is None:
+            return None
+        seriesData, seriesInfo = cached
+        if not isinstance(seriesInfo, dict):
+            return None  # written in the older list form
+        self._seriesInfoForSuid[suid] = SeriesInfo.fromDict(seriesInfo)
+        self._seriesCache.put(suid, seriesData)
+        return seriesData
+
+    def _mapFiles(self, function, args):
+        """ Apply a function to each argument using the decoding workers.
+
+        The function must be defined at module level when the workers are processes.
+
+        :return: list
+        The results in the same order as args.
+        """
+        if self._numDecodeWorkers <= 1 or len(args) < 2:
+            return [function(arg) for arg in args]
+        return self._getDecodePool().map(function, args, self._chunkSize(len(args)))
+
+    def _readSortedImageData(self, files, progress=None, onImageRead=None):
+        """ Read the image data of the files into a single array in the order given.
+
+        :param files: list of str
+        :param progress: function
+        See getImageData.
+        :param onImageRead: function
+        See getImageData.
+        :return: np.array
+        3D array [number of files, ny, nx]
+        """
+        firstImage = readImageData(files[0])
+        shape = [len(files)] + list(firstImage.shape)
+        # make room for the new series before allocating it
+        self._seriesCache.reserve(int(np.prod(shape)) * firstImage.dtype.itemsize)
+        numWorkers = self._numDecodeWorkers
+        args = list(enumerate(files))[1:]
+        if numWorkers > 1 and len(files) > 1 and self._decodeProcesses:
+            # the workers write into shared memory so the images are not pickled back to this process. A RawArray can
+            # only be passed to a worker process as it starts, not with a task, so these workers are started for this
+            # series rather than taken from the persistent decode pool.
+            buffer = RawArray(ctypes.c_char, int(np.prod(shape)) * firstImage.dtype.itemsize)
+            seriesData = np.frombuffer(buffer, firstImage.dtype).reshape(shape)
+            seriesData[0, :, :] = firstImage
+            self._reportImageRead(progress, onImageRead, 1, 0, seriesData)
+            pool = multiprocessing.Pool(numWorkers, _initSharedSeriesData, (buffer, firstImage.dtype.str, shape))
+            try:
+                results = pool.imap_unordered(_readImageIntoSharedSeriesData, args, self._chunkSize(len(files)))
+                for numRead, index in enumerate(results, 2):
+                    self._reportImageRead(progress, onImageRead, numRead, index, seriesData)
+            finally:
+                # every image has been read unless the load was cancelled or failed
+                pool.terminate()
+                pool.join()
+            return seriesData
+        # zeroed so that images not yet read show as blank while loading
+        seriesData = np.zeros(shape, firstImage.dtype)
+        seriesData[0, :, :] = firstImage
+        self._reportImageRead(progress, onImageRead, 1, 0, seriesData)
+        cancelled = threading.Event()
+
+        def readImageIntoSeriesData(args):
+            index, file = args
+            # files still queued for the workers when the load is cancelled are skipped
+            if not cancelled.is_set():
+                seriesData[index, :, :] = readImageData(file)
+            return index
+
+        if numWorkers <= 1 or len(files) < 2:
+            results = (readImageIntoSeriesData(arg) for arg in args)
         else:
-            raise Exception
+            results = self._getDecodePool().imap_unordered(readImageIntoSeriesData, args,
+                                                           self._chunkSize(len(files)))
         try:
-            x = datetime.strptime(acqTime,'%H:%M:%S.%f')
-            time = (x.hour * 60 + x.minute) * 60 + x.second + x.microsecond / 1000000.0
-        except ValueError:
-            time = float(acqTime)
-        return time
-
-    def _setSeriesInfoAndData(self, suid):
-        """ Set the image data for the series and the information for series. """
+            for numRead, index in enumerate(results, 2):
+                self._reportImageRead(progress, onImageRead, numRead, index, seriesData)
+        except SeriesLoadCancelled:
+            cancelled.set()
+            raise
+        return seriesData
+
+    def _reportImageRead(self, progress, onImageRead, numRead, index, seriesData):
+        """ Pass an image read to onImageRead and report the progress. """
+        if onImageRead is not None:
+            onImageRead(index, seriesData)
+        self._reportProgress(progress, numRead, seriesData)
+
+    def _reportProgress(self, progress, numRead, seriesData):
+        """ Call the progress function, raising SeriesLoadCancelled if it asks for the load to stop. """
+        if progress is not None and progress(numRead, seriesData.shape[0], seriesData) is False:
+            self._logger.info('load cancelled after %i of %i files' % (numRead, seriesData.shape[0]))
+            raise SeriesLoadCancelled()
+
+    def _saveToDiskCache(self, suid, seriesData):
+        """ Write the decoded series to the disk cache, if there is one. """
+        # series mapped straight from their files, or from the disk cache, gain nothing from it
+        if self._diskCache is not None and not isinstance(seriesData, np.memmap):
+            self._diskCache.save(suid, [os.path.join(self._dirNm, file) for file in self._filesForSuid[suid]],
+                                 seriesData, self._seriesInfoForSuid[suid].toDict())
+
+    def _setSeriesInfoAndData(self, suid, progress=None, onImageRead=None, headerProgress=None, cacheOnDisk=True):
+        """ Set the image data for the series and the information for series, and return the image data.
+
+        The series is written to the disk cache as well if cacheOnDisk is True. The file headers are read and sorted first so that each image can be read straight into its place in the
+        series array, which avoids holding a second sorted copy of the series.
+        """
+        seriesData = self._loadFromDiskCache(suid)
+        if seriesData is not None:
+            return seriesData
         fileNames= self._filesForSuid[suid]
-        seriesFileInfo= []
-        # release data memory first
-        self._data = None
-        for i, file in enumerate(fileNames):
-            fileNm= os.path.join(self._dirNm, file)
-            fileInfo, fileData= self._getFileInfoAndData(fileNm)
-            seriesFileInfo.append(fileInfo)
-            if len(fileNames) > 1:
-                if i == 0:
-                    dcm= dicom.read_file(fileNm, stop_before_pixels=False, force=True)
-                    if not dcm.dir('SamplesPerPixel'):
-                        # required for pixel_array access (NEMA)
-                        dcm.SamplesPerPixel = 1
-                    seriesData = np.zeros([len(fileNames), dcm.Rows, dcm.Columns], dcm.pixel_array.dtype)
-                    print dcm.Rows, dcm.Columns
-                seriesData[i, :, :] = fileData
-            else:
-                seriesData= fileData
-        if len(fileNames) > 1:
-            infoSortedWithIndex = sorted(enumerate(seriesFileInfo), key=lambda info: (info[1][2], info[1][1]))
-            sortIndex = []
-            infoSorted = []
-            for info in infoSortedWithIndex:
-                sortIndex.append(info[0])
-                infoSorted.append(info[1])
-            self._fileInfoForSuid[suid] = infoSorted
-            self._data = seriesData[sortIndex, :, :]
+        if len(fileNames) == 1:
+            fileInfo, seriesData = self._getFileInfoAndData(os.path.join(self._dirNm, fileNames[0]))
+            self._seriesInfoForSuid[suid] = SeriesInfo.fromFileInfo([fileInfo])
         else:
-            self._fileInfoForSuid[suid] = seriesFileInfo
-            self._data = seriesData
-        self._dataSuid = suid
\ No newline at end of file
+            seriesData = self._readSortedImageData(self._getSeriesInfo(suid, headerProgress).getFileNames(), progress,
+                                                   onImageRead)
+        self._storeSeriesData(suid, seriesData, cacheOnDisk)
+        return seriesData
+
+    def _storeSeriesData(self, suid, seriesData, cacheOnDisk=True):
+        """ Keep the decoded series in memory and, if cacheOnDisk is True, in the disk cache. """
+        if cacheOnDisk:
+            self._saveToDiskCache(suid, seriesData)
+        self._seriesCache.put(suid, seriesData)
+
+    def _updateSeriesFiles(self, suid, fileNames):
+        """ Bring the sorted file info and decoded image data of a series up to date after files are added or changed.
+
+        Only the headers and images of the given files are read. The images already decoded are copied into their
+        places in the extended series array. The new images are decoded before the series in memory is replaced, so
+        it is kept if they cannot be read.
+        :param suid: str
+        :param fileNames: list of str
+        Files of the series which are new or have changed.
+        """
+        oldInfo = self._seriesInfoForSuid.get(suid)
+        oldData = self._seriesCache.get(suid) if suid in self._seriesCache else None
+        # single file series, such as enhanced multiframe files, are read again when next needed
+        if oldInfo is None or oldData is None or len(oldInfo) == 1:
+            self._clearSeries(suid)
+            return
+        changedFiles = sorted(set(os.path.join(self._dirNm, file) for file in fileNames))
+        seriesInfo = oldInfo.updated(self._mapFiles(readFileInfo, changedFiles))
+        sortedFileNames = seriesInfo.getFileNames()
+        changedFiles = set(changedFiles)
+        readIndices = [i for i, fileNm in enumerate(sortedFileNames) if fileNm in changedFiles]
+        images = self._mapFiles(readImageData, [sortedFileNames[i] for i in readIndices])
+
+        oldIndexForFile = dict((fileNm, i) for i, fileNm in enumerate(oldInfo.getFileNames()))
+        keptIndices = [i for i, fileNm in enumerate(sortedFileNames) if fileNm not in changedFiles]
+        seriesData = np.zeros([len(seriesInfo)] + list(oldData.shape[1:]), oldData.dtype)
+        seriesData[keptIndices] = oldData[[oldIndexForFile[sortedFileNames[i]] for i in keptIndices]]
+        for i, image in zip(readIndices, images):
+            seriesData[i, :, :] = image
+        self._clearSeries(suid)
+        self._seriesInfoForSuid[suid] = seriesInfo
+        self._logger.info('extended series %s from %i to %i images' % (suid, len(oldInfo), len(seriesInfo)))
+        self._storeSeriesData(suid, seriesData)
@@ -1,81 +1,307 @@
 __author__ = 'medabana'
 
 import dicom
+import multiprocessing
 import os
+from collections import Counter
 
+from DicomReader.DirectoryWatcher import DirectoryWatcher
+from DicomReader.FileSniffer import sniffFileType
+from DicomReader.HeaderReader import readDiscoveryHeader
+from DicomReader.ImageFileReader import getImageTime, isImageFileComplete
 from DicomReader.PatientDirectoryReader import PatientDirectoryReader
 
+# The file types each established series file type will accept. 'otherDICOM' files have a DICOM preamble but are
+# not MR images, they are only accepted once the directory is known to hold DICOM.
+_acceptedFileTypes = {None: ('DICOM', 'enhancedDICOM', 'NEMA'),
+                      'DICOM': ('DICOM', 'enhancedDICOM', 'otherDICOM'),
+                      'enhancedDICOM': ('DICOM', 'enhancedDICOM', 'otherDICOM'),
+                      'NEMA': ('NEMA',)}
+
+
 class RecursiveDirectoryReader(PatientDirectoryReader):
     """Responsible for reading image data when there is not a DICOMDIR file."""
-    def __init__(self, dirNm):
+    def __init__(self, dirNm, headerOnly=True, numWorkers=1, index=None):
+        """
+        :param dirNm: str
+        The directory to search for image series.
+        :param headerOnly: bool
+        If True only the tags needed to identify the series are read from each file during the search,
+        otherwise every file is read in full.
+        :param numWorkers: int
+        Number of processes used to read the files. 1 reads them in this process.
+        :param index: StudyIndex
+        Optional persistent index. Only files that are not in the index, or have changed since they were indexed,
+        are read.
+        """
         PatientDirectoryReader.__init__(self, dirNm)
+        self._headerOnly = headerOnly
+        self._numWorkers = numWorkers
+        self._index = index
+        self._numFilesRead = 0
+        self._skipCounts = Counter()
+        # modification time and size of every file found, for finding changed files on refresh
+        self._fileStats = {}
+        # image files which were incomplete when last read, read again on every refresh until they are complete
+        self._pendingFiles = set()
+        # the files of each series as a set, for finding whether a changed file is already in its series
+        self._fileSetForSuid = {}
+        self._watcher = None
+        self._listOnNextRefresh = False
         self._gatherSeriesFileNames(dirNm)
 
+    def getSkipCounts(self):
+        """ Return the number of files skipped during the search for each reason.
+
+        'notDicom': the first bytes are not those of a DICOM or NEMA file, so the file was not parsed.
+        'unreadable': the file could not be parsed.
+        'notNema': a file without a preamble that is not ACR-NEMA 2.0.
+        'noSeriesInformation': the series description, series instance uid or acquisition time is missing.
+        'fileType': not an image of the directory's file type, such as a DICOM file that is not an MR image.
+        'indexed': recorded as not an image in the index, so not read again.
+        :return: dict
+        """
+        return dict(self._skipCounts)
+
+    def refresh(self):
+        """ Add the files that have arrived or changed since the directory was last searched.
+
+        Only the new and changed files are read. They are added to their series, or start new series, and the image
+        data of a series already in memory is extended with their images without reading the rest of the series
+        again. Files that have been removed are not taken out of their series. Image files whose pixel data cannot be
+        read yet, or which change while they are read, are left out until a later refresh finds them complete.
+        The files are found by listing the directory and comparing the modification times and sizes with those from
+        the last search, or from the directory watcher if setWatching has been used.
+        :return: list of str
+        Names of the series which are new or have new files.
+        """
+        if self._watcher is not None and not self._listOnNextRefresh:
+            fileNames = self._watcher.getChangedFiles()
+        else:
+            fileNames = self._listFilesRecursive(self._dirNm)
+            self._listOnNextRefresh = False
+        fileNames = list(fileNames) + sorted(self._pendingFiles.difference(fileNames))
+        changedFileNames = []
+        for fileNm in fileNames:
+            try:
+                fileStat = _getFileStat(fileNm)
+            except OSError:
+                self._pendingFiles.discard(fileNm)
+                continue  # removed since it was found
+            if self._fileStats.get(fileNm) != fileStat or fileNm in self._pendingFiles:
+                self._fileStats[fileNm] = fileStat
+                changedFileNames.append(fileNm)
+        records = self._readSeriesRecords(changedFileNames)
+        self._numFilesRead = len(changedFileNames)
+        self._logger.info('refresh read %i files' % len(changedFileNames))
+        changedFileNames, records = self._removeIncompleteFiles(changedFileNames, records)
+        if self._index is not None and changedFileNames:
+            self._index.setSeriesRecords(dict(zip(changedFileNames, records)))
+        changedFilesForSuid = {}
+        for fileNm, record in zip(changedFileNames, records):
+            suid = self._addSeriesRecord(fileNm, record)
+            if suid is not None:
+                changedFilesForSuid.setdefault(suid, []).append(fileNm)
+        self._sortSeriesNames()
+        for suid, seriesFileNames in changedFilesForSuid.items():
+            self._updateSeriesFiles(suid, seriesFileNames)
+        return [protName for protName in self._protNamesOrdered
+                if self._suidAndTimeForProtocols[protName][0] in changedFilesForSuid]
+
+    def setWatching(self, watch):
+        """ Find the files for refresh with an inotify directory watcher instead of listing the directory.
+
+        :param watch: bool
+        :return: bool
+        True if the directory is being watched, False if not, or if pyinotify is not available.
+        """
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        if watch and DirectoryWatcher.isAvailable():
+            self._watcher = DirectoryWatcher(self._dirNm)
+            # catch the files written before the watch started
+            self._listOnNextRefresh = True
+        return self._watcher is not None
+
+    def _addSeriesRecord(self, fileNm, record):
+        """ Add a file to its series, skipping files that are not images of the directory's file type.
+
+        :param fileNm: str
+        :param record: [str, str, str, float] or None
+        File type, protocol name, series instance uid and acquisition time as returned by readSeriesRecordAndSkipReason.
+        :return: str or None
+        Series instance uid of the series the file is in, None if it was skipped.
+        """
+        if record is None:
+            return  # skip non-dicom file
+        if record[0] not in _acceptedFileTypes[self._fileType]:
+            self._skipCounts['fileType'] += 1
+            return
+        fileType, protName, suid, time = record
+        if self._fileType is None:
+            self._fileType = fileType
+        if self._fileType == 'NEMA':
+            suid = suid[:-3]
+        if suid not in self._filesForSuid:
+            self._filesForSuid[suid] = [fileNm]
+            self._fileSetForSuid[suid] = set([fileNm])
+            self._suidNum += 1
+            protName = str(self._suidNum) + ": " + protName
+            self._suidAndTimeForProtocols[protName] = [suid, time]
+        elif fileNm not in self._fileSetForSuid[suid]:
+            self._filesForSuid[suid].append(fileNm)
+            self._fileSetForSuid[suid].add(fileNm)
+        return suid
+
     def _gatherSeriesFileNames(self, dcmDir):
         """ Get the series information, and generate a sorted list of names."""
         self._gatherSeriesFileNamesRecursive(dcmDir)
-        seriesSorted = sorted(self._suidAndTimeForProtocols.items(), key=lambda info: info[1])
-        for i, series in enumerate(seriesSorted):
-            self._protNamesOrdered.append(series[0])
+        self._sortSeriesNames()
 
     def _gatherSeriesFileNamesRecursive(self, dirNm):
-        """ Search the directory structure recursively and record information about the image series."""
-        files = os.listdir(dirNm)
-        for file in files:
+        """ Search the directory structure recursively and record information about the image series.
+
+        The files are read in parallel when there is more than one worker, but the series records are always
+        added in the order the files were found so the series numbering does not depend on the number of workers.
+        """
+        fileNames = self._listFilesRecursive(dirNm)
+        self._fileStats = dict((fileNm, _getFileStat(fileNm)) for fileNm in fileNames)
+        records = {}
+        if self._index is not None:
+            records = self._index.getSeriesRecords(fileNames)
+        newFileNames = [fileNm for fileNm in fileNames if fileNm not in records]
+        newRecords = dict(zip(newFileNames, self._readSeriesRecords(newFileNames)))
+        if self._index is not None and newRecords:
+            self._index.setSeriesRecords(newRecords)
+        numIndexedSkips = sum(1 for record in records.values() if record is None)
+        if numIndexedSkips:
+            self._skipCounts['indexed'] += numIndexedSkips
+        records.update(newRecords)
+        self._numFilesRead = len(newFileNames)
+        self._logger.info('read %i of %i files' % (len(newFileNames), len(fileNames)))
+        for fileNm in fileNames:
+            self._addSeriesRecord(fileNm, records[fileNm])
+        if self._skipCounts:
+            self._logger.info('skipped files %s' % dict(self._skipCounts))
+
+    def _listFilesRecursive(self, dirNm):
+        """ Return the paths of all the files below the directory in search order. """
+        fileNames = []
+        for file in os.listdir(dirNm):
             fileNm = os.path.join(dirNm, file)
             if not os.path.isdir(fileNm):
-                try:
-                    protName, suid, time= self._readImFileProtNameSuid(fileNm)
-                    if self._fileType == 'NEMA':
-                        suid= suid[:-3]
-                except:
-                    continue  # skip non-dicom file
-                if suid not in self._filesForSuid:
-                    self._filesForSuid[suid]= [fileNm]
-                    self._suidNum += 1
-                    protName = str(self._suidNum) + ": " + protName
-                    self._suidAndTimeForProtocols[protName] = [suid, time]
-                else:
-                    self._filesForSuid[suid].append(fileNm)
-                # print protName, ": ", fileInfo, " ", suid
+                fileNames.append(fileNm)
             else:
-                self._gatherSeriesFileNamesRecursive(fileNm)
+                fileNames.extend(self._listFilesRecursive(fileNm))
+        return fileNames
 
-    def _readImFileProtNameSuid(self, file):
-        """ Get the protocol information from the given file. """
-        if self._fileType == 'DICOM' or self._fileType is None:
+    def _readSeriesRecords(self, fileNames):
+        """ Read the series record of every file, sharing the files between the worker processes.
+
+        The reasons files are not images are added to the skip counts.
+        :return: list
+        The records in the same order as fileNames.
+        """
+        args = [(fileNm, self._headerOnly) for fileNm in fileNames]
+        if self._numWorkers <= 1 or len(fileNames) < 2:
+            results = [_readSeriesRecordArgs(arg) for arg in args]
+        else:
+            # several chunks per worker so a slow directory does not hold up a single worker
+            chunkSize = max(1, len(fileNames) // (4*self._numWorkers))
+            pool = multiprocessing.Pool(self._numWorkers)
             try:
-                dcm = dicom.read_file(file, stop_before_pixels=False, force=False)
-                if self._fileType is None:
-                    if 'Enhanced' in str(dcm.SOPClassUID):
-                        self._fileType = 'enhancedDICOM'
-                    elif 'MR Image' in str(dcm.SOPClassUID):
-                        self._fileType = 'DICOM'
-            except Exception as why:
-                if self._fileType == 'DICOM':
-                    # print file + " ", why
-                    raise Exception
-        if self._fileType == 'NEMA' or self._fileType is None:
+                results = pool.map(_readSeriesRecordArgs, args, chunkSize)
+            finally:
+                pool.close()
+                pool.join()
+        self._skipCounts.update(skipReason for record, skipReason in results if skipReason is not None)
+        return [record for record, skipReason in results]
+
+    def _removeIncompleteFiles(self, fileNames, records):
+        """ Leave out the image files which are still being written, keeping them pending so that they are read again
+        on the next refresh.
+
+        :param fileNames: list of str
+        :param records: list
+        The series records of the files.
+        :return: [list of str, list]
+        The files and records which are complete.
+        """
+        imageFileNames = [fileNm for fileNm, record in zip(fileNames, records) if record is not None]
+        self._pendingFiles.difference_update(fileNames)
+        isComplete = dict(zip(imageFileNames, self._mapFiles(isImageFileComplete, imageFileNames)))
+        for fileNm in imageFileNames:
             try:
-                dcm = dicom.read_file(file, stop_before_pixels=False, force=True)
-                try:
-                    #need to do this check on all files opened, as the force=True
-                    #option will open all sorts of files
-                    if dcm.RecognitionCode == 'ACR-NEMA 2.0':
-                        if self._fileType is None:
-                            self._fileType= 'NEMA'
-                        #required for the pixel_array access to work
-                        if not dcm.dir('SamplesPerPixel'):
-                            dcm.SamplesPerPixel= 1
-                except Exception:
-                    raise Exception
-            except Exception as why:
-                    # print file + " ", why
-                    raise Exception
-        try:
-            protName = dcm.SeriesDescription
-        except Exception as why:
-            # print file + " ", why
-            raise Exception
-        return protName.lstrip(), dcm.SeriesInstanceUID, self._getImageTime(dcm)
+                # a file whose size or modification time has changed since it was found is still being written
+                isComplete[fileNm] = isComplete[fileNm] and _getFileStat(fileNm) == self._fileStats[fileNm]
+            except OSError:
+                isComplete[fileNm] = False
+            if not isComplete[fileNm]:
+                self._logger.info('%s is not complete, leaving it for the next refresh' % fileNm)
+                self._pendingFiles.add(fileNm)
+        completeFiles = [(fileNm, record) for fileNm, record in zip(fileNames, records)
+                         if isComplete.get(fileNm, True)]
+        return [fileNm for fileNm, record in completeFiles], [record for fileNm, record in completeFiles]
+
+    def _sortSeriesNames(self):
+        """ Order the series names by series instance uid and time, updating the list in place. """
+        seriesSorted = sorted(self._suidAndTimeForProtocols.items(), key=lambda info: info[1])
+        self._protNamesOrdered[:] = [series[0] for series in seriesSorted]
+
+
+def readSeriesRecordAndSkipReason(file, headerOnly=True):
+    """ Get the series record of the given file, or the reason it is not an image.
+
+    The type of the file is sniffed from its first bytes first, so only possible DICOM and NEMA files are parsed.
+    :param file: str
+    :param headerOnly: bool
+    If True stop reading the file after the series information.
+    :return: [list, str]
+    The series record [file type, protocol name, series instance uid, acquisition time] and None, or None and the
+    skip reason as listed in RecursiveDirectoryReader.getSkipCounts.
+    """
+    sniffedType = sniffFileType(file)
+    if sniffedType == 'other':
+        return None, 'notDicom'
+    try:
+        # only NEMA files need forcing, they have no preamble
+        dcm = _readSeriesHeader(file, headerOnly, force=sniffedType == 'NEMA')
+    except Exception:
+        return None, 'unreadable'
+    if sniffedType == 'NEMA':
+        # need to do this check on all files opened, as the force=True
+        # option will open all sorts of files
+        if 'RecognitionCode' not in dcm or dcm.RecognitionCode != 'ACR-NEMA 2.0':
+            return None, 'notNema'
+        fileType = 'NEMA'
+    else:
+        sopClass = str(dcm.SOPClassUID) if 'SOPClassUID' in dcm else ''
+        if 'Enhanced' in sopClass:
+            fileType = 'enhancedDICOM'
+        elif 'MR Image' in sopClass:
+            fileType = 'DICOM'
+        else:
+            fileType = 'otherDICOM'
+    try:
+        return [fileType, dcm.SeriesDescription.lstrip(), dcm.SeriesInstanceUID, getImageTime(dcm)], None
+    except Exception:
+        return None, 'noSeriesInformation'
+
+
+def _getFileStat(fileNm):
+    """ Return the modification time and size of a file. """
+    stat = os.stat(fileNm)
+    return stat.st_mtime, stat.st_size
+
+
+def _readSeriesHeader(file, headerOnly, force):
+    """ Read the file, stopping after the series information when searching header only. """
+    if headerOnly:
+        return readDiscoveryHeader(file, force)
+    return dicom.read_file(file, stop_before_pixels=False, force=force)
+
 
+def _readSeriesRecordArgs(args):
+    """ Unpack the arguments for readSeriesRecordAndSkipReason, Pool.map only passes one. """
+    return readSeriesRecordAndSkipReason(*args)
@@ -0,0 +1,387 @@
+__author__ = 'medabana'
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import dicom
+import numpy as np
+
+import DicomReader.PatientDirectoryReader
+from DicomReader.DiskSeriesCache import DiskSeriesCache
+from DicomReader.EnhancedFileReader import getFrameInfo
+from DicomReader.PatientDirectoryReader import SeriesLoadCancelled
+from DicomReader.RecursiveDirectoryReader import RecursiveDirectoryReader
+from DicomReader.SeriesInfo import parseTimes
+from DicomReader.StudyIndex import StudyIndex
+from DicomReader.SyntheticStudy import SyntheticStudy
+
+_nonAsciiDirNm = u'M\xfcller'
+
+
+def _canEncodeFileName(fileNm):
+    """ Return True if the file name can be stored with the file system encoding. """
+    try:
+        fileNm.encode(sys.getfilesystemencoding() or 'ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+class RecursiveDirectoryReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dirNm = tempfile.mkdtemp()
+        self.study = SyntheticStudy(self.dirNm)
+        self.study.writeDicomSeries('dce', 3, 5)
+        self.study.writeDicomSeries('localiser', 2, 1, subDir='loc')
+        self.study.writeJunkFile('report.pdf')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirNm)
+
+    def test_headerOnlyMatchesFullRead(self):
+        full = RecursiveDirectoryReader(self.dirNm, headerOnly=False)
+        header = RecursiveDirectoryReader(self.dirNm, headerOnly=True)
+
+        self.assertEqual(['1: dce', '2: localiser'], header.getSeriesNames())
+        self.assertEqual(full.getSeriesNames(), header.getSeriesNames())
+        self.assertEqual(full._suidAndTimeForProtocols, header._suidAndTimeForProtocols)
+        self.assertEqual(full._filesForSuid, header._filesForSuid)
+
+    def test_skipCounts(self):
+        self.study.writeJunkFile('thumbnail.jpg')
+        self.study.writeJunkFile('empty', 0)
+        reader = RecursiveDirectoryReader(self.dirNm)
+
+        self.assertEqual({'notDicom': 3}, reader.getSkipCounts())
+        self.assertEqual(['1: dce', '2: localiser'], reader.getSeriesNames())
+
+    def test_parallelMatchesSerial(self):
+        self.study.writeDicomSeries('dce2', 2, 4, subDir='dce2')
+        serial = RecursiveDirectoryReader(self.dirNm)
+        parallel = RecursiveDirectoryReader(self.dirNm, numWorkers=3)
+
+        self.assertEqual(serial.getSeriesNames(), parallel.getSeriesNames())
+        self.assertEqual(serial._suidAndTimeForProtocols, parallel._suidAndTimeForProtocols)
+        self.assertEqual(serial._filesForSuid, parallel._filesForSuid)
+
+    def test_index(self):
+        indexDir = tempfile.mkdtemp()
+        index = StudyIndex(os.path.join(indexDir, 'studyIndex.sqlite'))
+        first = RecursiveDirectoryReader(self.dirNm, index=index)
+        second = RecursiveDirectoryReader(self.dirNm, index=index)
+
+        self.assertEqual(18, first._numFilesRead)
+        self.assertEqual(0, second._numFilesRead)
+        self.assertEqual(first.getSeriesNames(), second.getSeriesNames())
+        self.assertEqual(first._filesForSuid, second._filesForSuid)
+
+        self.study.writeDicomSeries('late', 1, 2, subDir='late')
+        third = RecursiveDirectoryReader(self.dirNm, index=index)
+        self.assertEqual(2, third._numFilesRead)
+        self.assertEqual(3, len(third.getSeriesNames()))
+        self.assertEqual({'indexed': 1}, third.getSkipCounts())
+        index.close()
+        shutil.rmtree(indexDir)
+
+    @unittest.skipIf(not _canEncodeFileName(_nonAsciiDirNm), 'file system encoding is ASCII')
+    def test_indexNonAsciiDirectory(self):
+        dirNm = os.path.join(self.dirNm, _nonAsciiDirNm)
+        SyntheticStudy(dirNm).writeDicomSeries('dce', 2, 3)
+        indexDir = tempfile.mkdtemp()
+        index = StudyIndex(os.path.join(indexDir, 'studyIndex.sqlite'))
+        try:
+            first = RecursiveDirectoryReader(dirNm, index=index)
+            second = RecursiveDirectoryReader(dirNm, index=index)
+
+            self.assertEqual(6, first._numFilesRead)
+            self.assertEqual(0, second._numFilesRead)
+            self.assertEqual(first._filesForSuid, second._filesForSuid)
+        finally:
+            index.close()
+            shutil.rmtree(indexDir)
+
+    def test_imageData(self):
+        reader = RecursiveDirectoryReader(self.dirNm)
+        data = reader.getImageData('1: dce')
+
+        self.assertEqual([8, 8, 3, 5], reader.getSequenceParameters('1: dce'))
+        np.testing.assert_array_equal(self.study.expectedData(3, 5, 8, 8, 1), data)
+
+    def test_diskCache(self):
+        cacheDir = tempfile.mkdtemp()
+        first = RecursiveDirectoryReader(self.dirNm)
+        first.setDiskCache(DiskSeriesCache(cacheDir))
+        decoded = first.getImageData('1: dce')
+        second = RecursiveDirectoryReader(self.dirNm)
+        second.setDiskCache(DiskSeriesCache(cacheDir))
+        mapped = second.getImageData('1: dce')
+
+        self.assertFalse(isinstance(decoded, np.memmap))
+        self.assertTrue(isinstance(mapped, np.memmap))
+        self.assertFalse(mapped.flags.writeable)
+        np.testing.assert_array_equal(decoded, mapped)
+        self.assertEqual(first.getOrderedFileList('1: dce'), second.getOrderedFileList('1: dce'))
+        self.assertEqual([8, 8, 3, 5], second.getSequenceParameters('1: dce'))
+        del mapped
+        shutil.rmtree(cacheDir)
+
+        cacheDir = tempfile.mkdtemp()
+        deferred = RecursiveDirectoryReader(self.dirNm)
+        deferred.setDiskCache(DiskSeriesCache(cacheDir))
+        deferred.getImageData('1: dce', deferDiskCache=True)
+        self.assertEqual([], os.listdir(cacheDir))
+        deferred.saveToDiskCache('1: dce')
+        self.assertEqual(2, len(os.listdir(cacheDir)))
+        shutil.rmtree(cacheDir)
+
+    @unittest.skipIf(not _canEncodeFileName(_nonAsciiDirNm), 'file system encoding is ASCII')
+    def test_diskCacheNonAsciiDirectory(self):
+        dirNm = os.path.join(self.dirNm, _nonAsciiDirNm)
+        SyntheticStudy(dirNm).writeDicomSeries('dce', 2, 3)
+        cacheDir = tempfile.mkdtemp()
+        try:
+            first = RecursiveDirectoryReader(dirNm)
+            first.setDiskCache(DiskSeriesCache(cacheDir))
+            decoded = first.getImageData('1: dce')
+            second = RecursiveDirectoryReader(dirNm)
+            second.setDiskCache(DiskSeriesCache(cacheDir))
+            mapped = second.getImageData('1: dce')
+
+            self.assertTrue(isinstance(mapped, np.memmap))
+            np.testing.assert_array_equal(decoded, mapped)
+            self.assertEqual(first.getOrderedFileList('1: dce'), second.getOrderedFileList('1: dce'))
+            del mapped
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_lazyImageData(self):
+        expected = self.study.expectedData(3, 5, 8, 8, 1)
+        reader = RecursiveDirectoryReader(self.dirNm)
+        lazy = reader.getLazyImageData('1: dce', loadInBackground=False, maxFrames=2)
+
+        self.assertEqual(expected.shape, lazy.shape)
+        np.testing.assert_array_equal(expected[7], lazy[7])
+        np.testing.assert_array_equal(expected[7, 2, 3], lazy[7, 2, 3])
+        np.testing.assert_array_equal(expected[5:10, :, 1], lazy[5:10, :, 1])
+        lazy.prefetch(range(10, 15)).join()
+        self.assertFalse(lazy.isLoaded())
+
+        data = lazy.loadAll(background=False)
+        self.assertTrue(lazy.isLoaded())
+        np.testing.assert_array_equal(expected, data)
+        np.testing.assert_array_equal(expected, np.asarray(lazy))
+        self.assertIs(data, reader.getImageData('1: dce'))
+
+    def test_decodeWorkers(self):
+        expected = self.study.expectedData(3, 5, 8, 8, 1)
+        for useProcesses in [False, True]:
+            reader = RecursiveDirectoryReader(self.dirNm)
+            reader.setDecodeWorkers(3, useProcesses)
+            np.testing.assert_array_equal(expected, reader.getImageData('1: dce'))
+            self.assertEqual([8, 8, 3, 5], reader.getSequenceParameters('1: dce'))
+
+    def test_progressAndCancel(self):
+        expected = self.study.expectedData(3, 5, 8, 8, 1)
+        for numWorkers in [1, 3]:
+            reader = RecursiveDirectoryReader(self.dirNm)
+            reader.setDecodeWorkers(numWorkers)
+            self.assertRaises(SeriesLoadCancelled, reader.getImageData, '1: dce',
+                              lambda numRead, numFiles, seriesData: numRead < 4)
+            self.assertEqual(0, reader.getCacheStatistics()['numSeries'])
+
+            calls = []
+            data = reader.getImageData('1: dce', lambda numRead, numFiles, seriesData: calls.append(numRead))
+            self.assertEqual(list(range(1, 16)), calls)
+            np.testing.assert_array_equal(expected, data)
+
+    def test_headerProgressAndCancel(self):
+        headerBatchSize = DicomReader.PatientDirectoryReader._headerBatchSize
+        DicomReader.PatientDirectoryReader._headerBatchSize = 4
+        try:
+            reader = RecursiveDirectoryReader(self.dirNm)
+            self.assertRaises(SeriesLoadCancelled, reader.getImageData, '1: dce', None, None,
+                              lambda numRead, numFiles: numRead < 8)
+            self.assertEqual({}, reader._seriesInfoForSuid)
+
+            calls = []
+            reader.getImageData('1: dce', headerProgress=lambda numRead, numFiles: calls.append((numRead, numFiles)))
+            self.assertEqual([(4, 15), (8, 15), (12, 15), (15, 15)], calls)
+        finally:
+            DicomReader.PatientDirectoryReader._headerBatchSize = headerBatchSize
+
+    def test_refresh(self):
+        self.study.writeDicomSeries('live', 2, 3, subDir='live')
+        liveDir = os.path.join(self.dirNm, 'live')
+        stagingDir = tempfile.mkdtemp()
+        lateFiles = sorted(os.listdir(liveDir))[:2]
+        for file in lateFiles:
+            shutil.move(os.path.join(liveDir, file), stagingDir)
+        reader = RecursiveDirectoryReader(self.dirNm)
+        # the series are numbered in the order the files are listed
+        live = [name for name in reader.getSeriesNames() if name.endswith('live')][0]
+        self.assertEqual(4, len(reader.getImageData(live)))
+        self.assertEqual([], reader.refresh())
+        self.assertEqual(0, reader._numFilesRead)
+
+        for file in lateFiles:
+            shutil.move(os.path.join(stagingDir, file), liveDir)
+        self.study.writeDicomSeries('late', 1, 2, subDir='late')
+        readImageData = DicomReader.PatientDirectoryReader.readImageData
+        imagesRead = []
+        DicomReader.PatientDirectoryReader.readImageData = lambda file: imagesRead.append(file) or readImageData(file)
+        try:
+            self.assertEqual([live, '4: late'], reader.refresh())
+            data = reader.getImageData(live)
+        finally:
+            DicomReader.PatientDirectoryReader.readImageData = readImageData
+            shutil.rmtree(stagingDir)
+
+        self.assertEqual(4, reader._numFilesRead)
+        self.assertEqual(2, len(imagesRead))
+        self.assertEqual([8, 8, 2, 3], reader.getSequenceParameters(live))
+        np.testing.assert_array_equal(self.study.expectedData(2, 3, 8, 8, 3), data)
+        self.assertEqual(4, len(reader.getSeriesNames()))
+
+
+    def test_refreshWatching(self):
+        reader = RecursiveDirectoryReader(self.dirNm)
+        watcher = DicomReader.RecursiveDirectoryReader.DirectoryWatcher
+        DicomReader.RecursiveDirectoryReader.DirectoryWatcher = _FakeWatcher
+        try:
+            self.assertTrue(reader.setWatching(True))
+            fakeWatcher = reader._watcher
+            self.study.writeDicomSeries('early', 1, 2, subDir='early')
+            # the files written before the watch started are found by listing the directory
+            self.assertEqual(['3: early'], reader.refresh())
+            self.assertEqual(2, reader._numFilesRead)
+
+            self.study.writeDicomSeries('late', 1, 2, subDir='late')
+            lateDir = os.path.join(self.dirNm, 'late')
+            fakeWatcher.changedFiles = [os.path.join(lateDir, sorted(os.listdir(lateDir))[0])]
+            self.assertEqual(['4: late'], reader.refresh())
+            self.assertEqual(1, reader._numFilesRead)
+            self.assertEqual([], fakeWatcher.changedFiles)
+
+            self.assertFalse(reader.setWatching(False))
+            self.assertTrue(fakeWatcher.isClosed)
+        finally:
+            DicomReader.RecursiveDirectoryReader.DirectoryWatcher = watcher
+
+    def test_refreshIncompleteFile(self):
+        self.study.writeDicomSeries('live', 2, 3, subDir='live')
+        liveDir = os.path.join(self.dirNm, 'live')
+        lateFile = os.path.join(liveDir, sorted(os.listdir(liveDir))[0])
+        with open(lateFile, 'rb') as f:
+            contents = f.read()
+        os.remove(lateFile)
+        reader = RecursiveDirectoryReader(self.dirNm)
+        live = [name for name in reader.getSeriesNames() if name.endswith('live')][0]
+        self.assertEqual(5, len(reader.getImageData(live)))
+
+        # written as far as part of the pixel data
+        with open(lateFile, 'wb') as f:
+            f.write(contents[:-30])
+        self.assertEqual([], reader.refresh())
+        self.assertEqual(5, len(reader.getImageData(live)))
+        self.assertEqual(1, reader.getCacheStatistics()['misses'])
+
+        with open(lateFile, 'wb') as f:
+            f.write(contents)
+        self.assertEqual([live], reader.refresh())
+        np.testing.assert_array_equal(self.study.expectedData(2, 3, 8, 8, 3), reader.getImageData(live))
+
+        # a file already in the series which is rewritten is not added to it a second time
+        with open(lateFile, 'wb') as f:
+            f.write(contents[:-30])
+        self.assertEqual([], reader.refresh())
+        with open(lateFile, 'wb') as f:
+            f.write(contents)
+        self.assertEqual([live], reader.refresh())
+        self.assertEqual(6, len(reader._filesForSuid[reader._suidAndTimeForProtocols[live][0]]))
+        np.testing.assert_array_equal(self.study.expectedData(2, 3, 8, 8, 3), reader.getImageData(live))
+
+
+class _FakeWatcher(object):
+    """ Directory watcher which reports the files it is given. """
+    def __init__(self, dirNm):
+        self.changedFiles = []
+        self.isClosed = False
+
+    @staticmethod
+    def isAvailable():
+        return True
+
+    def close(self):
+        self.isClosed = True
+
+    def getChangedFiles(self):
+        changedFiles, self.changedFiles = self.changedFiles, []
+        return changedFiles
+
+
+class RecursiveNemaReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dirNm = tempfile.mkdtemp()
+        self.study = SyntheticStudy(self.dirNm)
+        self.study.writeNemaSeries('nema', 3, 4)
+        self.study.writeJunkFile('notes.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirNm)
+
+    def test_imageData(self):
+        reader = RecursiveDirectoryReader(self.dirNm, numWorkers=2)
+        data = reader.getImageData('1: nema')
+
+        self.assertEqual(['1: nema'], reader.getSeriesNames())
+        self.assertEqual({'notDicom': 1}, reader.getSkipCounts())
+        self.assertEqual([8, 8, 3, 4], reader.getSequenceParameters('1: nema'))
+        np.testing.assert_array_equal(self.study.expectedData(3, 4, 8, 8, 1), data)
+
+class RecursiveEnhancedReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dirNm = tempfile.mkdtemp()
+        self.study = SyntheticStudy(self.dirNm)
+        self.study.writeEnhancedSeries('dce', 3, 4, 8, 6)
+        self.study.writeEnhancedSeries('volume', 5, 1, 8, 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirNm)
+
+    def test_imageData(self):
+        reader = RecursiveDirectoryReader(self.dirNm)
+        name = self._getSeriesName(reader, 'dce')
+        data = reader.getImageData(name)
+
+        self.assertEqual([8, 6, 3, 4], reader.getSequenceParameters(name))
+        np.testing.assert_array_equal(self.study.expectedData(3, 4, 8, 6, 1), data)
+
+    def test_framesInOrderAreMapped(self):
+        reader = RecursiveDirectoryReader(self.dirNm)
+        name = self._getSeriesName(reader, 'volume')
+        data = reader.getImageData(name)
+
+        self.assertTrue(isinstance(data, np.memmap))
+        self.assertEqual([8, 6, 5, 1], reader.getSequenceParameters(name))
+        np.testing.assert_array_equal(self.study.expectedData(5, 1, 8, 6, 2), data)
+        del data
+
+    def test_frameTimes(self):
+        dcm = dicom.read_file(os.path.join(self.dirNm, 'EN1'))
+        times, sliceIndices = getFrameInfo(dcm)
+
+        # frame times are in the same seconds as the series times
+        self.assertEqual(parseTimes([dcm.AcquisitionDateTime])[0], times[0])
+        np.testing.assert_array_equal(np.repeat(np.arange(4.0), 3), times - times[0])
+        reader = RecursiveDirectoryReader(self.dirNm)
+        self.assertEqual(times[0], reader._suidAndTimeForProtocols[self._getSeriesName(reader, 'dce')][1])
+
+    def _getSeriesName(self, reader, protName):
+        # the series are numbered in the order the files are listed
+        return [name for name in reader.getSeriesNames() if name.endswith(protName)][0]
+
+if __name__ == "__main__":
+    unittest.main()
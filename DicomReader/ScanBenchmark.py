@@ -0,0 +1,50 @@
+__author__ = 'medabana'
+
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import timeit
+
+from DicomReader.RecursiveDirectoryReader import RecursiveDirectoryReader
+from DicomReader.SyntheticStudy import SyntheticStudy
+
+
+def timeScan(dirNm, repeats=3, **readerArgs):
+    """ Return the best time in seconds taken to search the directory for image series. """
+    timer = timeit.Timer(lambda: RecursiveDirectoryReader(dirNm, **readerArgs))
+    return min(timer.repeat(repeats, 1))
+
+
+def main(argv):
+    """ Compare the header only series search with reading every file in full, and with searching in parallel.
+
+    Usage: python -m DicomReader.ScanBenchmark [dicomDirectory]
+    A synthetic study of 256x256 images is written to a temporary directory if no directory is given.
+    """
+    tmpDir = None
+    if len(argv) > 1:
+        dirNm = argv[1]
+    else:
+        tmpDir = tempfile.mkdtemp()
+        dirNm = tmpDir
+        study = SyntheticStudy(dirNm)
+        study.writeDicomSeries('localiser', 3, 1, 256, 256)
+        study.writeDicomSeries('dce', 20, 40, 256, 256, 'dce')
+    try:
+        fullTime = timeScan(dirNm, headerOnly=False)
+        headerTime = timeScan(dirNm, headerOnly=True)
+        print 'full read:   %.3f s' % fullTime
+        print 'header only: %.3f s' % headerTime
+        print 'speed up:    %.1fx' % (fullTime / headerTime)
+        for numWorkers in (2, 4, 8):
+            if numWorkers > multiprocessing.cpu_count():
+                break
+            parallelTime = timeScan(dirNm, numWorkers=numWorkers)
+            print '%i workers:   %.3f s (%.1fx)' % (numWorkers, parallelTime, headerTime / parallelTime)
+    finally:
+        if tmpDir is not None:
+            shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    main(sys.argv)
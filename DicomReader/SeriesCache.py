@@ -0,0 +1,111 @@
+__author__ = 'medabana'
+
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class SeriesCache(object):
+    """ Least recently used cache of decoded series, limited by the total size of the arrays.
+
+    The most recently added series is always kept, even if it is larger than the limit, so a limit of 0 keeps a
+    single series.
+    """
+    def __init__(self, maxBytes=0):
+        """
+        :param maxBytes: int
+        Memory ceiling for the cached arrays in bytes.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._series = OrderedDict()
+        # series can be added by background loading threads
+        self._lock = threading.RLock()
+        self._numBytes = 0
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytesEvicted = 0
+
+    def __contains__(self, key):
+        return key in self._series
+
+    def evict(self, key=None):
+        """ Remove a series from the cache, or every series if no key is given.
+
+        :param key: str
+        Series instance uid.
+        :return:
+        """
+        with self._lock:
+            keys = list(self._series.keys()) if key is None else [key]
+            for k in keys:
+                if k in self._series:
+                    self._remove(k)
+
+    def get(self, key):
+        """ Return the cached series and mark it as most recently used.
+
+        :param key: str
+        Series instance uid.
+        :return: np.array or None
+        None if the series is not cached.
+        """
+        with self._lock:
+            if key not in self._series:
+                self.misses += 1
+                return None
+            self.hits += 1
+            data = self._series.pop(key)
+            self._series[key] = data
+            return data
+
+    def getStatistics(self):
+        """ Return the cache usage statistics.
+
+        :return: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'bytesEvicted': self.bytesEvicted, 'numSeries': len(self._series), 'numBytes': self._numBytes,
+                'maxBytes': self.maxBytes}
+
+    def put(self, key, data):
+        """ Add a series to the cache, evicting the least recently used series to stay within the memory ceiling.
+
+        :param key: str
+        Series instance uid.
+        :param data: np.array
+        :return:
+        """
+        with self._lock:
+            if key in self._series:
+                self._remove(key, False)
+            self.reserve(_getNumBytes(data))
+            self._series[key] = data
+            self._numBytes += _getNumBytes(data)
+
+    def reserve(self, numBytes):
+        """ Evict the least recently used series until an array of numBytes would fit under the memory ceiling.
+
+        :param numBytes: int
+        :return:
+        """
+        with self._lock:
+            while self._series and self._numBytes + numBytes > self.maxBytes:
+                self._remove(next(iter(self._series)))
+
+    def _remove(self, key, isEviction=True):
+        data = self._series.pop(key)
+        self._numBytes -= _getNumBytes(data)
+        if isEviction:
+            self.evictions += 1
+            self.bytesEvicted += _getNumBytes(data)
+            self._logger.info('evicted series %s, %i bytes' % (key, _getNumBytes(data)))
+
+
+def _getNumBytes(data):
+    """ Return the memory used by the array. Memory maps are backed by their file so count as nothing. """
+    if isinstance(data, np.memmap):
+        return 0
+    return data.nbytes
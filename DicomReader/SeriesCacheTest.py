@@ -0,0 +1,47 @@
+__author__ = 'medabana'
+
+import unittest
+
+import numpy as np
+
+from DicomReader.SeriesCache import SeriesCache
+
+
+class SeriesCacheTest(unittest.TestCase):
+    def test_leastRecentlyUsedEvicted(self):
+        cache = SeriesCache(2000)
+        cache.put('a', np.zeros(100))
+        cache.put('b', np.zeros(100))
+        cache.get('a')
+        cache.put('c', np.zeros(100))
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        stats = cache.getStatistics()
+        self.assertEqual(1, stats['evictions'])
+        self.assertEqual(800, stats['bytesEvicted'])
+        self.assertEqual(1600, stats['numBytes'])
+
+    def test_newestSeriesAlwaysKept(self):
+        cache = SeriesCache(0)
+        cache.put('a', np.zeros(10))
+        cache.put('b', np.zeros(10))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evict(self):
+        cache = SeriesCache(10000)
+        cache.put('a', np.zeros(10))
+        cache.put('b', np.zeros(10))
+        cache.evict('a')
+        self.assertFalse('a' in cache)
+        cache.evict()
+        self.assertEqual(0, cache.getStatistics()['numSeries'])
+        self.assertEqual(0, cache.getStatistics()['numBytes'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+__author__ = 'medabana'
+
+import numpy as np
+import os
+import sys
+
+
+_powersOfTen = 10**np.arange(0, 15, dtype=np.int64)
+
+
+class SeriesInfo(object):
+    """ The per file information of a series held as columns, sorted by slice location and then time.
+
+    File names are split into a table of the distinct directories, an index into that table for each image and a
+    fixed width array of base names encoded with the file system encoding, so each image takes a few dozen bytes
+    rather than a list of Python objects. Names given as unicode are decoded again as they are returned.
+    fileIndices gives the position of each image in the order the files were given.
+    """
+    __slots__ = ('_baseNames', '_directories', '_directoryIndices', '_fileNames', 'fileIndices', 'instanceNumbers',
+                 'sliceLocations', 'times')
+
+    def __init__(self, fileNames, times, sliceLocations, instanceNumbers):
+        """
+        :param fileNames: list of str
+        :param times: np.array
+        Acquisition times in seconds.
+        :param sliceLocations: np.array
+        :param instanceNumbers: np.array
+        Used to order images with the same slice location and time.
+        """
+        times = np.asarray(times, np.float64)
+        sliceLocations = np.asarray(sliceLocations, np.float64)
+        instanceNumbers = np.asarray(instanceNumbers, np.int32)
+        order = np.lexsort((instanceNumbers, times, sliceLocations))
+        self._directories, directoryIndices, baseNames = _splitFileNames(fileNames)
+        self._directoryIndices = directoryIndices[order]
+        self._baseNames = baseNames[order]
+        self._fileNames = FileNameSequence(self)
+        self.fileIndices = order.astype(np.int32)
+        self.times = times[order]
+        self.sliceLocations = sliceLocations[order]
+        self.instanceNumbers = instanceNumbers[order]
+
+    def __len__(self):
+        return len(self.fileIndices)
+
+    @staticmethod
+    def fromDict(info):
+        """ Return the series info stored by toDict. """
+        return SeriesInfo(info['fileNames'], info['times'], info['sliceLocations'], info['instanceNumbers'])
+
+    @staticmethod
+    def fromFileInfo(fileInfo):
+        """ Return the series info for the file info read from each file.
+
+        :param fileInfo: list
+        [file, time string, slice location, instance number] for each file, as returned by readFileInfo.
+        :return: SeriesInfo
+        """
+        if not fileInfo:
+            return SeriesInfo([], [], [], [])
+        fileNames, timeStrings, sliceLocations, instanceNumbers = zip(*fileInfo)
+        return SeriesInfo(fileNames, parseTimes(timeStrings), sliceLocations, instanceNumbers)
+
+    def getDimensions(self):
+        """ Return the number of slices, from the distinct slice locations, and the number of timepoints.
+
+        :return: [int, int]
+        nz, nt
+        """
+        nz = max(1, len(np.unique(self.sliceLocations)))
+        return nz, len(self) // nz
+
+    def getFileName(self, index):
+        """ Return the file of an image in sorted order. """
+        directory = self._directories[self._directoryIndices.item(index)]
+        baseName = self._baseNames.item(index)
+        if not isinstance(directory, bytes):
+            baseName = _decodeFileName(baseName)
+        return os.path.join(directory, baseName)
+
+    def getFileNames(self):
+        """ Return the files in sorted order.
+
+        The same sequence is returned on each call and the names are only joined as they are indexed.
+        :return: FileNameSequence
+        """
+        return self._fileNames
+
+    def toDict(self):
+        """ Return the series info as a JSON serialisable dict. """
+        return {'fileNames': list(self._fileNames), 'times': self.times.tolist(),
+                'sliceLocations': self.sliceLocations.tolist(), 'instanceNumbers': self.instanceNumbers.tolist()}
+
+    def updated(self, fileInfo):
+        """ Return the series info with files added or replaced.
+
+        :param fileInfo: list
+        File info, as for fromFileInfo, of the files which are new or have changed.
+        :return: SeriesInfo
+        """
+        if not fileInfo:
+            return self
+        fileNames, timeStrings, sliceLocations, instanceNumbers = zip(*fileInfo)
+        changedFiles = set(fileNames)
+        sortedFileNames = list(self._fileNames)
+        kept = np.array([fileNm not in changedFiles for fileNm in sortedFileNames], np.bool)
+        return SeriesInfo([fileNm for fileNm in sortedFileNames if fileNm not in changedFiles] + list(fileNames),
+                          np.concatenate([self.times[kept], parseTimes(timeStrings)]),
+                          np.concatenate([self.sliceLocations[kept], np.asarray(sliceLocations, np.float64)]),
+                          np.concatenate([self.instanceNumbers[kept], np.asarray(instanceNumbers, np.int32)]))
+
+
+class FileNameSequence(object):
+    """ Read only sequence of the files of a series in sorted order, joined from the series info as they are indexed.
+
+    Can be used wherever a list of file names is read, without building the list.
+    """
+    __slots__ = ('_seriesInfo',)
+
+    def __init__(self, seriesInfo):
+        """
+        :param seriesInfo: SeriesInfo
+        """
+        self._seriesInfo = seriesInfo
+
+    def __eq__(self, other):
+        if not hasattr(other, '__len__'):
+            return NotImplemented
+        return len(self) == len(other) and all(fileNm == otherNm for fileNm, otherNm in zip(self, other))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('file index out of range')
+        return self._seriesInfo.getFileName(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._seriesInfo.getFileName(index)
+
+    def __len__(self):
+        return len(self._seriesInfo)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'FileNameSequence(%r)' % list(self)
+
+
+def parseTimes(timeStrings):
+    """ Convert DICOM TM, DT and NEMA time strings to seconds, all at once.
+
+    Accepts HHMMSS.FFFFFF, HH:MM:SS.FFFFFF and YYYYMMDDHHMMSS.FFFFFF, with the fraction optional and the time
+    possibly truncated. Date times count the days as well, so series which cross midnight stay in order.
+    The strings are parsed as a matrix of characters, each digit weighted by its place in the whole or fraction part.
+    Strings which cannot be parsed together, such as ones with leading spaces, are parsed one at a time in the same
+    way, so every time is in seconds.
+    :param timeStrings: list of str
+    :return: np.array
+    """
+    if len(timeStrings) == 0:
+        return np.zeros(0)
+    times = _parseTimesTogether(timeStrings)
+    if times is None:
+        times = np.array([_parseTimeSeparately(timeString) for timeString in timeStrings], np.float64)
+    return times
+
+
+def _decodeFileName(fileNm):
+    """ Return a file name encoded by _encodeFileName as unicode. """
+    if hasattr(os, 'fsdecode'):
+        return os.fsdecode(fileNm)
+    return fileNm.decode(sys.getfilesystemencoding() or 'utf-8')
+
+
+def _encodeFileName(fileNm):
+    """ Return a unicode file name encoded with the file system encoding. """
+    if hasattr(os, 'fsencode'):
+        return os.fsencode(fileNm)
+    return fileNm.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+def _firstTrue(mask):
+    """ Return the column of the first True in each row of the mask, the number of columns if there is none. """
+    return np.where(mask.any(1), mask.argmax(1), mask.shape[1])
+
+
+def _parseTimeSeparately(timeString):
+    """ Parse a time that could not be parsed with the others, without any surrounding spaces.
+
+    :param timeString: str
+    :return: float
+    Seconds, as from parseTimes.
+    """
+    times = _parseTimesTogether([timeString.strip()])
+    if times is None:
+        raise ValueError('cannot parse the time %r' % timeString)
+    return times[0]
+
+
+def _parseTimesTogether(timeStrings):
+    """ Parse the time strings together as described for parseTimes.
+
+    :param timeStrings: list of str
+    :return: np.array
+    Seconds, None if any of the strings is not in a form that can be parsed together.
+    """
+    chars = np.array(timeStrings, np.bytes_)
+    if chars.itemsize == 0:
+        return None
+    chars = chars.view(np.uint8).reshape(len(timeStrings), chars.itemsize)
+    columns = np.arange(chars.shape[1])
+    isDigit = (chars >= ord('0')) & (chars <= ord('9'))
+    # the whole part ends at the first character that is not a digit or colon, such as the '.' or a UTC offset
+    isEnd = ~(isDigit | (chars == ord(':')))
+    wholeEnd = _firstTrue(isEnd)
+    inWhole = isDigit & (columns < wholeEnd[:, None])
+    isFractionStart = np.zeros(len(wholeEnd), np.bool)
+    hasEnd = wholeEnd < chars.shape[1]
+    isFractionStart[hasEnd] = chars[hasEnd, wholeEnd[hasEnd]] == ord('.')
+    afterDot = (columns > wholeEnd[:, None]) & isFractionStart[:, None]
+    inFraction = isDigit & afterDot & (columns < _firstTrue(isEnd & afterDot)[:, None])
+
+    digits = chars.astype(np.int64) - ord('0')
+    numWholeDigits = inWhole.sum(1)
+    # truncated times, such as HHMM, are padded out to HHMMSS or YYYYMMDDHHMMSS
+    padding = np.where(numWholeDigits > 6, 14, 6) - numWholeDigits
+    if (padding < 0).any() or (numWholeDigits == 0).any():
+        return None
+    places = np.where(inWhole, numWholeDigits[:, None] - np.cumsum(inWhole, 1) + padding[:, None], 0)
+    whole = (digits * _powersOfTen[places] * inWhole).sum(1)
+    fractionPlaces = np.minimum(np.cumsum(inFraction, 1), len(_powersOfTen) - 1)
+    fraction = (digits / _powersOfTen[fractionPlaces].astype(np.float64) * inFraction).sum(1)
+
+    # times without a date are on day 0
+    uniqueDates, dateIndices = np.unique(np.where(numWholeDigits > 6, whole // 1000000, 19700101),
+                                         return_inverse=True)
+    try:
+        days = np.array(['%04i-%02i-%02i' % (d // 10000, d // 100 % 100, d % 100) for d in uniqueDates],
+                        'datetime64[D]').astype(np.int64)[dateIndices]
+    except ValueError:
+        return None
+    seconds = (whole // 10000 % 100) * 3600 + (whole // 100 % 100) * 60 + whole % 100
+    return days * 86400.0 + seconds + fraction
+
+
+def _splitFileNames(fileNames):
+    """ Split file names into a table of the distinct directories, the directory index of each and the base names.
+
+    :param fileNames: list of str
+    :return: [list of str, np.array, np.array]
+    """
+    directories = []
+    indexForDirectory = {}
+    directoryIndices = np.zeros(len(fileNames), np.int32)
+    baseNames = []
+    for i, fileNm in enumerate(fileNames):
+        directory, baseName = os.path.split(fileNm)
+        if directory not in indexForDirectory:
+            indexForDirectory[directory] = len(directories)
+            directories.append(directory)
+        directoryIndices[i] = indexForDirectory[directory]
+        baseNames.append(baseName if isinstance(baseName, bytes) else _encodeFileName(baseName))
+    # bytes rather than a unicode array, which would take four bytes for each character
+    return directories, directoryIndices, np.array(baseNames, np.bytes_) if baseNames else np.zeros(0, np.bytes_)
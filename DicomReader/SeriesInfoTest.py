@@ -0,0 +1,55 @@
+__author__ = 'medabana'
+
+import os
+import unittest
+
+import numpy as np
+
+from DicomReader.SeriesInfo import SeriesInfo, parseTimes
+
+
+class SeriesInfoTest(unittest.TestCase):
+    def test_fileNames(self):
+        fileNames = [os.path.join('study', 'series%i' % (i % 2), 'IM%i' % i) for i in range(0, 6)]
+        seriesInfo = SeriesInfo(fileNames, np.arange(6, 0, -1), np.zeros(6), np.zeros(6))
+
+        self.assertEqual(2, len(seriesInfo._directories))
+        self.assertEqual(fileNames[::-1], seriesInfo.getFileNames())
+        self.assertIs(seriesInfo.getFileNames(), seriesInfo.getFileNames())
+        self.assertEqual(fileNames[0], seriesInfo.getFileNames()[-1])
+        self.assertEqual(fileNames[4:2:-1], seriesInfo.getFileNames()[1:3])
+        self.assertRaises(IndexError, seriesInfo.getFileNames().__getitem__, 6)
+
+        # unicode names are stored as bytes and returned as unicode
+        unicodeNames = [os.path.join(u'study', u'IM%i' % i) for i in range(0, 3)]
+        seriesInfo = SeriesInfo(unicodeNames, np.arange(3), np.zeros(3), np.zeros(3))
+        self.assertEqual('S', seriesInfo._baseNames.dtype.kind)
+        self.assertEqual(unicodeNames, list(seriesInfo.getFileNames()))
+        self.assertEqual(type(u''), type(seriesInfo.getFileName(0)))
+
+    def test_parseTimes(self):
+        times = parseTimes(['100003.5', '10:00:03.250000', '100004 ', '20160101235959', '20160102000001.5+0100'])
+
+        np.testing.assert_allclose([36003.5, 36003.25, 36004.0], times[:3])
+        self.assertEqual(2.5, times[4] - times[3])
+        # an unusual string is parsed on its own, still in seconds
+        np.testing.assert_allclose([36003.5, 36004.0], parseTimes(['100003.5', ' 100004']))
+        self.assertRaises(ValueError, parseTimes, ['100003.5', 'unknown'])
+
+    def test_sortAndDimensions(self):
+        nz, nt = 3, 4
+        fileInfo = [['IM%i_%i' % (z, t), '1000%02i.0' % t, 10.0*z, 0] for t in range(0, nt) for z in range(0, nz)]
+        seriesInfo = SeriesInfo.fromFileInfo(fileInfo[::-1])
+
+        self.assertEqual((nz, nt), seriesInfo.getDimensions())
+        self.assertEqual(['IM%i_%i' % (z, t) for z in range(0, nz) for t in range(0, nt)], seriesInfo.getFileNames())
+        self.assertEqual('IM0_1', seriesInfo.getFileName(1))
+        restored = SeriesInfo.fromDict(seriesInfo.toDict())
+        self.assertEqual(seriesInfo.getFileNames(), restored.getFileNames())
+        np.testing.assert_array_equal(seriesInfo.times, restored.times)
+
+        updated = SeriesInfo.fromFileInfo(fileInfo[:6]).updated(fileInfo[6:])
+        self.assertEqual(seriesInfo.getFileNames(), updated.getFileNames())
+
+if __name__ == "__main__":
+    unittest.main()
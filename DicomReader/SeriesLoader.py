@@ -0,0 +1,92 @@
+__author__ = 'medabana'
+
+import logging
+from PySide import QtCore
+
+from DicomReader.PatientDirectoryReader import SeriesLoadCancelled
+
+
+class SeriesLoader(QtCore.QObject):
+    """ Reads the image data for a series in a worker thread so that the GUI stays responsive.
+
+    Move the loader to a QThread and connect the thread's started signal to run. The signals are delivered to the
+    GUI thread, so the partial series can be displayed while the rest of the files are read.
+    """
+    partialDataReady = QtCore.Signal(object)
+    headerProgress = QtCore.Signal(int, int)
+    progress = QtCore.Signal(int, int)
+    loaded = QtCore.Signal(object)
+    cancelled = QtCore.Signal()
+    failed = QtCore.Signal(str)
+
+    def __init__(self, seriesReader, protName, numUpdates=100, mapGenerator=None):
+        """
+        :param seriesReader: PatientDirectoryReader
+        :param protName: str
+        :param numUpdates: int
+        Maximum number of progress signals sent while reading the series.
+        :param mapGenerator: MapGenerator
+        If given, the images are added to an accumulator from it as they are read, which is left in accumulator to
+        pass to MapGenerator.setDynamics with the series.
+        """
+        super(SeriesLoader, self).__init__()
+        self._logger = logging.getLogger(__name__)
+        self._seriesReader = seriesReader
+        self._protName = protName
+        self._mapGenerator = mapGenerator
+        self.accumulator = None
+        self._numUpdates = numUpdates
+        self._cancel = False
+        self._seriesData = None
+
+    def cancel(self):
+        """ Stop reading the series after the file being read. The cancelled signal is sent when it stops. """
+        self._cancel = True
+
+    def run(self):
+        """ Read the series, sending headerProgress as the file headers are read, partialDataReady once the series
+        array is allocated, then progress as the files are read and finally loaded, cancelled or failed.
+
+        A series that was read is written to the disk cache of the reader, if it has one, after loaded is sent.
+        """
+        try:
+            onImageRead = self._addImage if self._mapGenerator is not None else None
+            data = self._seriesReader.getImageData(self._protName, self._reportProgress, onImageRead,
+                                                   self._reportHeaderProgress, deferDiskCache=True)
+        except SeriesLoadCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            self._logger.exception('failed to load %s' % self._protName)
+            self.failed.emit(str(e))
+            return
+        self.loaded.emit(data)
+        try:
+            self._seriesReader.saveToDiskCache(self._protName)
+        except Exception:
+            self._logger.exception('failed to write %s to the disk cache' % self._protName)
+
+    def _addImage(self, index, seriesData):
+        """ onImageRead function passed to getImageData, adding each image to the accumulator. Runs in the worker
+        thread.
+        """
+        if self.accumulator is None:
+            # made once the first image is read, when the headers have been sorted, so the number of timepoints is
+            # known without reading them for a series in the disk cache
+            nt = self._seriesReader.getSequenceParameters(self._protName)[3]
+            self.accumulator = self._mapGenerator.createAccumulator(nt)
+        self.accumulator.addImage(index, seriesData)
+
+    def _reportHeaderProgress(self, numRead, numFiles):
+        """ Header progress function passed to getImageData. Runs in the worker thread. """
+        self.headerProgress.emit(numRead, numFiles)
+        return not self._cancel
+
+    def _reportProgress(self, numRead, numFiles, seriesData):
+        """ Progress function passed to getImageData. Runs in the worker thread. """
+        if self._seriesData is None:
+            self._seriesData = seriesData
+            self.partialDataReady.emit(seriesData)
+        if numRead == numFiles or numRead % max(1, numFiles // self._numUpdates) == 0:
+            self.progress.emit(numRead, numFiles)
+        return not self._cancel
@@ -0,0 +1,137 @@
+__author__ = 'medabana'
+
+import json
+import logging
+import os
+import sqlite3
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER,
+                                  fileType TEXT, protName TEXT, suid TEXT, time REAL);
+CREATE TABLE IF NOT EXISTS dicomdirs (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, series TEXT);
+"""
+
+
+class StudyIndex(object):
+    """ Persistent record of the series information read from study directories.
+
+    Entries are keyed by the absolute path, modification time and size of the file, so a file that is changed or
+    replaced is read again while the rest of the study is loaded from the index. Text is stored and returned as
+    UTF-8 str, and unicode paths are encoded the same way before they are looked up.
+    """
+    def __init__(self, indexFile=None):
+        """
+        :param indexFile: str
+        Path of the SQLite index file. Defaults to studyIndex.sqlite in ~/.DceMrReader.
+        """
+        self._logger = logging.getLogger(__name__)
+        if indexFile is None:
+            indexFile = os.path.join(os.path.expanduser('~'), '.DceMrReader', 'studyIndex.sqlite')
+        indexDir = os.path.dirname(os.path.abspath(indexFile))
+        if not os.path.exists(indexDir):
+            os.makedirs(indexDir)
+        self._connection = sqlite3.connect(indexFile)
+        # return text as str, as read from the DICOM files
+        self._connection.text_factory = str
+        self._connection.executescript(_schema)
+
+    def close(self):
+        """ Close the index file. """
+        self._connection.close()
+
+    def getDicomDirSeries(self, fileNm):
+        """ Return the series information stored for a DICOMDIR file if the file has not changed.
+
+        :param fileNm: str
+        Path of the DICOMDIR file.
+        :return: dict or None
+        The series information passed to setDicomDirSeries, None if there is no up to date entry.
+        """
+        path, mtime, size = _fileKey(fileNm)
+        row = self._connection.execute('SELECT mtime, size, series FROM dicomdirs WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != mtime or row[1] != size:
+            return None
+        return _asStr(json.loads(row[2]))
+
+    def getSeriesRecords(self, fileNames):
+        """ Return the stored series records for the files that have not changed since they were indexed.
+
+        :param fileNames: list of str
+        :return: dict
+        Series record, as returned by RecursiveDirectoryReader.readSeriesRecordAndSkipReason, for each up to date file.
+        Files which are not images have a record of None.
+        """
+        if not fileNames:
+            return {}
+        stored = {}
+        prefix = os.path.commonprefix([_pathKey(fileNm) for fileNm in fileNames])
+        rows = self._connection.execute('SELECT path, mtime, size, fileType, protName, suid, time FROM files '
+                                        'WHERE path >= ? AND path < ?', _prefixRange(prefix))
+        for row in rows:
+            stored[row[0]] = row[1:]
+        records = {}
+        for fileNm in fileNames:
+            path, mtime, size = _fileKey(fileNm)
+            if path in stored and stored[path][0] == mtime and stored[path][1] == size:
+                fileType, protName, suid, time = stored[path][2:]
+                records[fileNm] = None if fileType is None else [fileType, protName, suid, time]
+        return records
+
+    def setDicomDirSeries(self, fileNm, series):
+        """ Store the series information read from a DICOMDIR file.
+
+        :param fileNm: str
+        Path of the DICOMDIR file.
+        :param series: dict
+        JSON serialisable series information.
+        """
+        self._connection.execute('INSERT OR REPLACE INTO dicomdirs VALUES (?, ?, ?, ?)',
+                                 _fileKey(fileNm) + (json.dumps(series),))
+        self._connection.commit()
+
+    def setSeriesRecords(self, records):
+        """ Store the series records for files.
+
+        :param records: dict
+        Series record, or None if the file is not an image, for each file name.
+        """
+        rows = []
+        for fileNm, record in records.items():
+            if record is None:
+                record = [None, None, None, None]
+            rows.append(_fileKey(fileNm) + tuple(record))
+        self._connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self._connection.commit()
+        self._logger.info('indexed %i files' % len(rows))
+
+
+def _asStr(value):
+    """ Return the JSON value with its unicode text encoded as UTF-8 str, matching the text read from the files. """
+    if isinstance(value, dict):
+        return dict((_asStr(key), _asStr(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_asStr(item) for item in value]
+    if not isinstance(value, str) and isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def _fileKey(fileNm):
+    """ Return the absolute path, modification time and size of a file. """
+    stat = os.stat(fileNm)
+    return _pathKey(fileNm), stat.st_mtime, stat.st_size
+
+
+def _pathKey(fileNm):
+    """ Return the absolute path of a file as str, encoding unicode paths as UTF-8 to match the stored paths. """
+    path = os.path.abspath(fileNm)
+    if not isinstance(path, str):
+        path = path.encode('utf-8')
+    return path
+
+
+def _prefixRange(prefix):
+    """ Return the range of strings that start with the prefix, for use in a SQL range query. """
+    if not prefix:
+        return '', '\xff'
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,270 @@
+__author__ = 'medabana'
+
+import os
+import struct
+import numpy as np
+import dicom.UID
+from dicom.dataset import Dataset, FileDataset
+from dicom.sequence import Sequence
+
+MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4'
+ENHANCED_MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4.1'
+MEDIA_STORAGE_DIRECTORY_STORAGE = '1.2.840.10008.1.3.10'
+EXPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2.1'
+
+
+class SyntheticStudy(object):
+    """ Writes small synthetic DCE-MRI studies to disk for the reader tests and benchmarks.
+
+    The files are written in a shuffled order so that the readers have to sort them by slice and time.
+    """
+    def __init__(self, dirNm, seed=0):
+        self._dirNm = dirNm
+        self._random = np.random.RandomState(seed)
+        self._numSeries = 0
+
+    def expectedData(self, nz, nt, ny, nx, seriesNum):
+        """ Return the [nt x nz, ny, nx] array the readers should produce for a series.
+
+        Each image is filled with a value that encodes its slice and timepoint.
+        """
+        data = np.zeros([nz*nt, ny, nx], np.uint16)
+        for z in range(0, nz):
+            for t in range(0, nt):
+                data[z*nt + t, :, :] = self._imageValue(seriesNum, z, t) + np.arange(nx, dtype=np.uint16)
+        return data
+
+    def writeDicomSeries(self, protName, nz, nt, ny=8, nx=8, subDir=''):
+        """ Write a series of single frame MR Image Storage files.
+
+        :return: int
+        The series number used to generate the pixel values.
+        """
+        self._numSeries += 1
+        seriesNum = self._numSeries
+        outDir = os.path.join(self._dirNm, subDir)
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        suid = '1.2.826.0.1.3680043.2.1125.%i' % seriesNum
+        data = self.expectedData(nz, nt, ny, nx, seriesNum)
+        order = self._random.permutation(nz*nt)
+        for fileNum, index in enumerate(order):
+            z, t = divmod(index, nt)
+            ds = self._newDataset(True)
+            ds.SOPClassUID = MR_IMAGE_STORAGE
+            ds.AcquisitionTime = '%06i.%06i' % (100000 + seriesNum*100 + t, 0)
+            ds.SeriesDescription = protName
+            ds.SeriesInstanceUID = suid
+            ds.SliceLocation = '%.1f' % (10.0*z)
+            ds.InstanceNumber = str(index + 1)
+            self._setPixelData(ds, data[index, :, :])
+            fileNm = os.path.join(outDir, 'IM%i_%05i' % (seriesNum, fileNum))
+            ds.save_as(fileNm)
+        return seriesNum
+
+    def writeDicomDir(self, numPatients, numStudies, numSeries, numImages, fileNm='DICOMDIR'):
+        """ Write a DICOMDIR file of PATIENT, STUDY, SERIES and IMAGE records, without the image files.
+
+        The file is written as raw explicit VR little endian bytes with the directory record offsets filled in, so
+        that large directories can be written quickly. Each study also has a PRIVATE record, which holds no series.
+        :return: list
+        [protName, suid, seriesTime, fileNames] for each series in directory order.
+        """
+        series = []
+        records = []
+
+        def addRecord(recordType, elements, parent=None):
+            records.append({'type': recordType, 'elements': elements, 'children': []})
+            if parent is not None:
+                records[parent]['children'].append(len(records) - 1)
+            return len(records) - 1
+
+        roots = []
+        for p in range(0, numPatients):
+            patient = addRecord('PATIENT', [(0x00100010, 'PN', 'Patient^%i' % p), (0x00100020, 'LO', 'P%i' % p)])
+            roots.append(patient)
+            for s in range(0, numStudies):
+                study = addRecord('STUDY', [(0x00080020, 'DA', '20160101'), (0x00080030, 'TM', '100000'),
+                                            (0x0020000D, 'UI', '1.2.826.0.1.3680043.2.1125.%i.%i' % (p, s))], patient)
+                for n in range(0, numSeries):
+                    protName = 'series %i' % n
+                    suid = '1.2.826.0.1.3680043.2.1125.%i.%i.%i' % (p, s, n)
+                    seriesTime = '%06i' % (100000 + n)
+                    seriesRecord = addRecord('SERIES', [(0x00080031, 'TM', seriesTime), (0x00080060, 'CS', 'MR'),
+                                                        (0x00181030, 'LO', protName), (0x0020000E, 'UI', suid),
+                                                        (0x00200011, 'IS', str(n + 1))], study)
+                    fileNames = []
+                    for i in range(0, numImages):
+                        fileID = ['DICOM', 'P%i' % p, 'S%i' % s, 'SE%i' % n, 'IM%i' % i]
+                        fileNames.append(os.path.join(*fileID))
+                        addRecord('IMAGE', [(0x00041500, 'CS', '\\'.join(fileID)),
+                                            (0x00041510, 'UI', MR_IMAGE_STORAGE),
+                                            (0x00041511, 'UI', suid + '.%i' % i),
+                                            (0x00041512, 'UI', EXPLICIT_VR_LITTLE_ENDIAN),
+                                            (0x00200013, 'IS', str(i + 1))], seriesRecord)
+                    series.append([protName, suid, seriesTime, fileNames])
+                addRecord('PRIVATE', [(0x00041432, 'UI', '1.2.826.0.1.3680043.2.1125.0')], study)
+
+        fileMeta = ''.join([_encodeElement(0x00020001, 'OB', '\0\1'),
+                            _encodeElement(0x00020002, 'UI', MEDIA_STORAGE_DIRECTORY_STORAGE),
+                            _encodeElement(0x00020003, 'UI', '1.2.826.0.1.3680043.2.1125.0.1'),
+                            _encodeElement(0x00020010, 'UI', EXPLICIT_VR_LITTLE_ENDIAN),
+                            _encodeElement(0x00020012, 'UI', '1.2.826.0.1.3680043.2.1125.1')])
+        fileMeta = _encodeElement(0x00020000, 'UL', len(fileMeta)) + fileMeta
+        # the records are stored depth first after the header, whose length does not depend on the offsets
+        headerLength = 128 + 4 + len(fileMeta) + len(self._encodeDicomDirHeader(0, 0))
+        offsets = []
+        offset = headerLength
+        for record in records:
+            offsets.append(offset)
+            offset += len(self._encodeDirectoryRecord(record, 0, 0))
+
+        def getNext(siblings, i):
+            return offsets[siblings[i + 1]] if i + 1 < len(siblings) else 0
+
+        encoded = [None] * len(records)
+        for siblings in [roots] + [record['children'] for record in records]:
+            for i, r in enumerate(siblings):
+                lower = offsets[records[r]['children'][0]] if records[r]['children'] else 0
+                encoded[r] = self._encodeDirectoryRecord(records[r], getNext(siblings, i), lower)
+        with open(os.path.join(self._dirNm, fileNm), 'wb') as f:
+            f.write('\0' * 128 + 'DICM' + fileMeta)
+            f.write(self._encodeDicomDirHeader(offsets[roots[0]], offsets[roots[-1]]))
+            f.write(''.join(encoded))
+            f.write(struct.pack('<HHL', 0xFFFE, 0xE0DD, 0))
+        return series
+
+    def writeEnhancedSeries(self, protName, nz, nt, ny=8, nx=8, subDir=''):
+        """ Write a series as a single Enhanced MR Image Storage file.
+
+        The frames are written in acquisition order, all the slices of the first timepoint followed by all the
+        slices of the next, with DimensionIndexValues of [stack, timepoint, slice].
+        :return: int
+        The series number used to generate the pixel values.
+        """
+        self._numSeries += 1
+        seriesNum = self._numSeries
+        outDir = os.path.join(self._dirNm, subDir)
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        data = self.expectedData(nz, nt, ny, nx, seriesNum)
+        ds = self._newDataset(True)
+        ds.file_meta.MediaStorageSOPClassUID = ENHANCED_MR_IMAGE_STORAGE
+        ds.SOPClassUID = ENHANCED_MR_IMAGE_STORAGE
+        ds.AcquisitionDateTime = '20160101%06i.000000' % (100000 + seriesNum*100)
+        ds.SeriesDescription = protName
+        ds.SeriesInstanceUID = '1.2.826.0.1.3680043.2.1125.%i' % seriesNum
+        ds.NumberOfFrames = nz*nt
+        frames = []
+        for t in range(0, nt):
+            for z in range(0, nz):
+                frameContent = Dataset()
+                frameContent.FrameAcquisitionDateTime = '20160101%06i.000000' % (100000 + seriesNum*100 + t)
+                frameContent.DimensionIndexValues = [1, t + 1, z + 1]
+                framePosition = Dataset()
+                framePosition.ImagePositionPatient = [0.0, 0.0, 10.0*z]
+                frame = Dataset()
+                frame.FrameContentSequence = Sequence([frameContent])
+                frame.PlanePositionSequence = Sequence([framePosition])
+                frames.append(frame)
+        ds.PerFrameFunctionalGroupsSequence = Sequence(frames)
+        frameOrder = np.arange(nz*nt).reshape(nz, nt).T.ravel()
+        self._setPixelData(ds, data[0, :, :])
+        ds.PixelData = data[frameOrder, :, :].astype('<u2').tostring()
+        fileNm = os.path.join(outDir, 'EN%i' % seriesNum)
+        ds.save_as(fileNm)
+        return seriesNum
+
+    def writeNemaSeries(self, protName, nz, nt, ny=8, nx=8, subDir=''):
+        """ Write a series as ACR-NEMA 2.0 files, with no preamble and implicit VR.
+
+        :return: int
+        The series number used to generate the pixel values.
+        """
+        self._numSeries += 1
+        seriesNum = self._numSeries
+        outDir = os.path.join(self._dirNm, subDir)
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        suid = '1.2.826.0.1.3680043.2.1125.%i' % seriesNum
+        data = self.expectedData(nz, nt, ny, nx, seriesNum)
+        order = self._random.permutation(nz*nt)
+        for fileNum, index in enumerate(order):
+            z, t = divmod(index, nt)
+            ds = self._newDataset(False)
+            ds.RecognitionCode = 'ACR-NEMA 2.0'
+            ds.ContentTime = '10:%02i:%02i.000000' % (seriesNum, t)
+            ds.SeriesDescription = protName
+            # NEMA series instance uids carry a per image suffix which the reader strips
+            ds.SeriesInstanceUID = suid + '.%02i' % (z % 100)
+            ds.SliceLocation = '%.1f' % (10.0*z)
+            self._setPixelData(ds, data[index, :, :])
+            del ds.SamplesPerPixel
+            fileNm = os.path.join(outDir, 'NEMA%i_%05i' % (seriesNum, fileNum))
+            ds.save_as(fileNm)
+        return seriesNum
+
+    def writeJunkFile(self, name, numBytes=1024):
+        """ Write a file that is not DICOM, such as a thumbnail or report. """
+        with open(os.path.join(self._dirNm, name), 'wb') as f:
+            f.write(self._random.bytes(numBytes))
+
+    def _encodeDicomDirHeader(self, firstRootOffset, lastRootOffset):
+        """ Return the DICOMDIR elements before the directory records, up to the start of DirectoryRecordSequence. """
+        return ''.join([_encodeElement(0x00041130, 'CS', ''),
+                        _encodeElement(0x00041200, 'UL', firstRootOffset),
+                        _encodeElement(0x00041202, 'UL', lastRootOffset),
+                        _encodeElement(0x00041212, 'US', 0),
+                        struct.pack('<HH2sHL', 0x0004, 0x1220, 'SQ', 0, 0xFFFFFFFF)])
+
+    def _encodeDirectoryRecord(self, record, nextOffset, lowerOffset):
+        """ Return a directory record as an undefined length item. """
+        elements = [_encodeElement(0x00041400, 'UL', nextOffset),
+                    _encodeElement(0x00041410, 'US', 0xFFFF),
+                    _encodeElement(0x00041420, 'UL', lowerOffset),
+                    _encodeElement(0x00041430, 'CS', record['type'])]
+        elements += [_encodeElement(*element) for element in record['elements']]
+        return (struct.pack('<HHL', 0xFFFE, 0xE000, 0xFFFFFFFF) + ''.join(elements) +
+                struct.pack('<HHL', 0xFFFE, 0xE00D, 0))
+
+    def _imageValue(self, seriesNum, z, t):
+        return 1000*seriesNum + 100*z + t
+
+    def _newDataset(self, withPreamble):
+        fileMeta = Dataset()
+        if withPreamble:
+            fileMeta.MediaStorageSOPClassUID = MR_IMAGE_STORAGE
+            fileMeta.MediaStorageSOPInstanceUID = dicom.UID.generate_uid()
+            fileMeta.ImplementationClassUID = '1.2.826.0.1.3680043.2.1125.1'
+            fileMeta.TransferSyntaxUID = dicom.UID.ImplicitVRLittleEndian
+            ds = FileDataset('', {}, file_meta=fileMeta, preamble=b'\0' * 128)
+        else:
+            ds = FileDataset('', {}, file_meta=fileMeta, preamble=None)
+        ds.is_little_endian = True
+        ds.is_implicit_VR = True
+        return ds
+
+    def _setPixelData(self, ds, image):
+        ny, nx = image.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.Rows = ny
+        ds.Columns = nx
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.PixelData = image.astype('<u2').tostring()
+
+
+def _encodeElement(tag, vr, value):
+    """ Return an explicit VR little endian data element. """
+    if vr == 'UL':
+        value = struct.pack('<L', value)
+    elif vr == 'US':
+        value = struct.pack('<H', value)
+    elif len(value) % 2:
+        value += '\0' if vr == 'UI' else ' '
+    if vr == 'OB':
+        return struct.pack('<HH2sHL', tag >> 16, tag & 0xFFFF, vr, 0, len(value)) + value
+    return struct.pack('<HH2sH', tag >> 16, tag & 0xFFFF, vr, len(value)) + value
@@ -1,12 +1,21 @@
 __author__ = 'medabana'
 
+import argparse
 import sys
 from PySide import QtGui
 
 from ControlMainWindow import ControlMainWindow
+from DicomReader.DiskSeriesCache import DiskSeriesCache
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    mySW = ControlMainWindow()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seriesCache', help='directory to keep decoded series in, off unless given')
+    parser.add_argument('--seriesCacheGB', type=float, default=20, help='size limit of the series cache')
+    args, qtArgs = parser.parse_known_args()
+    diskSeriesCache = None
+    if args.seriesCache:
+        diskSeriesCache = DiskSeriesCache(args.seriesCache, int(args.seriesCacheGB * 1024**3))
+    app = QtGui.QApplication(sys.argv[:1] + qtArgs)
+    mySW = ControlMainWindow(diskSeriesCache=diskSeriesCache)
     mySW.show()
     sys.exit(app.exec_())